@@ -2,8 +2,17 @@
 
 __version__ = "0.3.0"
 
+import serial
+
+# pyserial finds the 'sim://' handler in serprog/urlhandler/protocol_sim.py,
+# for `serial.serial_for_url` as soon as any serprog module is imported
+if 'serprog.urlhandler' not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append('serprog.urlhandler')
+
 import serprog.loader
+import serprog.aioloader
 
 Loader = serprog.loader.Loader
+AsyncLoader = serprog.aioloader.AsyncLoader
 
-__all__ = ['Loader']
+__all__ = ['Loader', 'AsyncLoader']
@@ -34,6 +34,36 @@ def run():
         else:
             business.do_prog(args)
 
+    elif args.subcmd == 'compile':
+        if cmdline.chk_compile_args(args) is False:
+            sys.exit(1)
+        else:
+            business.do_compile(args)
+
+    elif args.subcmd == 'replay':
+        if cmdline.chk_replay_args(args) is False:
+            sys.exit(1)
+        else:
+            business.do_replay(args)
+
+    elif args.subcmd == 'simulate':
+        if cmdline.chk_simulate_args(args) is False:
+            sys.exit(1)
+        else:
+            business.do_simulate(args)
+
+    elif args.subcmd == 'bench-host':
+        if cmdline.chk_bench_host_args(args) is False:
+            sys.exit(1)
+        else:
+            business.do_bench_host(args)
+
+    elif args.subcmd == 'link-test':
+        if cmdline.chk_link_test_args(args) is False:
+            sys.exit(1)
+        else:
+            business.do_link_test(args)
+
     else:
         parser.print_help()
 
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+""" asyncio Loader API
+AsyncCommandTrnasHandler and SerialTransport are internal objects of AsyncLoader.
+
+`AsyncLoader` runs the steps of `serprog.loader.Loader` over a transport
+watched by the event loop, so the commands, retries, timing profile,
+metrics and checkpoint are the same. Nothing blocks the event loop on the
+port, so one loop can program many ports at once:
+
+    async def prog(port):
+        ser = serial.Serial(port, 115200)
+        l = AsyncLoader(ser, is_flash_prog=True, flash_file='app.hex')
+        await l.program()
+        ser.close()
+
+    await asyncio.gather(*[prog(p) for p in ports])
+"""
+
+import asyncio
+import collections
+import inspect
+import math
+import os
+import time
+import serial
+
+from serprog import bootprotocol
+from serprog import exceptions
+from serprog import loader
+
+__all__ = ['AsyncLoader']
+
+
+class SerialTransport():
+    """ Non-blocking packet transport over an opened serial object, asyncio
+    version of `serprog.loader.SerialTransport`.
+
+    On POSIX the file descriptor of the port is watched by the event loop.
+    Other serial objects (Windows ports, pyserial URLs) are read by a task
+    in the default executor instead, and written there, with the read
+    timeout of the port set to `POLL` until `close` sets it back. When the
+    port is closed or gone, reading stops and the waiting `get_packet` fails.
+    """
+
+    # Seconds a read in the executor blocks, it notices `close` as often.
+    POLL = 0.05
+
+    def __init__(self, ser: serial.Serial, loop: asyncio.AbstractEventLoop = None):
+        """ Initialization
+        Args:
+            ser (serial.Serial): The serial object used for communication must be opened by the outside first.
+            loop (asyncio.AbstractEventLoop, optional): The event loop. The default is the running loop.
+        """
+        self._ser = ser
+        self._loop = loop if loop is not None else asyncio.get_running_loop()
+        self._pd = bootprotocol.Decoder()
+        self._packets = collections.deque()    # (packet, time it was received)
+        self._waiter = None                     # future of the waiting `get_packet`
+        self._is_closed = False
+        self._fd = None
+        self._reader = None
+        self._timeout = None                    # read timeout of the caller, set back by `close`
+
+        if os.name == 'posix' and isinstance(ser, serial.Serial):
+            self._fd = ser.fileno()
+            self._loop.add_reader(self._fd, self._on_readable)
+        else:
+            self._timeout = ser.timeout
+            ser.timeout = self.POLL
+            self._reader = self._loop.create_task(self._read_loop())
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            # the port is gone, e.g. the USB adapter is unplugged
+            data = b''
+        if not data:
+            self.close()
+            return
+        self._received(data)
+
+    async def _read_loop(self):
+        try:
+            while not self._is_closed:
+                data = await self._loop.run_in_executor(None, self._read_chunk)
+                if data:
+                    self._received(data)
+        except Exception:
+            # the port is closed under the read, or gone
+            self.close()
+
+    def _read_chunk(self) -> bytes:
+        return self._ser.read(max(1, self._ser.in_waiting))
+
+    def _received(self, data: bytes):
+        now = time.monotonic()
+        packets = self._pd.feed(data)
+        if packets:
+            self._packets.extend([(packet, now) for packet in packets])
+            if self._waiter is not None and not self._waiter.done():
+                self._waiter.set_result(None)
+
+    async def write(self, data: bytes):
+        """ Write all of `data`.
+
+        Raises:
+            exceptions.ComuError: The port is closed.
+        """
+        if self._is_closed:
+            raise exceptions.ComuError
+        if self._fd is None:
+            await self._loop.run_in_executor(None, self._ser.write, data)
+            return
+
+        view = memoryview(data)
+        while view:
+            try:
+                n = os.write(self._fd, view)
+            except BlockingIOError:
+                n = 0
+            view = view[n:]
+            if view:
+                writable = self._loop.create_future()
+                self._loop.add_writer(self._fd, lambda: writable.done() or writable.set_result(None))
+                try:
+                    await writable
+                finally:
+                    self._loop.remove_writer(self._fd)
+
+    async def get_packet(self, timeout: float) -> tuple:
+        """ Wait for the next packet.
+
+        Args:
+            timeout (float): Seconds to wait, `math.inf` waits until a packet arrives.
+
+        Raises:
+            exceptions.ComuError: Timeout, or the port is closed.
+
+        Returns:
+            tuple: (bootprotocol.Packet, `time.monotonic()` it was received)
+        """
+        if not self._packets:
+            if self._is_closed:
+                raise exceptions.ComuError
+            self._waiter = self._loop.create_future()
+            try:
+                await asyncio.wait_for(self._waiter, None if timeout == math.inf else timeout)
+            except asyncio.TimeoutError:
+                raise exceptions.ComuError
+            finally:
+                self._waiter = None
+        return self._packets.popleft()
+
+    def clear(self):
+        """ Drop the bytes and packets received so far, the decoder starts over.
+        """
+        self._ser.reset_input_buffer()
+        self._pd = bootprotocol.Decoder()
+        self._packets.clear()
+
+    async def drain(self, delay: float):
+        """ `clear` after waiting `delay` seconds for late bytes.
+        """
+        await asyncio.sleep(delay)
+        self.clear()
+
+    def close(self):
+        """ Stop reading the port, the waiting `get_packet` fails. The read
+        timeout of the port is set back. The serial object is closed by the outside.
+        """
+        if self._is_closed:
+            return
+        self._is_closed = True
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+        if self._reader is not None:
+            if not self._reader.done():
+                self._reader.cancel()
+            try:
+                self._ser.timeout = self._timeout
+            except (ValueError, serial.SerialException):
+                # the port is gone
+                pass
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_exception(exceptions.ComuError())
+
+
+class AsyncCommandTrnasHandler(loader.CommandTrnasHandler):
+    """ Manager of Command Response, coroutine version of `serprog.loader.CommandTrnasHandler`.
+
+    The commands are the same, `run` awaits the calls of the transport, so
+    the functions `cmd_xxx` return coroutines.
+    """
+
+    async def run(self, steps):
+        """ Run a generator of transport calls, see `serprog.loader.CommandTrnasHandler.run`.
+        """
+        res, error = None, None
+        while True:
+            try:
+                call = steps.send(res) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            res, error = None, None
+            try:
+                res = getattr(self._transport, call[0])(*call[1:])
+                if inspect.isawaitable(res):
+                    res = await res
+            except Exception as e:
+                res, error = None, e
+
+
+class AsyncLoader(loader.Loader):
+    """ Programming transaction management object, asyncio version of `serprog.loader.Loader`.
+
+    The arguments and steps are the ones of `serprog.loader.Loader`. The
+    constructor does no I/O, `prepare` loads the images and detects the
+    device, `do_step` runs a step and `program` all of them. A failed or
+    cancelled step saves the checkpoint, like `serprog.loader.Loader.do_step`.
+
+    Raises:
+        exceptions.CheckDeviceError: Device can't be dectected.
+        exceptions.DeviceTypeError: The detected device is a different type than the specified device.
+        FileNotFoundError: Can't find flash or eeprom programming file (image).
+        exceptions.ComuError: Communication error.
+        exceptions.FlashIsNotIhexError: The flash programming file (image) is not in a supported format.
+        exceptions.EepromIsNotIhexError: The eeprom programming file (image) is not in a supported format.
+        exceptions.ImageRangeError: The flash image is not in the application area of the device.
+        exceptions.ArtifactHashError: A page of an artifact does not match its hash.
+        exceptions.SectorSizeError: The application area of the device does not start at a sector.
+    """
+
+    _transport   = None
+    _is_prepared = bool()
+
+    def _open(self):
+        # done by `prepare`, in the event loop
+        pass
+
+    async def prepare(self):
+        """ Preparation before programming, done by `program` if not called before.
+
+        1. Load the flash, external flash and eeprom images, in the default executor
+        2. Detection device, erase plan and checkpoint, see `serprog.loader.Loader._prepare`
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._prepare_images)
+        if self._transport is None:
+            self._transport = SerialTransport(self._ser, loop)
+            self._cth = AsyncCommandTrnasHandler(self._ser, self._transport)
+        await self._cth.run(self._prepare_steps())
+        self._is_prepared = True
+
+    async def do_step(self):
+        stage = self.stage
+        try:
+            await self._cth.run(self._step())
+        except BaseException:
+            # keep what is acknowledged, for a resume, also when cancelled
+            self._save_checkpoint()
+            raise
+        self._step_done(stage)
+
+    async def program(self):
+        """ Run the whole programming transaction.
+
+        Flash, external flash, eeprom, external flash boot and end, in the
+        same order as `serprog.loader.Loader`.
+        """
+        if not self._is_prepared:
+            await self.prepare()
+
+        try:
+            while not self.is_finished:
+                await self.do_step()
+        finally:
+            self.close()
+
+    def close(self):
+        """ Release the event loop resources. Called by `program`, the serial object is closed by the outside.
+        """
+        if self._transport is not None:
+            self._transport.close()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Precompiled page image.
+
+An artifact holds an image which is already padded and cut to pages, so
+programming it needs no parsing. It is written by `serprog compile` and
+memory mapped when loaded.
+
+File layout, all integers little endian:
+
+    header   64 bytes   magic, version, page size, page count,
+                        data size, payload offset
+    index    40 bytes   address (8) and SHA-256 of the page data (32),
+             per page   in address order
+    payload  page size  the page data, in the order of the index,
+             per page   starting at a multiple of 4096
+
+The hash of a page is checked when the page is first read, so a corrupted
+artifact is not programmed. Hashing is much faster than the serial link.
+"""
+
+from serprog import exceptions
+
+import hashlib
+import mmap
+import os
+import struct
+
+MAGIC = b'SPRGIMG\x00'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sHHIIQQ')    # magic, version, reserved, pgsz, count, size, payload offset
+_HEADER_SIZE = 64
+_ENTRY = struct.Struct('<Q32s')         # address, sha256 of the page
+_ALIGN = 4096
+
+
+class Pages():
+    """ Read only sequence of the pages of an artifact.
+
+    Pages are dicts of 'address' and 'data' like the pages of
+    `serprog.ihex.cut_to_pages`, made when they are indexed. 'data' is a
+    view of the mapped file. The hash of each page is checked the first
+    time it is indexed.
+
+    Raises:
+        serprog.exceptions.ArtifactHashError: An indexed page does not match its hash.
+    """
+    __slots__ = ('_filename', '_index', '_payload', '_pgsz', '_count', '_checked')
+
+    def __init__(self, filename: str, index: memoryview, payload: memoryview, pgsz: int, count: int):
+        self._filename = filename
+        self._index    = index
+        self._payload  = payload
+        self._pgsz     = pgsz
+        self._count    = count
+        self._checked  = bytearray(count)   # 1 for the pages whose hash matched
+
+    def __len__(self):
+        return self._count
+
+    def _page(self, idx: int) -> tuple:
+        """ (address, data, SHA-256 of the index) of page `idx`, not checked. """
+        address, digest = _ENTRY.unpack_from(self._index, idx * _ENTRY.size)
+        offset = idx * self._pgsz
+        return address, self._payload[offset : offset + self._pgsz], digest
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._count))]
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError('page index out of range')
+        address, data, digest = self._page(idx)
+        if not self._checked[idx]:
+            if hashlib.sha256(data).digest() != digest:
+                raise exceptions.ArtifactHashError(self._filename, address)
+            self._checked[idx] = 1
+        return {'address': address, 'data': data}
+
+    def __iter__(self):
+        for idx in range(self._count):
+            yield self[idx]
+
+    def digest(self, idx: int) -> bytes:
+        """ SHA-256 of page `idx` stored in the index. """
+        return _ENTRY.unpack_from(self._index, idx * _ENTRY.size)[1]
+
+
+def is_artifact(filename: str) -> bool:
+    """ Check the file starts with the artifact magic.
+
+    Args:
+        filename (str): The file to check.
+
+    Returns:
+        bool: True or False.
+    """
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write(filename: str, pages: list, pgsz: int, size: int):
+    """ Write pages to an artifact.
+
+    The file is written next to `filename` first and then renamed, so a
+    half written artifact is never used.
+
+    Args:
+        filename (str): The artifact to write.
+        pages (list): Pages of `pgsz` bytes in address order, e.g. from
+            `serprog.ihex.cut_to_pages`.
+        pgsz (int): page size, e.g. 256, 512.
+        size (int): Bytes of data of the image, without padding.
+    """
+    count = len(pages)
+    payload_offset = -(-(_HEADER_SIZE + count * _ENTRY.size) // _ALIGN) * _ALIGN
+
+    header = bytearray(payload_offset)
+    _HEADER.pack_into(header, 0, MAGIC, VERSION, 0, pgsz, count, size, payload_offset)
+    for i, page in enumerate(pages):
+        _ENTRY.pack_into(header, _HEADER_SIZE + i * _ENTRY.size,
+                         page['address'], hashlib.sha256(page['data']).digest())
+
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wb') as f:
+        f.write(header)
+        for page in pages:
+            f.write(page['data'])
+    os.replace(tmpname, filename)
+
+
+def load(filename: str) -> tuple:
+    """ Map an artifact.
+
+    Only the header is read, the pages are read and checked when they are indexed.
+
+    Args:
+        filename (str): The artifact to load.
+
+    Raises:
+        serprog.exceptions.ImageFormatError: Not an artifact, an unknown
+            version or a truncated file.
+
+    Returns:
+        tuple: (pgsz, size, Pages)
+    """
+    with open(filename, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            raise exceptions.ImageFormatError(filename)
+    view = memoryview(mm)
+
+    if len(view) < _HEADER_SIZE:
+        raise exceptions.ImageFormatError(filename)
+    magic, version, _, pgsz, count, size, payload_offset = _HEADER.unpack_from(view)
+    if magic != MAGIC or version != VERSION or pgsz == 0 or \
+            payload_offset < _HEADER_SIZE + count * _ENTRY.size or \
+            len(view) < payload_offset + count * pgsz:
+        raise exceptions.ImageFormatError(filename)
+
+    index = view[_HEADER_SIZE : _HEADER_SIZE + count * _ENTRY.size]
+    payload = view[payload_offset : payload_offset + count * pgsz]
+    return pgsz, size, Pages(filename, index, payload, pgsz, count)
+
+
+def verify(filename: str) -> list:
+    """ Compare the pages of an artifact with their hashes.
+
+    Args:
+        filename (str): The artifact to check.
+
+    Raises:
+        serprog.exceptions.ImageFormatError:
+
+    Returns:
+        list: Indexes of the pages whose hash does not match.
+    """
+    _, _, pages = load(filename)
+    res = []
+    for i in range(len(pages)):
+        _, data, digest = pages._page(i)
+        if hashlib.sha256(data).digest() != digest:
+            res.append(i)
+    return res
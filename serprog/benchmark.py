@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Host-side benchmarks of the programming pipeline.
+
+The image parser, the packet codec, and whole programmings against the
+simulated bootloader of `serprog.simulator`, so no board is needed.
+Run with `serprog bench-host` or `python -m serprog.benchmark`, the
+results can be written as JSON to compare releases.
+"""
+
+from serprog import bootprotocol
+from serprog import exceptions
+from serprog import ihex
+from serprog import loader
+
+import datetime
+import json
+import os
+import platform
+import random
+import serial
+import tempfile
+import time
+
+def _best_of(func, repeat: int) -> float:
+    """ Run `func` `repeat` times and return the fastest run in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_decoder(payload_size: int = 512, packets: int = 200,
+                  chunk_size: int = 4096, repeat: int = 5) -> dict:
+    """ Compare `Decoder.step` with `Decoder.feed` on a FLASH_READ like stream.
+
+    Args:
+        payload_size (int, optional): Data length of each packet. The default is 512.
+        packets (int, optional): Number of packets in the stream. The default is 200.
+        chunk_size (int, optional): Bytes per `feed` call. The default is 4096.
+        repeat (int, optional): Runs per method, the fastest is kept. The default is 5.
+
+    Returns:
+        dict: Stream size in bytes and MB/s of each method.
+    """
+    data = bytes(range(256)) * (payload_size // 256 + 1)
+    frame = bootprotocol.encode(bootprotocol.CMD.FLASH_READ, data[:payload_size])
+    stream = frame * packets
+
+    def run_step():
+        d = bootprotocol.Decoder()
+        count = 0
+        for ch in stream:
+            d.step(ch)
+            if d.isDone():
+                d.getPacket()
+                count += 1
+        assert count == packets
+
+    def run_feed():
+        d = bootprotocol.Decoder()
+        count = 0
+        for i in range(0, len(stream), chunk_size):
+            count += len(d.feed(stream[i:i + chunk_size]))
+        assert count == packets
+
+    size = len(stream)
+    return {
+        'bytes': size,
+        'step_MBps': size / _best_of(run_step, repeat) / 1e6,
+        'feed_MBps': size / _best_of(run_feed, repeat) / 1e6,
+    }
+
+def bench_encoder(payload_size: int = 512, packets: int = 2000, repeat: int = 5) -> dict:
+    """ Compare building FLASH_WRITE packets with `encode` and with `Encoder`.
+
+    Args:
+        payload_size (int, optional): Page size. The default is 512.
+        packets (int, optional): Number of pages. The default is 2000.
+        repeat (int, optional): Runs per method, the fastest is kept. The default is 5.
+
+    Returns:
+        dict: Microseconds per packet of each method.
+    """
+    buf = memoryview(bytes(range(256)) * (payload_size * packets // 256 + 1)).toreadonly()
+    pages = [buf[i * payload_size : (i + 1) * payload_size] for i in range(packets)]
+    cmd = bootprotocol.CMD.FLASH_WRITE
+
+    def run_encode():
+        for addr, page in enumerate(pages):
+            bootprotocol.encode(cmd, addr.to_bytes(4, 'little') + page)
+
+    def run_encoder():
+        pe = bootprotocol.Encoder()
+        for addr, page in enumerate(pages):
+            pe.encode(cmd, page, addr)
+
+    encode_s = _best_of(run_encode, repeat)
+    encoder_s = _best_of(run_encoder, repeat)
+    size = payload_size * packets
+    return {
+        'encode_us': encode_s / packets * 1e6,
+        'encoder_us': encoder_s / packets * 1e6,
+        'encode_MBps': size / encode_s / 1e6,
+        'encoder_MBps': size / encoder_s / 1e6,
+    }
+
+def write_ihex(filename: str, size: int, address: int = 0x00010000):
+    """ Write a synthetic ihex file of random data, 16 bytes per record.
+
+    Args:
+        filename (str): The file to write.
+        size (int): Bytes of data.
+        address (int, optional): Start address. The default is 0x00010000.
+    """
+    data = random.Random(size).randbytes(size)
+    lines = []
+    ela = None
+    for off in range(0, size, 16):
+        addr = address + off
+        if addr >> 16 != ela:
+            ela = addr >> 16
+            rec = bytes([2, 0, 0, 4]) + ela.to_bytes(2, 'big')
+            lines.append(':' + (rec + bytes([-sum(rec) & 0xFF])).hex().upper())
+        chunk = data[off:off + 16]
+        rec = bytes([len(chunk)]) + (addr & 0xFFFF).to_bytes(2, 'big') + b'\x00' + chunk
+        lines.append(':' + (rec + bytes([-sum(rec) & 0xFF])).hex().upper())
+    lines.append(':00000001FF')
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def reference_parse(filename: str) -> list:
+    """ The line by line ihex parser which `serprog.ihex.parse` replaced,
+    kept as the reference of `bench_ihex`.
+
+    Args:
+        filename (str): The file to parse.
+
+    Raises:
+        serprog.exceptions.IhexFormatError:
+
+    Returns:
+        list: data blocks with start address.
+    """
+    with open(filename, 'r') as hexfile:
+        sections = []
+        extend_address = 0
+        eof_flag = False
+
+        for line in hexfile.readlines():
+            # line is end up with '\n'
+            if len(line) < 12 or not line.startswith(':'):
+                raise exceptions.IhexFormatError(filename)
+
+            record_length = int(line[1:3], 16)
+            address = int(line[3:7], 16)
+            record_type = int(line[7:9], 16)
+
+            if record_length != 0:
+                if len(line) != 12 + record_length * 2:
+                    raise exceptions.IhexFormatError(filename)
+                data = bytearray.fromhex(line[9 : 9 + record_length*2])
+            else:
+                data = b''
+
+            if record_type == ihex.DATA_RECORD:
+                if sections and extend_address + address == sections[-1]['address'] + len(sections[-1]['data']):
+                    # Add data to previous section
+                    sections[-1]['data'] += data
+                else:
+                    sections.append({'address': extend_address + address, 'data': data})
+            elif record_type == ihex.EOF_RECORD:
+                eof_flag = True
+            elif record_type == ihex.EXT_SEG_ADDR_RECORD:
+                extend_address = int(line[9:13], 16) << 4
+            elif record_type == ihex.EXT_LINEAR_ADDR_RECORD:
+                extend_address = int(line[9:13], 16) << 16
+
+        if not eof_flag:
+            raise exceptions.IhexFormatError(filename)
+
+    return sections
+
+def bench_ihex(sizes: tuple = (64 << 10, 1 << 20, 16 << 20), pgsz: int = 512, repeat: int = 3) -> list:
+    """ Time the ihex pipeline on synthetic files.
+
+    Args:
+        sizes (tuple, optional): Data bytes of each file. The default is 64 KB, 1 MB and 16 MB.
+        pgsz (int, optional): Page size of `padding_space` and `cut_to_pages`. The default is 512.
+        repeat (int, optional): Runs per file, the fastest is kept. The default is 3.
+
+    Returns:
+        list: dict of data size, file size and seconds of `parse`, of the
+            former parser `reference_parse`, of the streaming `iter_records`,
+            `padding_space` and `cut_to_pages` per file.
+    """
+    res = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            filename = os.path.join(tmp, f'{size}.hex')
+            write_ihex(filename, size)
+
+            def run_stream():
+                for _ in ihex.iter_records(filename):
+                    pass
+
+            h = ihex.parse(filename)
+            res.append({
+                'bytes': size,
+                'file_bytes': os.path.getsize(filename),
+                'parse_s': _best_of(lambda: ihex.parse(filename), repeat),
+                'reference_parse_s': _best_of(lambda: reference_parse(filename), repeat),
+                'iter_records_s': _best_of(run_stream, repeat),
+                'padding_space_s': _best_of(lambda: ihex.padding_space(h, pgsz, b'\xFF'), repeat),
+                'cut_to_pages_s': _best_of(lambda: ihex.cut_to_pages(h, pgsz), repeat),
+            })
+    return res
+
+def bench_loader(size: int = 64 << 10, baudrates: tuple = (921600, 3000000),
+                 windows: tuple = (1, 8), device_type: int = 1) -> list:
+    """ Time whole flash programmings against the simulated bootloader.
+
+    The simulated device takes the time of a real link at each baud rate,
+    with the command latencies of `simulator.DEFAULT_LATENCY`.
+
+    Args:
+        size (int, optional): Data bytes of the image. The default is 64 KB.
+        baudrates (tuple, optional): Baud rates of the link. The default is 921600 and 3000000.
+        windows (tuple, optional): Write windows of the Loader. The default is 1 and 8.
+        device_type (int, optional): Simulated device type. The default is 1.
+
+    Returns:
+        list: dict of baud rate, window, pages, seconds and KB/s per run.
+    """
+    res = []
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, f'{size}.hex')
+        write_ihex(filename, size)
+        for baudrate in baudrates:
+            for window in windows:
+                ser = serial.serial_for_url(f'sim://{device_type}', baudrate=baudrate, timeout=1)
+                start = time.perf_counter()
+                l = loader.Loader(ser, device_type=device_type, is_flash_prog=True,
+                                  flash_file=filename, window=window)
+                while not l.is_finished:
+                    l.do_step()
+                seconds = time.perf_counter() - start
+                ser.close()
+                res.append({
+                    'baudrate': baudrate,
+                    'window': window,
+                    'pages': l.total_steps - 1,
+                    'seconds': seconds,
+                    'KBps': size / 1024 / seconds,
+                })
+    return res
+
+def run(quick: bool = False) -> dict:
+    """ Run the whole suite.
+
+    Args:
+        quick (bool, optional): Smaller images, for a smoke test. The default is False.
+
+    Returns:
+        dict: The environment and the results of each benchmark, JSON serializable.
+    """
+    from serprog import __version__
+    if quick:
+        ihex_sizes, loader_size = (64 << 10, 1 << 20), 16 << 10
+    else:
+        ihex_sizes, loader_size = (64 << 10, 1 << 20, 16 << 20), 64 << 10
+    return {
+        'serprog': __version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'decoder': bench_decoder(),
+        'encoder': bench_encoder(),
+        'ihex': bench_ihex(ihex_sizes),
+        'loader': bench_loader(loader_size),
+    }
+
+def report(res: dict):
+    """ Print the results of `run`. """
+    dec = res['decoder']
+    print(f"Decoder, {dec['bytes']} bytes of 512-byte FLASH_READ packets")
+    print(f"    step: {dec['step_MBps']:8.2f} MB/s")
+    print(f"    feed: {dec['feed_MBps']:8.2f} MB/s  (x{dec['feed_MBps'] / dec['step_MBps']:.1f})")
+
+    enc = res['encoder']
+    print("FLASH_WRITE packet of a 512-byte page")
+    print(f"    encode:  {enc['encode_us']:8.2f} us  {enc['encode_MBps']:8.2f} MB/s")
+    print(f"    Encoder: {enc['encoder_us']:8.2f} us  {enc['encoder_MBps']:8.2f} MB/s")
+
+    for r in res['ihex']:
+        print(f"ihex, {r['bytes'] / (1 << 20):.2f} MB data ({r['file_bytes'] / (1 << 20):.2f} MB file)")
+        print(f"    reference:     {r['reference_parse_s']:8.4f} s")
+        print(f"    parse:         {r['parse_s']:8.4f} s  (x{r['reference_parse_s'] / r['parse_s']:.1f})")
+        print(f"    iter_records:  {r['iter_records_s']:8.4f} s")
+        print(f"    padding_space: {r['padding_space_s']:8.4f} s")
+        print(f"    cut_to_pages:  {r['cut_to_pages_s']:8.4f} s")
+
+    print("Loader, flash programming of the simulated bootloader")
+    for r in res['loader']:
+        print(f"    {r['baudrate']:8} baud, window {r['window']:2}: {r['pages']:5} pages "
+              f"in {r['seconds']:7.3f} s  {r['KBps']:8.2f} KB/s")
+
+def write(filename: str, res: dict):
+    """ Write the results of `run` as JSON. """
+    with open(filename, 'w') as f:
+        json.dump(res, f, indent=2)
+
+def main():
+    report(run())
+
+
+if __name__ == '__main__':
+    main()
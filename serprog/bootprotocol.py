@@ -3,6 +3,8 @@
 Bootloader Protocol implementation.
 """
 import enum
+import struct
+import zlib
 from typing import Union
 
 HEADER = b'\xA5\xA5\xA5'
@@ -36,6 +38,25 @@ class CMD(enum.IntEnum):
     EXT_FLASH_ERASE_SECTOR  = 0x35
     EXT_FLASH_HEX_DEL       = 0x36
 
+class Packet(object):
+    """ A decoded packet.
+
+    Attributes:
+        command (CMD): Command of the packet.
+        data (bytearray): Data of the packet.
+        error (bool): True if the checksum does not match the data.
+    """
+    __slots__ = ('command', 'data', 'error')
+
+    def __init__(self, command: CMD, data: bytearray, error: bool = False):
+        self.command = command
+        self.data    = data
+        self.error   = error
+
+    def __repr__(self):
+        return 'Packet(command={0!r}, data={1!r}, error={2!r})'.format(
+            self.command, bytes(self.data), self.error)
+
 class Decoder(object):
     class _Status(enum.IntEnum):
         HEADER  = 0
@@ -57,16 +78,135 @@ class Decoder(object):
         super(Decoder, self).__init__()
         self._status = self._Status(self._Status.HEADER)
 
+        # state of `feed`, independent of `step`
+        self._feed_status = self._Status(self._Status.HEADER)
+        self._feed_header = 0           # count of HEADER bytes matched so far
+        self._feed_fixed  = bytearray() # command and length bytes
+        self._feed_cmd    = None
+        self._feed_data   = bytearray()
+        self._feed_filled = 0
+        self._feed_chksum = 0
+
+    def feed(self, buf: Union[bytes, bytearray, memoryview]) -> list:
+        """ Decode a chunk of received bytes.
+
+        The header is located by a bulk search and the payload is copied
+        once into a buffer allocated as soon as the length is known, so the
+        cost per packet does not depend on how the bytes are chunked.
+        Do not mix `feed` and `step` on the same decoder.
+
+        Args:
+            buf (Union[bytes, bytearray, memoryview]): Received bytes.
+
+        Returns:
+            list: Complete packets (`Packet`) decoded from this and the
+                previous chunks, in order. May be empty.
+        """
+        if isinstance(buf, memoryview):
+            buf = buf.tobytes()
+        packets = []
+        mv = memoryview(buf)
+        n = len(buf)
+        i = 0
+
+        while i < n:
+            if self._feed_status is self._Status.HEADER:
+                # Finish a header split over the previous chunk.
+                if self._feed_header:
+                    need = 3 - self._feed_header
+                    part = buf[i:i + need]
+                    if part == HEADER[:len(part)]:
+                        i += len(part)
+                        if len(part) < need:
+                            self._feed_header += len(part)
+                            continue
+                        self._feed_header = 0
+                        self._feed_status = self._Status.COMMAND
+                        self._feed_fixed = bytearray()
+                        continue
+                    self._feed_header = 0
+
+                idx = buf.find(HEADER, i)
+                if idx < 0:
+                    # Keep the trailing part which may begin a header.
+                    if buf.endswith(HEADER[:2]) and n - i >= 2:
+                        self._feed_header = 2
+                    elif buf.endswith(HEADER[:1]):
+                        self._feed_header = 1
+                    break
+                i = idx + 3
+                self._feed_status = self._Status.COMMAND
+                self._feed_fixed = bytearray()
+
+            elif self._feed_status is self._Status.COMMAND:
+                if not self._feed_fixed:
+                    ch = buf[i]
+                    i += 1
+                    if ch == HEADER[-1]:
+                        # A longer run of header bytes, the header ends here.
+                        continue
+                    try:
+                        self._feed_cmd = CMD(ch)
+                    except ValueError:
+                        # Not a packet, search the next header.
+                        self._feed_status = self._Status.HEADER
+                        continue
+                    self._feed_fixed.append(ch)
+                    continue
+                take = min(3 - len(self._feed_fixed), n - i)
+                self._feed_fixed += mv[i:i + take]
+                i += take
+                if len(self._feed_fixed) < 3:
+                    continue
+                length = (self._feed_fixed[1] << 8) | self._feed_fixed[2]
+                self._feed_data = bytearray(length)
+                self._feed_filled = 0
+                self._feed_chksum = 0
+                if length == 0:
+                    self._feed_status = self._Status.CHKSUM
+                else:
+                    self._feed_status = self._Status.DATA
+
+            elif self._feed_status is self._Status.DATA:
+                filled = self._feed_filled
+                take = min(len(self._feed_data) - filled, n - i)
+                chunk = mv[i:i + take]
+                self._feed_data[filled:filled + take] = chunk
+                self._feed_chksum += sum(chunk)
+                self._feed_filled = filled + take
+                i += take
+                if self._feed_filled == len(self._feed_data):
+                    self._feed_status = self._Status.CHKSUM
+
+            elif self._feed_status is self._Status.CHKSUM:
+                error = (self._feed_chksum & 0xFF) != buf[i]
+                i += 1
+                packets.append(Packet(self._feed_cmd, self._feed_data, error))
+                self._feed_data = bytearray()
+                self._feed_status = self._Status.HEADER
+
+        return packets
+
     def step(self, ch):
 
         if self._status is self._Status.HEADER:
             self._header_buffer = self._header_buffer[1:3] + bytes([ch])
             if self._header_buffer == HEADER:
                 self._chksum = 0
+                self._isError = False
                 self._status = self._Status.COMMAND
 
         elif self._status is self._Status.COMMAND:
-            self._command = CMD(ch)
+            if ch == HEADER[-1]:
+                # A longer run of header bytes, the header ends here.
+                return
+            try:
+                self._command = CMD(ch)
+            except ValueError:
+                # Not a packet, search the next header.
+                self._status = self._Status.HEADER
+                self._header_buffer = b'\x00\x00\x00'
+                return
             self._counter = 0
             self._status = self._Status.LENGTH
 
@@ -92,7 +232,7 @@ class Decoder(object):
 
         elif self._status is self._Status.CHKSUM:
             if self._chksum % 256 != ch:
-                self._error = True
+                self._isError = True
             self._status = self._Status.HEADER
             self._header_buffer = b'\x00\x00\x00'
             self._isDone = True
@@ -111,6 +251,24 @@ class Decoder(object):
             res = {'command': None, 'data': b''}
         return res
 
+def checksum(data: bytes) -> int:
+    """Checksum of a package, the sum of the data bytes modulo 256.
+
+    Below 256 bytes the low 16 bits of adler32 are exactly 1 + the sum of
+    the bytes, so the sum is taken in C without copying `data`.
+
+    Args:
+        data (bytes): Data in the package, any bytes-like object.
+
+    Returns:
+        int: The checksum.
+    """
+    view = memoryview(data)
+    res = 0
+    for i in range(0, len(view), 256):
+        res += zlib.adler32(view[i : i + 256]) - 1
+    return res & 0xFF
+
 def encode(cmd: Union[int, CMD], data: bytes) -> bytes:
     """Encode command, data to a package.
     
@@ -129,3 +287,49 @@ def encode(cmd: Union[int, CMD], data: bytes) -> bytes:
 
     payload = header + command + length + data + checksum
     return payload
+
+_FRAME_HEAD = struct.Struct('>3sBH')   # header, command, length
+_FRAME_ADDR = struct.Struct('<I')      # page address of page commands
+
+class Encoder():
+    """ Encode packets into a reusable frame buffer.
+
+    The frame returned by `encode` is a view of the buffer, it is only valid
+    until the next call. Write it out before encoding the next packet.
+    """
+    __slots__ = ('_buf', '_view')
+
+    def __init__(self, size: int = 1024):
+        """ Initialization
+        Args:
+            size (int, optional): Initial buffer size, grown when a packet needs more. The default is 1024.
+        """
+        self._buf  = bytearray(size)
+        self._view = memoryview(self._buf)
+
+    def encode(self, cmd: Union[int, CMD], data: bytes, address: int = None) -> memoryview:
+        """Encode command, data to a package, the same as `encode`.
+
+        Args:
+            cmd (Union[int, Command]): Command in the package.
+            data (bytes): Data in the package.
+            address (int, optional): Page address put before `data` as 4 bytes
+                little endian, e.g. for FLASH_WRITE. The default is None.
+
+        Returns:
+            memoryview: Package, valid until the next call.
+        """
+        start = 6 if address is None else 10
+        end = start + len(data)
+        if len(self._buf) < end + 1:
+            # a new buffer, frames returned before stay valid
+            self._buf  = bytearray(end + 1)
+            self._view = memoryview(self._buf)
+        buf, view = self._buf, self._view
+
+        _FRAME_HEAD.pack_into(buf, 0, HEADER, cmd, end - 6)
+        if address is not None:
+            _FRAME_ADDR.pack_into(buf, 6, address)
+        buf[start:end] = data
+        buf[end] = checksum(view[6:end])
+        return view[:end + 1]
@@ -3,15 +3,28 @@
 Sub-command implementation.
 """
 
+from serprog import artifact
+from serprog import benchmark
+from serprog import checkpoint
 from serprog import device
+from serprog import eraseplan
+from serprog import image
+from serprog import linktest
 from serprog import loader
 from serprog import exceptions
+from serprog import metrics
+from serprog import simulator
+from serprog import timing
+from serprog import trace
 
 import serial.tools.list_ports
 
 import progressbar
+import os
 import serial
 import sys
+import threading
+import time
 
 def do_print_devices(args):
     print("Available device list:")
@@ -20,45 +33,208 @@ def do_print_devices(args):
     devices = [f"  - {dev['name']:11s}  \t {dev['dev_type']:4}\t {dev['note']}" for dev in device.device_list]
     print('\n'.join(devices))
 
+    entries = timing.Profile.load().entries()
+    if entries:
+        print()
+        print("Measured throughput:")
+        print("    device name   \t baud rate\t window\t runs\t page (s)\t KB/s")
+        print("-" * 72)
+        for name, baudrate, window, times in entries:
+            page = times.get('flash_page', times.get('ext_flash_page', 0))
+            rate = 0.5 / page if page else 0
+            print(f"  - {name:11s}  \t {baudrate:9}\t {window:6}\t {times.get('runs', 0):4}\t {page:8.4f}\t {rate:.2f}")
+
 def do_print_ports(args):
     for (port, desc, hwid) in serial.tools.list_ports.comports():
         print(f"{port:20}")
         print(f"    desc: {desc}")
         print(f"    hwid: {hwid}")
 
-def do_prog(args):
+def do_compile(args):
+    """ Cut the image to pages and write them to an artifact.
+    """
+    start_time = time.monotonic()
+    try:
+        img = image.load(args.input_file, args.page_size, base_address=args.base_address)
+    except exceptions.ImageFormatError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
 
-    # Create Serial object
-    ser = serial.Serial()
-    ser.port = args.port
-    ser.baudrate = 115200
+    artifact.write(args.output_file, img.pages, args.page_size, img.size)
+    if artifact.verify(args.output_file):
+        print(f"ERROR: {args.output_file} does not match the image, please check the disk.")
+        sys.exit(1)
+
+    print(f"Image size is {img.size/1024:.2f} KB ({img.size} bytes)")
+    print(f"Pages are {len(img.pages)} of {args.page_size} bytes")
+    print(f"Wrote {args.output_file} in {time.monotonic() - start_time:.2f} s")
+
+def _open_port(port: str, args, profile: timing.Profile = None) -> serial.Serial:
+    """ Open the serial port of the 'prog' sub-command.
+
+    Without parameter --baud the port is opened at the rate negotiated last
+    for the device type, kept in the timing profile, or the rate of the device list.
+
+    Raises:
+        serial.SerialException: The port can not be opened.
+        exceptions.ComuError: No response while negotiating the baud rate.
+    """
+    device_type = device.get_device_by_str(args.device)
+
+    # a port name, or a pyserial URL such as 'sim://ATSAME54_DEVB'
+    ser = serial.serial_for_url(port, do_not_open=True)
+    if args.baud is None:
+        rate = None
+        if profile is not None:
+            rate = profile.baudrate(device.device_list[device_type]['name'])
+        ser.baudrate = rate or device.device_list[device_type]['baudrate']
+    elif args.baud == 'auto':
+        ser.baudrate = device.baudrate_list[0]
+    else:
+        ser.baudrate = int(args.baud)
     ser.timeout = 1
+    ser.open()
+
+    if args.trace_file:
+        loader_args = _loader_args(args)
+        # the trace is replayed from any directory
+        for key in ('flash_file', 'ext_flash_file', 'eeprom_file'):
+            if loader_args[key]:
+                loader_args[key] = os.path.abspath(loader_args[key])
+        meta = {'baud': args.baud, 'port': port, 'loader': loader_args}
+        ser = trace.TraceSerial(ser, _trace_file(args, port), meta)
+
+    if args.baud == 'auto':
+        try:
+            loader.negotiate_baudrate(ser)
+        except exceptions.ComuError:
+            ser.close()
+            raise
+    return ser
+
+def _trace_file(args, port: str) -> str:
+    """ The trace file of a port, parameter --trace with the port name
+    appended when several ports are programmed.
+    """
+    if len(args.port) == 1:
+        return args.trace_file
+    root, ext = os.path.splitext(args.trace_file)
+    return f"{root}-{os.path.basename(port)}{ext}"
+
+def _loader_args(args) -> dict:
+    """ Keyword arguments of Loader given by the 'prog' sub-command, without the port and images.
+    """
+    return dict(
+        device_type       = device.get_device_by_str(args.device),
+        is_flash_prog     = bool(args.flash_file),
+        is_ext_flash_prog = bool(args.ext_flash_file),
+        is_eeprom_prog    = bool(args.eeprom_file),
+        is_ext_flash_boot = bool(args.ext_flash_boot),
+        flash_file        = args.flash_file,
+        ext_flash_file    = args.ext_flash_file,
+        eeprom_file       = args.eeprom_file,
+        window            = args.window,
+        is_delta          = args.delta,
+        is_erase_all      = args.erase_all,
+        is_ext_flash_stream = args.stream,
+        base_address      = args.base_address,
+    )
+
+def _new_loader(ser: serial.Serial, args, images: dict = None,
+                profile: timing.Profile = None, port: str = None) -> loader.Loader:
+    """ Create the Loader of the 'prog' sub-command.
+
+    Args:
+        ser (serial.Serial): The opened serial port.
+        args (argparse.Namespace): CLI paser command.
+        images (dict, optional): Loaded images, keyword arguments of Loader
+            such as 'flash_image'. The default is None.
+        profile (timing.Profile, optional): Measured times of the devices. The default is None.
+        port (str, optional): The port, whose checkpoint is kept for --resume. The default is None.
+    """
+    if images is None:
+        images = dict()
+    l = loader.Loader(
+        ser               = ser,
+        timing_profile    = profile,
+        checkpoint_file   = checkpoint.default_path(port) if port else None,
+        is_resume         = args.resume,
+        **_loader_args(args),
+        **images,
+    )
+    if args.baud == 'auto' and profile is not None:
+        # saved with the measured times, used by the next run without --baud
+        profile.set_baudrate(l.device_name, l.baudrate)
+    return l
+
+def _save_profile(profile: timing.Profile):
+    """ Write the measured times, a failure only warns. """
     try:
-        ser.open()
-    except:
-        print(f"ERROR: {args.port} has been opened by another application.")
+        profile.save()
+    except OSError as e:
+        print(f"WARNING: Can't save the timing profile {profile.path}: {e.strerror}")
+
+def _write_metrics(args, loaders: dict):
+    """ Write the command metrics of parameter --metrics, a failure only warns.
+
+    Args:
+        args (argparse.Namespace): CLI paser command.
+        loaders (dict): port -> Loader of each programmed port.
+    """
+    if not args.metrics_file:
+        return
+    runs = []
+    for port, l in loaders.items():
+        labels = {'port': port, 'device': l.device_name, 'baudrate': l.baudrate}
+        runs.append((labels, l.metrics))
+    try:
+        metrics.write(args.metrics_file, runs)
+    except OSError as e:
+        print(f"WARNING: Can't write the metrics {args.metrics_file}: {e.strerror}")
+
+def _load_images(args) -> dict:
+    """ Load the images of the 'prog' sub-command.
+
+    The images were parsed and cached while checking the arguments, so this
+    takes them from the cache. A streamed external flash image is not loaded.
+
+    Returns:
+        dict: Loaded images, keyword arguments of Loader such as 'flash_image'.
+    """
+    images = {}
+    try:
+        if args.flash_file:
+            images['flash_image'] = image.load(args.flash_file, base_address=args.base_address)
+        if args.ext_flash_file and not args.stream:
+            images['ext_flash_image'] = image.load(args.ext_flash_file, base_address=args.base_address)
+        if args.eeprom_file:
+            images['eeprom_image'] = image.load(args.eeprom_file, base_address=args.base_address)
+    except exceptions.ImageFormatError as e:
+        print(f"ERROR: {e}")
         sys.exit(1)
+    return images
 
-    is_prog_flash     = bool(args.flash_file)
-    is_ext_flash      = bool(args.ext_flash_file)
-    is_prog_eeprom    = bool(args.eeprom_file)
-    is_ext_flash_boot = bool(args.ext_flash_boot)
+def do_prog(args):
+    if len(args.port) > 1:
+        do_gang_prog(args)
+        return
+    port = args.port[0]
+    images = _load_images(args)
+    profile = timing.Profile.load()
 
-    # Device number
-    device_type = device.get_device_by_str(args.device)
+    # Create Serial object
+    try:
+        ser = _open_port(port, args, profile)
+    except exceptions.ComuError:
+        print("ERROR: Can't communicate with the device.")
+        print("       Please check the comport and the device.")
+        sys.exit(1)
+    except:
+        print(f"ERROR: {port} has been opened by another application.")
+        sys.exit(1)
 
     try:
-        l = loader.Loader(
-            ser               = ser,
-            device_type       = device_type,
-            is_flash_prog     = is_prog_flash,
-            is_ext_flash_prog = is_ext_flash,
-            is_eeprom_prog    = is_prog_eeprom,
-            is_ext_flash_boot = is_ext_flash_boot,
-            flash_file        = args.flash_file,
-            ext_flash_file    = args.ext_flash_file,
-            eeprom_file       = args.eeprom_file,
-        )
+        l = _new_loader(ser, args, images, profile, port)
     except exceptions.ComuError:
         print("ERROR: Can't communicate with the device.")
         print("       Please check the comport and the device.")
@@ -68,37 +244,317 @@ def do_prog(args):
         print("       Assigned device is '{0:s}'".format(device.device_list[e.in_dev]['name']))
         print("       Detected device is '{0:s}'".format(device.device_list[e.real_dev]['name']))
         sys.exit(1)
+    except (exceptions.ImageRangeError, exceptions.ImageFormatError, exceptions.SectorSizeError) as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
 
     print(f"Device is '{device.device_list[l.device_type]['name']}'")
+    print(f"Baud rate is {l.baudrate}")
     print(f"Flash hex size is {l.flash_size/1024:.2f} KB ({l.flash_size} bytes)")
-    print(f"Externel Flash hex size is {l.ext_flash_size/1024:.2f} KB ({l.ext_flash_size} bytes)")
+    if args.stream and args.ext_flash_file:
+        print(f"Externel Flash hex size is about {l.ext_flash_size/1024:.2f} KB (streamed)")
+    else:
+        print(f"Externel Flash hex size is {l.ext_flash_size/1024:.2f} KB ({l.ext_flash_size} bytes)")
     print(f"EEPROM hex size is {l.eeprom_size} bytes.")
+    if l.blank_pages:
+        print(f"Flash blank pages are {l.blank_pages}, not programmed.")
+    if l.erase_sectors:
+        print(f"Flash erase is {l.erase_sectors} sectors ({l.erase_size/1024:.2f} KB)")
+    if args.resume and l.resumed_pages:
+        print(f"Resumed after {l.resumed_pages} pages of the interrupted programming.")
+    elif args.resume:
+        print("No interrupted programming of these images to resume, programming from the start.")
     print(f"Estimated time  is {l.prog_time:.2f} s.")
 
     # Progress bar
+    eta = progressbar.FormatCustomText(' ETA: %(eta)6.1fs', {'eta': l.eta})
     widgets = [
         ' [', progressbar.Timer('Elapsed Time: %(seconds)0.2fs', ), '] ',
         progressbar.Bar(),
         progressbar.Counter(format='%(percentage)0.2f%%'),
+        eta,
     ]
 
     bar = progressbar.ProgressBar(max_value=l.total_steps, widgets=widgets)
     bar.update(0)
 
     # Program device
-    for i in range(l.total_steps):
+    while not l.is_finished:
         try:
             l.do_step()
-            bar.update(i)
+            if bar.max_value != l.total_steps:
+                # streamed image, the estimated steps are corrected
+                bar.max_value = l.total_steps
+            eta.update_mapping(eta=l.eta)
+            bar.update(min(l.cur_step, l.total_steps))
+        except exceptions.FlashIsNotIhexError as e:
+            bar.finish(end='\n', dirty=True)
+            print(f"ERROR: The flash binary file {e.filename} is not a valid ihex, S-record, ELF or binary file.")
+            break
+        except exceptions.ArtifactHashError as e:
+            bar.finish(end='\n', dirty=True)
+            print(f"ERROR: {e}")
+            print("Compile the artifact again.")
+            break
         except exceptions.ComuError:
             print("ERROR: Can't communicate with the device.")
             print("Please check the comport is correct.")
+            print("Run the same command with --resume to continue.")
             break
         except Exception:
             bar.finish(end='\n', dirty=True)
             print("ERROR: Can't communicate with the device.")
             print("Please check the comport is correct.")
+            print("Run the same command with --resume to continue.")
             break
 
     bar.finish(end='\n')
+    if args.delta:
+        print(f"Skipped {l.skipped_pages} flash pages which are up to date.")
+    if l.retries:
+        print(f"Sent {l.retries} commands again after a timeout or a corrupted response.")
     ser.close()
+    _write_metrics(args, {port: l})
+
+    if l.is_finished:
+        print(f"Programmed in {l.elapsed:.2f} s, estimated {l.prog_time:.2f} s.")
+        _save_profile(profile)
+
+def _gang_worker(port: str, args, images: dict, result: dict, profile: timing.Profile = None):
+    """ Program one port of the gang programming, in its own thread.
+
+    Errors are stored in `result` instead of raised, so they don't abort
+    the other ports.
+    """
+    start_time = time.monotonic()
+    try:
+        ser = _open_port(port, args, profile)
+    except exceptions.ComuError:
+        result['error'] = "Can't communicate with the device."
+        return
+    except Exception:
+        result['error'] = "Can't open the port."
+        return
+
+    try:
+        l = _new_loader(ser, args, images, profile, port)
+        result['device'] = l.device_name
+        result['loader'] = l
+        while not l.is_finished:
+            l.do_step()
+        result['ok'] = True
+    except exceptions.ComuError:
+        result['error'] = "Can't communicate with the device."
+    except exceptions.CheckDeviceError as e:
+        result['error'] = "Device is not match, detected '{0:s}'.".format(
+            device.device_list[e.real_dev]['name'])
+    except (exceptions.ImageRangeError, exceptions.ImageFormatError, exceptions.SectorSizeError) as e:
+        result['error'] = str(e)
+    except Exception as e:
+        result['error'] = repr(e)
+    finally:
+        ser.close()
+        result['time'] = time.monotonic() - start_time
+
+def do_gang_prog(args):
+    """ Program all ports of the 'prog' sub-command at once.
+
+    The images are loaded once and shared by one worker thread per port,
+    and so is the timing profile, it is saved when all ports are done.
+    """
+    images = _load_images(args)
+    profile = timing.Profile.load()
+
+    results = dict()
+    threads = list()
+    for port in args.port:
+        results[port] = {'device': '', 'ok': False, 'error': '', 'time': 0.0, 'loader': None}
+        t = threading.Thread(target=_gang_worker, args=(port, args, images, results[port], profile),
+                             daemon=True)
+        threads.append(t)
+        t.start()
+
+    # Progress bar, 100 steps per port
+    widgets = [
+        ' [', progressbar.Timer('Elapsed Time: %(seconds)0.2fs', ), '] ',
+        progressbar.Bar(),
+        progressbar.Counter(format='%(percentage)0.2f%%'),
+    ]
+
+    bar = progressbar.ProgressBar(max_value=100 * len(threads), widgets=widgets)
+    bar.update(0)
+
+    def progress():
+        value = 0
+        for res in results.values():
+            l = res['loader']
+            if res['ok']:
+                value += 100
+            elif l is not None:
+                value += 100 * min(l.cur_step, l.total_steps) // l.total_steps
+        return value
+
+    while any([t.is_alive() for t in threads]):
+        bar.update(progress())
+        time.sleep(0.2)
+    bar.update(progress())
+    bar.finish(end='\n')
+
+    print(f"{'port':20} {'device':15} {'result':6} {'time':>8} {'retries':>7}")
+    print("-" * 60)
+    for port, res in results.items():
+        state = 'OK' if res['ok'] else 'FAIL'
+        retries = res['loader'].retries if res['loader'] is not None else 0
+        print(f"{port:20} {res['device']:15} {state:6} {res['time']:7.2f}s {retries:7}")
+        if res['error']:
+            print(f"    {res['error']}")
+
+    _write_metrics(args, {port: res['loader'] for port, res in results.items() if res['loader'] is not None})
+
+    failed = len([res for res in results.values() if not res['ok']])
+    if failed < len(results):
+        _save_profile(profile)
+    print(f"{len(results) - failed} of {len(results)} ports programmed.")
+    if failed:
+        sys.exit(1)
+
+def do_replay(args):
+    """ Run a programming again with the responses of a trace, without hardware.
+    """
+    try:
+        tr = trace.load(args.input_file)
+    except exceptions.TraceFormatError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+    packets, errors, seconds = trace.decode(tr)
+    print(f"Trace has {tr.count(trace.TX)} writes and {tr.count(trace.RX)} reads in {tr.duration:.2f} s")
+    print(f"Decoded {packets} packets ({errors} checksum errors) in {seconds * 1000:.2f} ms")
+
+    ser = trace.ReplaySerial(tr, realtime=not args.fast)
+    start_time = time.monotonic()
+    l = None
+    try:
+        if tr.meta.get('baud') == 'auto':
+            loader.negotiate_baudrate(ser)
+        l = loader.Loader(ser, **tr.meta.get('loader', {}))
+        while not l.is_finished:
+            l.do_step()
+    except FileNotFoundError:
+        print("ERROR: The images of the trace are not found.")
+        sys.exit(1)
+    except exceptions.ComuError:
+        print("Replay stopped where the trace has no response, as the device did.")
+    except exceptions.CheckDeviceError:
+        print("ERROR: The device of the trace does not match.")
+        sys.exit(1)
+    except (exceptions.FlashIsNotIhexError, exceptions.EepromIsNotIhexError) as e:
+        print(f"ERROR: The image {e.filename} of the trace is not a valid ihex, S-record, ELF or binary file.")
+        sys.exit(1)
+    except (exceptions.ImageFormatError, exceptions.ImageRangeError, exceptions.SectorSizeError) as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+    print(f"Replayed in {time.monotonic() - start_time:.2f} s, recorded {tr.duration:.2f} s.")
+    if ser.mismatches:
+        print(f"WARNING: {ser.mismatches} writes differ from the trace.")
+    if l is not None:
+        _write_metrics(args, {tr.meta.get('port', 'replay'): l})
+
+def do_simulate(args):
+    """ Serve a simulated bootloader on a pseudo terminal until Ctrl-C.
+    """
+    bootloader = simulator.Bootloader(
+        device_type  = device.get_device_by_str(args.device),
+        latency      = args.latency,
+        error_rate   = args.error_rate,
+        drop_rate    = args.drop_rate,
+        max_baudrate = args.max_baud,
+        seed         = args.seed,
+    )
+    server = simulator.PtyServer(bootloader, args.baud).start()
+    print(f"Simulated '{device.device_list[bootloader.device_type]['name']}' bootloader on {server.path}")
+    print("Press Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    for cmd, count in sorted(bootloader.counts.items()):
+        print(f"    {cmd.name:24} {count}")
+
+def do_bench_host(args):
+    """ Run the host benchmarks, and write their results.
+    """
+    res = benchmark.run(args.quick)
+    benchmark.report(res)
+    if args.output_file:
+        benchmark.write(args.output_file, res)
+        print(f"Wrote {args.output_file}")
+
+def do_link_test(args):
+    """ Characterise the link to the device, and recommend a baud rate.
+    """
+    device_type = device.get_device_by_str(args.device)
+    try:
+        ser = serial.serial_for_url(args.port, do_not_open=True)
+        ser.baudrate = args.baudrates[0]
+        ser.timeout = 1
+        ser.open()
+    except Exception:
+        print(f"ERROR: {args.port} has been opened by another application.")
+        sys.exit(1)
+
+    try:
+        res = linktest.run(ser, device_type, args.baudrates, args.page_sizes, args.probes,
+                           args.pages, args.window, args.write, progress=lambda msg: print(f"  {msg}"))
+    except exceptions.ComuError:
+        print("ERROR: Can't communicate with the device.")
+        print("       Please check the comport and the device.")
+        sys.exit(1)
+    except exceptions.CheckDeviceError as e:
+        print("ERROR: Device is not match.")
+        print("       Detected device is '{0:s}'".format(device.device_list[e.real_dev]['name']))
+        sys.exit(1)
+    finally:
+        ser.close()
+
+    dev = device.device_list[res['device_type']]
+    print(f"Device is '{dev['name']}'")
+    print(f"{'baud rate':>10} {'errors':>7} {'rtt p50':>9} {'p90':>9} {'p99':>9} {'max':>9}   page KB/s")
+    print("-" * 80)
+    for rate in res['rates']:
+        rtt = rate['rtt']
+        line = f"{rate['baudrate']:10} {rate['error_rate'] * 100:6.1f}%"
+        if rtt:
+            line += ''.join([f" {rtt[q] * 1000:7.2f}ms" for q in (0.5, 0.9, 0.99, 'max')])
+        else:
+            line += f" {'-':>9}" * 4
+        pages = '  '.join([f"{pgsz}:{tp['KBps']:.1f}" for pgsz, tp in rate['pages'].items()])
+        print(f"{line}   {pages}".rstrip())
+
+    best = res['best']
+    if best is None:
+        print("No baud rate works without errors, please check the cable and the adapter.")
+        sys.exit(1)
+    print(f"Recommended baud rate is {best['baudrate']} "
+          f"({best['KBps']:.1f} KB/s, pages of {linktest.PAGE_SIZE} bytes, window {args.window})")
+
+    if args.flash_file:
+        try:
+            img = image.load(args.flash_file, linktest.PAGE_SIZE, base_address=args.base_address)
+        except exceptions.ImageFormatError as e:
+            print(f"ERROR: {e}")
+            sys.exit(1)
+        sectors = len(eraseplan.plan(img.pages, dev['flash_sector_size']))
+        if args.write:
+            page_s, erase_s = best['page_s'], best['erase_s']
+        else:
+            # the link time was measured, the device time per page and erase is the model's
+            times = timing.default_times(res['device_type'], 115200)
+            page_s = best['page_s'] + max(0.0, times['flash_page'] - timing.page_wire_time(115200))
+            erase_s = times['erase_sector']
+        projected = len(img.pages) * page_s + sectors * erase_s
+        print(f"Projected time of {args.flash_file} is {projected:.2f} s "
+              f"({len(img.pages)} pages, {sectors} sectors)")
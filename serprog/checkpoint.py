@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints of interrupted programmings.
+
+While programming, the loader keeps a small JSON file per port with the
+device, a hash of each image and the pages of each region which have
+been acknowledged. When the programming is interrupted, e.g. by a USB
+hiccup, 'prog --resume' of the same images checks the last acknowledged
+page on the device and continues after it, without erasing again. The
+file is removed when the programming finishes.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+VERSION = 1
+
+# regions of a programming
+FLASH     = 'flash'
+EXT_FLASH = 'ext_flash'
+EEPROM    = 'eeprom'
+
+
+def default_dir() -> str:
+    """ The checkpoint directory, $SERPROG_CHECKPOINTS or ~/.serprog/checkpoints.
+    """
+    path = os.environ.get('SERPROG_CHECKPOINTS')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), '.serprog', 'checkpoints')
+
+
+def default_path(port: str) -> str:
+    """ The checkpoint file of a serial port or pyserial URL.
+    """
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', port).strip('_') or 'port'
+    return os.path.join(default_dir(), name + '.json')
+
+
+def image_hash(filename: str, base_address: int = None) -> str:
+    """ SHA-256 of an image file and the address it is loaded to.
+    """
+    h = hashlib.sha256()
+    h.update(str(base_address).encode())
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Checkpoint():
+    """ Progress of a programming.
+
+    Attributes:
+        path (str): The checkpoint file.
+        device_name (str): Name of the programmed device.
+        images (dict): region -> `image_hash` of its image.
+        regions (dict): region -> dict of 'pages' (acknowledged pages) and
+            'done' (the region is finished).
+    """
+
+    def __init__(self, path: str, device_name: str = '', images: dict = None):
+        self.path        = path
+        self.device_name = device_name
+        self.images      = dict(images or {})
+        self.regions     = dict()
+
+    @classmethod
+    def load(cls, path: str):
+        """ Read a checkpoint.
+
+        Returns:
+            Checkpoint: The checkpoint, None if it is missing, broken or of another version.
+        """
+        try:
+            with open(path, 'r') as f:
+                content = json.load(f)
+            if content.get('version') != VERSION:
+                return None
+            cp = cls(path, content['device'], content['images'])
+            cp.regions = {k: {'pages': int(v['pages']), 'done': bool(v['done'])}
+                          for k, v in content['regions'].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+        return cp
+
+    def matches(self, device_name: str, images: dict) -> bool:
+        """ The checkpoint is of the same device and images. """
+        return self.device_name == device_name and self.images == images
+
+    def pages(self, region: str) -> int:
+        return self.regions.get(region, {}).get('pages', 0)
+
+    def done(self, region: str) -> bool:
+        return self.regions.get(region, {}).get('done', False)
+
+    def update(self, region: str, pages: int, done: bool = False):
+        self.regions[region] = {'pages': pages, 'done': done}
+
+    def save(self):
+        """ Write the checkpoint.
+
+        Raises:
+            OSError: The file can not be written.
+        """
+        text = json.dumps({
+            'version': VERSION,
+            'device':  self.device_name,
+            'images':  self.images,
+            'regions': self.regions,
+        }, indent=2, sort_keys=True)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmpname = self.path + '.tmp'
+        with open(tmpname, 'w') as f:
+            f.write(text)
+        os.replace(tmpname, self.path)
+
+    def remove(self):
+        """ Remove the checkpoint file, if any. """
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
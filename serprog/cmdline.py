@@ -5,10 +5,13 @@ CLI parameter paser
 
 from serprog import device
 from serprog import business
-from serprog import ihex
+from serprog import image
+from serprog import simulator
 
 import serial.tools.list_ports
 import argparse
+import fnmatch
+import glob
 import os
 
 
@@ -27,6 +30,51 @@ def parser_init(parser: argparse.ArgumentParser):
 
     parser_prog_init(parser_pr)
 
+    # parser of 'compile' subcommand
+    parser_cp = subparsers.add_parser(
+        'compile',
+        aliases = [],
+        help = 'Cut an image to pages once, and save them to an artifact file for \'prog\'.'
+    )
+
+    parser_compile_init(parser_cp)
+
+    # parser of 'replay' subcommand
+    parser_rp = subparsers.add_parser(
+        'replay',
+        aliases = [],
+        help = 'Run a programming recorded by \'prog --trace\' again, without hardware.'
+    )
+
+    parser_replay_init(parser_rp)
+
+    # parser of 'simulate' subcommand
+    parser_sm = subparsers.add_parser(
+        'simulate',
+        aliases = [],
+        help = 'Serve a simulated bootloader on a pseudo terminal, e.g. to benchmark \'prog\' without hardware.'
+    )
+
+    parser_simulate_init(parser_sm)
+
+    # parser of 'bench-host' subcommand
+    parser_bh = subparsers.add_parser(
+        'bench-host',
+        aliases = [],
+        help = 'Benchmark the parser, the packet codec and the loader on this host, with a simulated bootloader.'
+    )
+
+    parser_bench_host_init(parser_bh)
+
+    # parser of 'link-test' subcommand
+    parser_lt = subparsers.add_parser(
+        'link-test',
+        aliases = [],
+        help = 'Measure the latency, error rate and throughput of the link to a device.'
+    )
+
+    parser_link_test_init(parser_lt)
+
     # parser of 'print-devices' subcommand
     parser_pd = subparsers.add_parser(
         'print-devices',
@@ -62,18 +110,35 @@ def parser_prog_init(parser: argparse.ArgumentParser):
     )
 
     ## Select serial com port. -p
-    arg_p_help = 'The serial port which program burn the device.'
+    arg_p_help = 'The serial port which program burn the device. '
+    arg_p_help += 'Several ports or a glob (e.g. "/dev/ttyUSB*", "COM*") program all of them at once. '
+    arg_p_help += 'A pyserial URL such as "sim://ATSAME54_DEVB" programs a simulated bootloader.'
     parser.add_argument(
         *('-p', '--port'),
         action      = 'store',
         dest        = 'port',
+        nargs       = '+',
         type        = str,
         required    = True,
         help        = arg_p_help
     )
 
+    ## Select serial baud rate. -b
+    arg_b_help = 'The baud rate of the serial port, or \'auto\' to use the fastest rate '
+    arg_b_help += 'the link sustains. The default is the rate negotiated last for the device type, '
+    arg_b_help += 'or the rate of the device type.'
+    parser.add_argument(
+        *('-b', '--baud'),
+        action      = 'store',
+        dest        = 'baud',
+        type        = str,
+        required    = False,
+        help        = arg_b_help
+    )
+
     # Select programmed flash image. -f
-    arg_f_help = 'Set binary file which program to flash.'
+    arg_f_help = 'Set binary file which program to flash. '
+    arg_f_help += 'Intel HEX, Motorola S-record, ELF, raw binary (.bin) and compiled (.sprg) files are accepted.'
     parser.add_argument(
         *('-f', '--flash'),
         action      = 'store',
@@ -105,6 +170,18 @@ def parser_prog_init(parser: argparse.ArgumentParser):
         help        = arg_e_help
     )
 
+    # Load address of raw binary files. --base-address
+    arg_base_address_help = 'The address raw binary files are programmed to, e.g. 0x10000, '
+    arg_base_address_help += 'required by them. Files of no other format are read as raw binary.'
+    parser.add_argument(
+        *('--base-address',),
+        action      = 'store',
+        dest        = 'base_address',
+        type        = str,
+        required    = False,
+        help        = arg_base_address_help
+    )
+
     # Select programmed file name in embedded file system. -flashboot
     arg_flash_boot_help = 'Program from externel flash to internel flash.'
     parser.add_argument(
@@ -116,6 +193,598 @@ def parser_prog_init(parser: argparse.ArgumentParser):
         help        = arg_flash_boot_help
     )
 
+    # Only reprogram the changed flash sectors. --delta
+    arg_delta_help = 'Verify the flash against the image and only erase and program '
+    arg_delta_help += 'the sectors which differ.'
+    parser.add_argument(
+        *('--delta',),
+        action      = 'store_true',
+        dest        = 'delta',
+        required    = False,
+        help        = arg_delta_help
+    )
+
+    # Stream the external flash image. --stream
+    arg_stream_help = 'Parse the externel flash image while programming it, '
+    arg_stream_help += 'only a few pages are kept in memory. The records of the image must be in ascending address order.'
+    parser.add_argument(
+        *('--stream',),
+        action      = 'store_true',
+        dest        = 'stream',
+        required    = False,
+        help        = arg_stream_help
+    )
+
+    # Erase the whole flash first. --erase-all
+    arg_erase_all_help = 'Erase the whole flash before programming, instead of only '
+    arg_erase_all_help += 'the sectors the flash image touches.'
+    parser.add_argument(
+        *('--erase-all',),
+        action      = 'store_true',
+        dest        = 'erase_all',
+        required    = False,
+        help        = arg_erase_all_help
+    )
+
+    # Number of outstanding page writes. --window
+    arg_window_help = 'Send up to N flash pages before waiting for their responses. '
+    arg_window_help += 'Falls back to 1 after an error. The default is 1.'
+    parser.add_argument(
+        *('--window',),
+        action      = 'store',
+        dest        = 'window',
+        type        = int,
+        default     = 1,
+        required    = False,
+        help        = arg_window_help
+    )
+
+    # Continue an interrupted programming. --resume
+    arg_resume_help = 'Continue an interrupted programming of the same images on this port, '
+    arg_resume_help += 'after the last page the device acknowledged, without erasing again.'
+    parser.add_argument(
+        *('--resume',),
+        action      = 'store_true',
+        dest        = 'resume',
+        required    = False,
+        help        = arg_resume_help
+    )
+
+    # Record the serial traffic. --trace
+    arg_trace_help = 'Record every chunk written to and read from the port to FILE, for \'replay\'. '
+    arg_trace_help += 'With several ports the port name is appended to FILE.'
+    parser.add_argument(
+        *('--trace',),
+        action      = 'store',
+        dest        = 'trace_file',
+        type        = str,
+        metavar     = 'FILE',
+        required    = False,
+        help        = arg_trace_help
+    )
+
+    # Write the command metrics. --metrics
+    arg_metrics_help = 'Write the count, bytes, latency histogram and errors of each command to FILE '
+    arg_metrics_help += 'when programming ends, in the Prometheus text format if FILE ends with \'.prom\', otherwise JSON.'
+    parser.add_argument(
+        *('--metrics',),
+        action      = 'store',
+        dest        = 'metrics_file',
+        type        = str,
+        metavar     = 'FILE',
+        required    = False,
+        help        = arg_metrics_help
+    )
+
+
+def parser_compile_init(parser: argparse.ArgumentParser):
+    """ Parser of CLI sub-command 'compile'.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser of sub-command 'compile'.
+    """
+
+    # Select the image. -i
+    arg_i_help = 'The image to compile, Intel HEX, Motorola S-record, ELF or raw binary (.bin).'
+    parser.add_argument(
+        *('-i', '--input'),
+        action      = 'store',
+        dest        = 'input_file',
+        type        = str,
+        required    = True,
+        help        = arg_i_help
+    )
+
+    # Select the artifact. -o
+    arg_o_help = 'The artifact to write. The default is the image with the extension \'.sprg\'.'
+    parser.add_argument(
+        *('-o', '--output'),
+        action      = 'store',
+        dest        = 'output_file',
+        type        = str,
+        required    = False,
+        help        = arg_o_help
+    )
+
+    # Page size. --page-size
+    arg_page_size_help = 'The page size of the artifact. The default is 512, the page size of all devices.'
+    parser.add_argument(
+        *('--page-size',),
+        action      = 'store',
+        dest        = 'page_size',
+        type        = int,
+        default     = 512,
+        required    = False,
+        help        = arg_page_size_help
+    )
+
+    # Load address of raw binary files. --base-address
+    arg_base_address_help = 'The address a raw binary image is programmed to, e.g. 0x10000, required by it.'
+    parser.add_argument(
+        *('--base-address',),
+        action      = 'store',
+        dest        = 'base_address',
+        type        = str,
+        required    = False,
+        help        = arg_base_address_help
+    )
+
+def parser_replay_init(parser: argparse.ArgumentParser):
+    """ Parser of CLI sub-command 'replay'.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser of sub-command 'replay'.
+    """
+
+    # Select the trace. -i
+    arg_i_help = 'The trace recorded by \'prog --trace\'. The images it programmed must exist.'
+    parser.add_argument(
+        *('-i', '--input'),
+        action      = 'store',
+        dest        = 'input_file',
+        type        = str,
+        required    = True,
+        help        = arg_i_help
+    )
+
+    # Replay as fast as possible. --fast
+    arg_fast_help = 'Answer at once, instead of with the recorded delays of the device.'
+    parser.add_argument(
+        *('--fast',),
+        action      = 'store_true',
+        dest        = 'fast',
+        required    = False,
+        help        = arg_fast_help
+    )
+
+    # Write the command metrics. --metrics
+    arg_metrics_help = 'Write the metrics of the replayed commands to FILE, see \'prog --metrics\'.'
+    parser.add_argument(
+        *('--metrics',),
+        action      = 'store',
+        dest        = 'metrics_file',
+        type        = str,
+        metavar     = 'FILE',
+        required    = False,
+        help        = arg_metrics_help
+    )
+
+def parser_simulate_init(parser: argparse.ArgumentParser):
+    """ Parser of CLI sub-command 'simulate'.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser of sub-command 'simulate'.
+    """
+
+    ## Select device type. -d
+    arg_d_help = 'The name or number of the simulated device type. The default is ATSAME54_DEVB.'
+    parser.add_argument(
+        *('-d', '--decice'),
+        action      = 'store',
+        dest        = 'device',
+        type        = str,
+        default     = 'ATSAME54_DEVB',
+        help        = arg_d_help
+    )
+
+    ## Baud rate of the wire time. -b
+    arg_b_help = 'The baud rate of the wire time. The default is the rate the programmer sets.'
+    parser.add_argument(
+        *('-b', '--baud'),
+        action      = 'store',
+        dest        = 'baud',
+        type        = int,
+        required    = False,
+        help        = arg_b_help
+    )
+
+    # Command latencies. --latency
+    arg_latency_help = 'Seconds a command takes on the device, e.g. FLASH_ERASE_ALL:0.5,FLASH_WRITE:0.001. '
+    arg_latency_help += 'Can be given several times.'
+    parser.add_argument(
+        *('--latency',),
+        action      = 'append',
+        dest        = 'latency',
+        type        = str,
+        default     = [],
+        required    = False,
+        help        = arg_latency_help
+    )
+
+    # Corrupted responses. --error-rate
+    arg_error_rate_help = 'Probability of a response with a bad checksum. The default is 0.'
+    parser.add_argument(
+        *('--error-rate',),
+        action      = 'store',
+        dest        = 'error_rate',
+        type        = float,
+        default     = 0.0,
+        required    = False,
+        help        = arg_error_rate_help
+    )
+
+    # Dropped responses. --drop-rate
+    arg_drop_rate_help = 'Probability of a response which is not sent. The default is 0.'
+    parser.add_argument(
+        *('--drop-rate',),
+        action      = 'store',
+        dest        = 'drop_rate',
+        type        = float,
+        default     = 0.0,
+        required    = False,
+        help        = arg_drop_rate_help
+    )
+
+    # Fastest baud rate of the link. --max-baud
+    arg_max_baud_help = 'Faster baud rates corrupt every response, like a link which does not sustain them.'
+    parser.add_argument(
+        *('--max-baud',),
+        action      = 'store',
+        dest        = 'max_baud',
+        type        = int,
+        required    = False,
+        help        = arg_max_baud_help
+    )
+
+    # Seed of the injected errors. --seed
+    arg_seed_help = 'Seed of the injected errors, for repeatable runs.'
+    parser.add_argument(
+        *('--seed',),
+        action      = 'store',
+        dest        = 'seed',
+        type        = int,
+        required    = False,
+        help        = arg_seed_help
+    )
+
+def parser_bench_host_init(parser: argparse.ArgumentParser):
+    """ Parser of CLI sub-command 'bench-host'.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser of sub-command 'bench-host'.
+    """
+
+    # Write the results. -o
+    arg_o_help = 'Write the results as JSON to FILE, to compare them between releases.'
+    parser.add_argument(
+        *('-o', '--output'),
+        action      = 'store',
+        dest        = 'output_file',
+        type        = str,
+        metavar     = 'FILE',
+        required    = False,
+        help        = arg_o_help
+    )
+
+    # Smaller images. --quick
+    arg_quick_help = 'Use smaller images, for a smoke test which runs in seconds.'
+    parser.add_argument(
+        *('--quick',),
+        action      = 'store_true',
+        dest        = 'quick',
+        required    = False,
+        help        = arg_quick_help
+    )
+
+def parser_link_test_init(parser: argparse.ArgumentParser):
+    """ Parser of CLI sub-command 'link-test'.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser of sub-command 'link-test'.
+    """
+
+    ## Select device type. -d
+    arg_d_help = 'The name or number of the device type. The default is auto.'
+    parser.add_argument(
+        *('-d', '--decice'),
+        action      = 'store',
+        dest        = 'device',
+        type        = str,
+        default     = 'auto',
+        help        = arg_d_help
+    )
+
+    ## Select serial com port. -p
+    arg_p_help = 'The serial port of the device, or a pyserial URL.'
+    parser.add_argument(
+        *('-p', '--port'),
+        action      = 'store',
+        dest        = 'port',
+        type        = str,
+        required    = True,
+        help        = arg_p_help
+    )
+
+    ## Candidate baud rates. -b
+    arg_b_help = 'The baud rates to test, slowest first, e.g. 115200,921600. '
+    arg_b_help += 'The first one must work. The default is the rates of \'prog -b auto\'.'
+    parser.add_argument(
+        *('-b', '--baud'),
+        action      = 'store',
+        dest        = 'baud',
+        type        = str,
+        required    = False,
+        help        = arg_b_help
+    )
+
+    # Candidate page sizes. --page-sizes
+    arg_page_sizes_help = 'The page sizes to test, e.g. 256,512,1024. The default is 256,512,1024,2048. '
+    arg_page_sizes_help += 'The baud rate is recommended by the throughput at 512, the page size of \'prog\', '
+    arg_page_sizes_help += 'which is always tested.'
+    parser.add_argument(
+        *('--page-sizes',),
+        action      = 'store',
+        dest        = 'page_sizes',
+        type        = str,
+        default     = '256,512,1024,2048',
+        required    = False,
+        help        = arg_page_sizes_help
+    )
+
+    # Number of CHK_PROTOCOL probes. --probes
+    arg_probes_help = 'CHK_PROTOCOL probes per baud rate. The default is 100.'
+    parser.add_argument(
+        *('--probes',),
+        action      = 'store',
+        dest        = 'probes',
+        type        = int,
+        default     = 100,
+        required    = False,
+        help        = arg_probes_help
+    )
+
+    # Number of pages. --pages
+    arg_pages_help = 'Pages per throughput measurement. The default is 64.'
+    parser.add_argument(
+        *('--pages',),
+        action      = 'store',
+        dest        = 'pages',
+        type        = int,
+        default     = 64,
+        required    = False,
+        help        = arg_pages_help
+    )
+
+    # Number of outstanding page commands. --window
+    arg_window_help = 'Send up to N pages before waiting for their responses, as \'prog --window\'. The default is 1.'
+    parser.add_argument(
+        *('--window',),
+        action      = 'store',
+        dest        = 'window',
+        type        = int,
+        default     = 1,
+        required    = False,
+        help        = arg_window_help
+    )
+
+    # Measure with real writes. --write
+    arg_write_help = 'Measure with FLASH_WRITE instead of FLASH_VERIFY. '
+    arg_write_help += 'The last flash sector of the application is erased and written.'
+    parser.add_argument(
+        *('--write',),
+        action      = 'store_true',
+        dest        = 'write',
+        required    = False,
+        help        = arg_write_help
+    )
+
+    # Image of the projection. -f
+    arg_f_help = 'Print the projected programming time of this flash image at the recommended settings.'
+    parser.add_argument(
+        *('-f', '--flash'),
+        action      = 'store',
+        dest        = 'flash_file',
+        type        = str,
+        required    = False,
+        help        = arg_f_help
+    )
+
+    # Load address of raw binary files. --base-address
+    arg_base_address_help = 'The address a raw binary image is programmed to, e.g. 0x10000, required by it.'
+    parser.add_argument(
+        *('--base-address',),
+        action      = 'store',
+        dest        = 'base_address',
+        type        = str,
+        required    = False,
+        help        = arg_base_address_help
+    )
+
+def _int_list(text: str) -> list:
+    """ Parse a comma separated list of positive integers, None if illegal. """
+    try:
+        res = [int(item) for item in text.split(',') if item]
+    except ValueError:
+        return None
+    if not res or min(res) < 1:
+        return None
+    return res
+
+def chk_base_address_arg(args: argparse.Namespace) -> bool:
+    """ Check and convert parameter --base-address.
+
+    Args:
+        args (argparse.Namespace): CLI paser command.
+
+    Returns:
+        bool: True, legal; False, illegal.
+    """
+    if args.base_address is not None:
+        try:
+            args.base_address = int(args.base_address, 0)
+        except ValueError:
+            args.base_address = -1
+        if args.base_address < 0:
+            print('Error: Parameter --base-address is illegal.')
+            return False
+    return True
+
+def chk_base_address_of(args: argparse.Namespace, filename: str) -> bool:
+    """ Check parameter --base-address is given for a raw binary file.
+
+    Args:
+        args (argparse.Namespace): CLI paser command, checked by `chk_base_address_arg`.
+        filename (str): The image file, it must exist.
+
+    Returns:
+        bool: True, legal; False, illegal.
+    """
+    if args.base_address is None and image.detect(filename) == 'bin':
+        print('Error: Parameter --base-address is required by the raw binary file {0}.'.format(filename))
+        return False
+    return True
+
+def chk_compile_args(args: argparse.Namespace) -> bool:
+    """ Check the 'compile' sub-command.
+
+    Args:
+        args (argparse.Namespace): CLI paser command.
+
+    Returns:
+        bool: True, legal; False, illegal.
+    """
+    if args.page_size < 1:
+        print('Error: Parameter --page-size must be 1 or more.')
+        return False
+
+    if chk_base_address_arg(args) is False:
+        return False
+
+    if not os.path.isfile(args.input_file):
+        errmsg = 'Error: Cannot find image file {0}.'
+        print(errmsg.format(args.input_file))
+        return False
+    if image.detect(args.input_file, args.base_address) is None:
+        errmsg = 'Error: The image file {0} is not a valid ihex, S-record, ELF or binary file.'
+        print(errmsg.format(args.input_file))
+        return False
+    if chk_base_address_of(args, args.input_file) is False:
+        return False
+
+    if args.output_file is None:
+        args.output_file = os.path.splitext(args.input_file)[0] + '.sprg'
+    if os.path.abspath(args.output_file) == os.path.abspath(args.input_file):
+        print('Error: The artifact can not overwrite the image.')
+        return False
+    return True
+
+def chk_replay_args(args: argparse.Namespace) -> bool:
+    """ Check the 'replay' sub-command.
+
+    Args:
+        args (argparse.Namespace): CLI paser command.
+
+    Returns:
+        bool: True, legal; False, illegal.
+    """
+    if not os.path.isfile(args.input_file):
+        errmsg = 'Error: Cannot find trace file {0}.'
+        print(errmsg.format(args.input_file))
+        return False
+    return True
+
+def chk_simulate_args(args: argparse.Namespace) -> bool:
+    """ Check and convert the 'simulate' sub-command.
+
+    Args:
+        args (argparse.Namespace): CLI paser command.
+
+    Returns:
+        bool: True, legal; False, illegal.
+    """
+    if device.get_device_by_str(args.device) < 1:
+        print('Error: Parameter --device is illegal.')
+        business.do_print_devices(args)
+        return False
+
+    latency = dict()
+    for text in args.latency:
+        try:
+            latency.update(simulator.parse_latency(text))
+        except ValueError:
+            print('Error: Parameter --latency is illegal.')
+            return False
+    args.latency = latency
+
+    if not 0 <= args.error_rate <= 1 or not 0 <= args.drop_rate <= 1:
+        print('Error: Parameter --error-rate and --drop-rate must be between 0 and 1.')
+        return False
+
+    if os.name != 'posix':
+        print('Error: Pseudo terminals are not supported, use the port \'sim://<device>\' instead.')
+        return False
+    return True
+
+def chk_link_test_args(args: argparse.Namespace) -> bool:
+    """ Check and convert the 'link-test' sub-command.
+
+    Args:
+        args (argparse.Namespace): CLI paser command.
+
+    Returns:
+        bool: True, legal; False, illegal.
+    """
+    if device.get_device_by_str(args.device) == -1:
+        print('Error: Parameter --device is illegal.')
+        business.do_print_devices(args)
+        return False
+
+    args.baudrates = device.baudrate_list if args.baud is None else _int_list(args.baud)
+    if args.baudrates is None:
+        print('Error: Parameter --baud is illegal.')
+        return False
+
+    args.page_sizes = _int_list(args.page_sizes)
+    if args.page_sizes is None:
+        print('Error: Parameter --page-sizes is illegal.')
+        return False
+
+    if args.probes < 1 or args.pages < 1 or args.window < 1:
+        print('Error: Parameter --probes, --pages and --window must be 1 or more.')
+        return False
+
+    if chk_base_address_arg(args) is False:
+        return False
+
+    if args.flash_file is not None:
+        if not os.path.isfile(args.flash_file):
+            errmsg = 'Error: Cannot find flash binary file {0}.'
+            print(errmsg.format(args.flash_file))
+            return False
+        elif chk_base_address_of(args, args.flash_file) is False:
+            return False
+        elif not image.is_image(args.flash_file, args.base_address):
+            errmsg = 'Error: The flash binary file {0} is not a valid ihex, S-record, ELF or binary file.'
+            print(errmsg.format(args.flash_file))
+            return False
+
+    available = [p[0] for p in serial.tools.list_ports.comports()]
+    if args.port not in available and '://' not in args.port and not os.path.exists(args.port):
+        print('Error: Cannot find serial port {0}.'.format(args.port))
+        print('The available serial ports are as follows:')
+        business.do_print_ports(args)
+        return False
+    return True
 
 def chk_prog_args(args: argparse.Namespace) -> bool:
     """ Check the 'prog' sub-command.
@@ -135,6 +804,23 @@ def chk_prog_args(args: argparse.Namespace) -> bool:
         business.do_print_devices(args)
         return False
 
+    ## Select serial baud rate. -b
+    if args.baud is not None and args.baud != 'auto' and not args.baud.isdigit():
+        print('Error: Parameter --baud is illegal.')
+        return False
+
+    ## Load address of raw binary files. --base-address
+    if chk_base_address_arg(args) is False:
+        return False
+
+    if args.window < 1:
+        print('Error: Parameter --window must be 1 or more.')
+        return False
+
+    if args.delta and args.erase_all:
+        print('Error: Parameter --delta and --erase-all can not be used together.')
+        return False
+
     # Check whether it is ext_flash_boot status.
     if (args.ext_flash_boot):
         pass
@@ -149,8 +835,10 @@ def chk_prog_args(args: argparse.Namespace) -> bool:
             errmsg = 'Error: Cannot find flash binary file {0}.'
             print(errmsg.format(args.flash_file))
             return False
-        elif not ihex.is_ihex(args.flash_file):
-            errmsg = 'Error: The flash binary file {0} is not ihex formatted.'
+        elif chk_base_address_of(args, args.flash_file) is False:
+            return False
+        elif not image.is_image(args.flash_file, args.base_address):
+            errmsg = 'Error: The flash binary file {0} is not a valid ihex, S-record, ELF or binary file.'
             print(errmsg.format(args.flash_file))
             return False
 
@@ -160,8 +848,12 @@ def chk_prog_args(args: argparse.Namespace) -> bool:
             errmsg = 'Error: Cannot find flash binary file {0}.'
             print(errmsg.format(args.ext_flash_file))
             return False
-        elif not ihex.is_ihex(args.ext_flash_file):
-            errmsg = 'Error: The flash binary file {0} is not ihex formatted.'
+        elif chk_base_address_of(args, args.ext_flash_file) is False:
+            return False
+        elif args.stream and image.detect(args.ext_flash_file, args.base_address) is None or \
+                not args.stream and not image.is_image(args.ext_flash_file, args.base_address):
+            # a streamed file is checked while it is programmed
+            errmsg = 'Error: The flash binary file {0} is not a valid ihex, S-record, ELF or binary file.'
             print(errmsg.format(args.ext_flash_file))
             return False
 
@@ -171,17 +863,67 @@ def chk_prog_args(args: argparse.Namespace) -> bool:
             errmsg = 'Error: Cannot find eeprom binary file {0}.'
             print(errmsg.format(args.eeprom_file))
             return False
-        elif not ihex.is_ihex(args.eeprom_file):
-            errmsg = 'Error: The eeprom binary file {0} is not ihex formatted.'
+        elif chk_base_address_of(args, args.eeprom_file) is False:
+            return False
+        elif not image.is_image(args.eeprom_file, args.base_address):
+            errmsg = 'Error: The eeprom binary file {0} is not a valid ihex, S-record, ELF or binary file.'
             print(errmsg.format(args.eeprom_file))
             return False
 
     # Serial port check.
-    if args.port not in [p[0] for p in serial.tools.list_ports.comports()]:
-        print('Error: Cannot find serial port {0}.'.format(args.port))
-        print('The available serial ports are as follows:')
-        business.do_print_ports(args)
+    args.port = expand_ports(args.port)
+    if not args.port:
+        print('Error: No serial port matches parameter --port.')
         return False
+    available = [p[0] for p in serial.tools.list_ports.comports()]
+    for port in args.port:
+        # pyserial URLs and device files which are not listed, e.g. pseudo terminals
+        if port not in available and '://' not in port and not os.path.exists(port):
+            print('Error: Cannot find serial port {0}.'.format(port))
+            print('The available serial ports are as follows:')
+            business.do_print_ports(args)
+            return False
+
+def expand_ports(patterns: list) -> list:
+    """ Expand the glob patterns in the ports of parameter --port.
+
+    A pattern matches the available serial ports and the files of the
+    file system. Ports without wildcards and pyserial URLs are kept as they are.
+
+    Args:
+        patterns (list): Ports and glob patterns.
+
+    Returns:
+        list: Ports, without duplicates, in the given order.
+    """
+    available = [p[0] for p in serial.tools.list_ports.comports()]
+    ports = []
+    for pattern in patterns:
+        if glob.has_magic(pattern) and '://' not in pattern:
+            matched = fnmatch.filter(available, pattern) + glob.glob(pattern)
+            matched.sort()
+        else:
+            matched = [pattern]
+        for port in matched:
+            if port not in ports:
+                ports.append(port)
+    return ports
+
+def chk_bench_host_args(args: argparse.Namespace) -> bool:
+    """ Check the 'bench-host' sub-command.
+
+    Args:
+        args (argparse.Namespace): CLI paser command.
+
+    Returns:
+        bool: True, legal; False, illegal.
+    """
+    if args.output_file is not None:
+        folder = os.path.dirname(os.path.abspath(args.output_file))
+        if not os.path.isdir(folder):
+            print('Error: Cannot find the folder of {0}.'.format(args.output_file))
+            return False
+    return True
 
 def chk_print_ports_args(args: argparse.Namespace) -> bool:
     """ Check the 'print-ports' sub-command.
@@ -10,6 +10,9 @@ device_list = [
         'protocol_version': 0,
         'userapp_start': 0,
         'userapp_size':  0,
+        'flash_sector_size': 0,
+        'baudrate': 115200,
+        'prog_time': {'flash_page': 0, 'ext_flash_page': 0, 'eeprom_page': 0, 'overhead': 0},
         'note': 'Default, auto detect device type.'
     },
     {
@@ -18,6 +21,9 @@ device_list = [
         'protocol_version': 1,
         'userapp_start': 0x00010000,
         'userapp_size':  0x000F0000,
+        'flash_sector_size': 0x2000,
+        'baudrate': 115200,
+        'prog_time': {'flash_page': 0.23, 'ext_flash_page': 0.3, 'eeprom_page': 0.05, 'overhead': 4.5},
         'note': ''
     },
     {
@@ -26,10 +32,20 @@ device_list = [
         'protocol_version': 1,
         'userapp_start': 0x00010000,
         'userapp_size':  0x000F0000,
+        'flash_sector_size': 0x1000,
+        'baudrate': 115200,
+        'prog_time': {'flash_page': 0.14, 'ext_flash_page': 0.2, 'eeprom_page': 0.05, 'overhead': 3.3},
         'note': ''
     }
 ]
 
+# 'prog_time' is the seconds per page and the fixed seconds of a programming
+# at 115200 baud, used until `serprog.timing` has measured the device.
+
+# Candidate baud rates of the automatic baud rate negotiation, slowest first.
+# The first one is the safe rate which every device supports.
+baudrate_list = [115200, 230400, 460800, 921600, 1000000, 2000000, 3000000]
+
 def get_device_by_str(s: str) -> int:
     """ Get the device number.
 
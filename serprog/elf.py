@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""ELF functions.
+
+This module loads the PT_LOAD segments of an ELF executable, the same data
+`objcopy -O ihex` would write. Segments are placed at their physical (load)
+address, and the file is memory mapped so the data is never copied.
+"""
+
+from serprog import exceptions
+from serprog.sparseimage import SparseImage
+
+import mmap
+import struct
+
+MAGIC = b'\x7fELF'
+
+PT_LOAD = 1
+
+# e_phoff, e_phentsize, e_phnum of the file header, after e_ident
+_EHDR = {1: ('HHIIIIIHHH', 4, 8, 9), 2: ('HHIQQQIHHH', 4, 8, 9)}
+# p_type, p_offset, p_paddr, p_filesz of a program header
+_PHDR = {1: ('IIIIIIII', 0, 1, 3, 4), 2: ('IIQQQQQQ', 0, 2, 4, 5)}
+
+
+def parse(filename: str) -> SparseImage:
+    """ Load the PT_LOAD segments of an ELF file to a sparse image.
+
+    Both 32 and 64 bits, little and big endian files are supported.
+    Segments without file data (e.g. .bss) are skipped.
+
+    Args:
+        filename (str): The file to load.
+
+    Raises:
+        serprog.exceptions.ElfFormatError:
+
+    Returns:
+        SparseImage: The segments as views of the mapped file.
+    """
+    with open(filename, 'rb') as elffile:
+        try:
+            mm = mmap.mmap(elffile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            raise exceptions.ElfFormatError(filename)
+    view = memoryview(mm)
+
+    try:
+        if view[:4] != MAGIC or view[4] not in _EHDR or view[5] not in (1, 2):
+            raise exceptions.ElfFormatError(filename)
+        order = '<' if view[5] == 1 else '>'
+
+        fmt, i_phoff, i_phentsize, i_phnum = _EHDR[view[4]]
+        ehdr = struct.unpack_from(order + fmt, view, 16)
+        phoff, phentsize, phnum = ehdr[i_phoff], ehdr[i_phentsize], ehdr[i_phnum]
+
+        fmt, i_type, i_offset, i_paddr, i_filesz = _PHDR[view[4]]
+        phdr = struct.Struct(order + fmt)
+        if phentsize < phdr.size:
+            raise exceptions.ElfFormatError(filename)
+
+        img = SparseImage()
+        for n in range(phnum):
+            ph = phdr.unpack_from(view, phoff + n * phentsize)
+            if ph[i_type] != PT_LOAD or ph[i_filesz] == 0:
+                continue
+            offset, size = ph[i_offset], ph[i_filesz]
+            if offset + size > len(view):
+                raise exceptions.ElfFormatError(filename)
+            img.add(ph[i_paddr], view[offset : offset + size], copy=False)
+        img.merge()
+    except (IndexError, struct.error, exceptions.ImageOverlapError) as e:
+        raise exceptions.ElfFormatError(filename) from e
+    return img
+
+
+def is_elf(filename: str) -> bool:
+    """Check the file is an ELF file with loadable segments.
+
+    Args:
+        filename (str): The file to check.
+
+    Returns:
+        bool: True or False.
+    """
+    try:
+        parse(filename)
+    except exceptions.ElfFormatError:
+        return False
+    return True
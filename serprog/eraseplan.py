@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Erase planning.
+
+This module maps the pages of an image onto the erase sectors of a device,
+so only the sectors the image touches are erased, each one right before
+its pages are programmed.
+"""
+
+def plan(pages: list, sector_size: int) -> list:
+    """Group pages by the erase sector they are in.
+
+    Args:
+        pages (list): response from `serprog.ihex.cut_to_pages`, sorted by address.
+        sector_size (int): erase sector size of the device, e.g. 4096, 8192.
+
+    Returns:
+        list: sectors in address order. Each sector is a dict with
+            'sector' (sector number, address // sector_size),
+            'start' and 'end' (range of the page indexes in the sector).
+    """
+    res = []
+    for i, page in enumerate(pages):
+        sector = page['address'] // sector_size
+        if res and res[-1]['sector'] == sector:
+            res[-1]['end'] = i + 1
+        else:
+            res.append({'sector': sector, 'start': i, 'end': i + 1})
+    return res
+
+
+def erase_size(sectors: list, sector_size: int) -> int:
+    """Bytes of flash erased by a plan.
+
+    Args:
+        sectors (list): response from `serprog.eraseplan.plan`.
+        sector_size (int): erase sector size of the device.
+
+    Returns:
+        int: erased bytes.
+    """
+    return len(sectors) * sector_size
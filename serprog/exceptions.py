@@ -2,10 +2,40 @@
 class Error(Exception):
     pass
 
-class IhexFormatError(Error):
+class ImageFormatError(Error):
     filename: str
-    def __init__(self, filename):
+    lineno: int
+    kind = 'image'
+    def __init__(self, filename, lineno=0):
         self.filename = filename
+        self.lineno = lineno
+
+    def __str__(self):
+        if self.lineno:
+            return '{0}:{1}: bad {2} record'.format(self.filename, self.lineno, self.kind)
+        return '{0}: bad {1} file'.format(self.filename, self.kind)
+
+class IhexFormatError(ImageFormatError):
+    kind = 'ihex'
+
+class SrecFormatError(ImageFormatError):
+    kind = 'srec'
+
+class ElfFormatError(ImageFormatError):
+    kind = 'ELF'
+
+class BaseAddressError(ImageFormatError):
+    def __str__(self):
+        return '{0}: raw binary file needs a base address'.format(self.filename)
+
+class ArtifactHashError(ImageFormatError):
+    address: int
+    def __init__(self, filename, address):
+        super().__init__(filename)
+        self.address = address
+
+    def __str__(self):
+        return '{0}: page at 0x{1:08X} does not match its hash'.format(self.filename, self.address)
 
 class FlashIsNotIhexError(Error):
     filename: str
@@ -36,3 +66,49 @@ class CheckDeviceError(Error):
     def __init__(self, in_dev, real_dev):
         self.in_dev = in_dev
         self.real_dev = real_dev
+
+class ImageOverlapError(Error):
+    address: int
+    size: int
+    def __init__(self, address, size):
+        self.address = address
+        self.size = size
+
+    def __str__(self):
+        return 'data at 0x{0:08X} ({1} bytes) overlaps other data'.format(self.address, self.size)
+
+class ImageRangeError(Error):
+    filename: str
+    address: int
+    start: int
+    end: int
+    def __init__(self, filename, address, start, end):
+        self.filename = filename
+        self.address = address
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        return '{0}: data at 0x{1:08X} is outside the application area 0x{2:08X}-0x{3:08X}'.format(
+            self.filename, self.address, self.start, self.end)
+
+class SectorSizeError(Error):
+    device_name: str
+    sector_size: int
+    address: int
+    def __init__(self, device_name, sector_size, address):
+        self.device_name = device_name
+        self.sector_size = sector_size
+        self.address = address
+
+    def __str__(self):
+        return '{0}: application area at 0x{1:08X} is not aligned to the sector size 0x{2:X}'.format(
+            self.device_name, self.address, self.sector_size)
+
+class TraceFormatError(Error):
+    filename: str
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __str__(self):
+        return '{0}: bad trace file'.format(self.filename)
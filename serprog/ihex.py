@@ -14,171 +14,270 @@ loader is supprot ihex file. The output binary data of compiler
 """
 
 from serprog import exceptions
+from serprog.sparseimage import SparseImage
 
-def parse(filename: str) -> list:
-    """ Parse ihex file to data blocks.
+# IHEX record types
+DATA_RECORD = 0
+EOF_RECORD = 1
+EXT_SEG_ADDR_RECORD = 2
+START_SEG_ADDR_RECORD = 3
+EXT_LINEAR_ADDR_RECORD = 4
+START_LINEAR_ADDR_RECORD = 5
+
+
+def _decode_lines(filename: str, lines):
+    """ Decode records line by line.
+
+    Yields:
+        tuple: (line number, record bytes from length to checksum)
+    """
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip()
+        if not line.startswith(':'):
+            raise exceptions.IhexFormatError(filename, lineno)
+        try:
+            record = bytes.fromhex(line[1:])
+        except ValueError:
+            raise exceptions.IhexFormatError(filename, lineno)
+        yield lineno, record
+
+
+def _decode_bulk(filename: str, text: bytes):
+    """ Decode all records of a file with one `bytes.fromhex`.
+
+    Raises:
+        ValueError: The file has characters which are not hex digits, or
+            spaces inside a line, use `_decode_lines`.
+
+    Yields:
+        tuple: (line number, record bytes from length to checksum)
+    """
+    # trailing spaces and the '\r' of CRLF files, like `_decode_lines`
+    lines = [line.rstrip() for line in text.splitlines()]
+    digits = b''.join(lines).replace(b':', b'')
+    blob = bytes.fromhex(digits.decode('ascii'))
+    if len(blob) * 2 != len(digits):
+        # spaces inside a line, the records are not where the line lengths say
+        raise ValueError
+    pos = 0
+    for lineno, line in enumerate(lines, 1):
+        size = (len(line) - 1) >> 1
+        if not line.startswith(b':') or not len(line) & 1:
+            raise exceptions.IhexFormatError(filename, lineno)
+        yield lineno, blob[pos : pos + size]
+        pos += size
+
+
+def _walk_records(filename: str, records):
+    """ Check records and resolve their addresses.
+
+    Every record checksum is verified. The base address is set by the
+    last extended segment (02) or extended linear (04) address record.
+
+    Yields:
+        tuple: (address, data) of each data record.
+    """
+    base = 0
+    lineno = 0
+    for lineno, record in records:
+        length = len(record) - 5
+        if length < 0 or record[0] != length:
+            # record length does not match the line
+            raise exceptions.IhexFormatError(filename, lineno)
+        if sum(record) & 0xFF:
+            # checksum error
+            raise exceptions.IhexFormatError(filename, lineno)
+
+        record_type = record[3]
+        if record_type == DATA_RECORD:
+            if length:
+                yield base + ((record[1] << 8) | record[2]), record[4 : 4 + length]
+
+        elif record_type == EOF_RECORD:
+            if length != 0 or record[1] or record[2]:
+                raise exceptions.IhexFormatError(filename, lineno)
+            return
+
+        elif record_type == EXT_SEG_ADDR_RECORD:
+            if length != 2:
+                raise exceptions.IhexFormatError(filename, lineno)
+            base = ((record[4] << 8) | record[5]) << 4
+
+        elif record_type == EXT_LINEAR_ADDR_RECORD:
+            if length != 2:
+                raise exceptions.IhexFormatError(filename, lineno)
+            base = ((record[4] << 8) | record[5]) << 16
+
+        elif record_type in (START_SEG_ADDR_RECORD, START_LINEAR_ADDR_RECORD):
+            pass
+
+        else:
+            raise exceptions.IhexFormatError(filename, lineno)
+
+    # no end of file record
+    raise exceptions.IhexFormatError(filename, lineno + 1)
+
+
+def iter_records(filename: str):
+    """ Read the data records of an ihex file one by one.
+
+    The file is read line by line, so records are available before the
+    whole file is parsed.
+
+    Args:
+        filename (str): The file to read.
+
+    Raises:
+        serprog.exceptions.IhexFormatError: Raised when the bad record is reached.
+
+    Yields:
+        tuple: (address, data) of each data record, address includes the extended address.
+    """
+    with open(filename, 'r') as hexfile:
+        yield from _walk_records(filename, _decode_lines(filename, hexfile))
+
+
+def parse(filename: str) -> SparseImage:
+    """ Parse ihex file to a sparse image.
+
+    The whole file is decoded at once, and every record checksum is verified.
+    Records can be in any order, but must not overlap.
     
     Args:
         filename (str): The file to parse.
     
     Raises:
-        serprog.exceptions.IhexFormatError:
+        serprog.exceptions.IhexFormatError: `lineno` is the line of the bad record,
+            or 0 when records overlap.
     
     Returns:
-        list: data blocks with start address.
+        SparseImage: data segments with start address.
     """
+    with open(filename, 'rb') as hexfile:
+        text = hexfile.read()
 
-    # IHEX record types
-    DATA_RECORD = 0
-    EOF_RECORD = 1
-    EXT_SEG_ADDR_RECORD = 2
-    START_SEG_ADDR_RECORD = 3
-    EXT_LINEAR_ADDR_RECORD = 4
-    START_LINEAR_ADDR_RECORD = 5
+    try:
+        return _to_image(filename, _walk_records(filename, _decode_bulk(filename, text)))
+    except ValueError:
+        # not hex digits somewhere, find the line
+        return _to_image(filename, iter_records(filename))
 
-    with open(filename, 'r') as hexfile:
-        sections = []
-        section_index = 0
-        extend_address = 0
-        extend_seg_address = 0
-        extend_lin_address = 0
-        eof_flag = False
-
-        for line in hexfile.readlines():
-            # line is end up with '\n'
-            if len(line) < 12:
-                # less than minimum length of General Record Format
-                raise exceptions.IhexFormatError(filename)
 
-            # Check record mark
-            if not line.startswith(':'):
+def _to_image(filename: str, records) -> SparseImage:
+    """ Add records to a sparse image.
+    """
+    img = SparseImage()
+    try:
+        img.update(records)
+    except exceptions.ImageOverlapError as e:
+        raise exceptions.IhexFormatError(filename) from e
+    return img
+
+
+def iter_pages(records, pgsz: int, space_data: bytes, filename: str = ''):
+    """Cut data records to pages while they are read.
+
+    The same pages as `padding_space` and `cut_to_pages`, but only the
+    current page is kept in memory. Records may be in any order inside a
+    page, but the pages must be in ascending address order, as a page is
+    not read again once the next one has started.
+
+    Args:
+        records (iterable): (address, data) records, e.g. from `serprog.ihex.iter_records`.
+        pgsz (int): page size, e.g. 256, 512.
+        space_data (bytes): the byte data used to padding.
+        filename (str, optional): The file of the records, for the error.
+
+    Raises:
+        serprog.exceptions.IhexFormatError: A record is before the current page.
+
+    Yields:
+        dict: data page
+    """
+    page_addr = None
+    page = None
+    for address, data in records:
+        offset = 0
+        while offset < len(data):
+            addr = address + offset
+            base = (addr // pgsz) * pgsz
+            if page_addr is not None and base < page_addr:
                 raise exceptions.IhexFormatError(filename)
-            
-            # Parse IHEX record fields
-            record_length = int(line[1:3], 16)
-            address = int(line[3:7], 16)
-            record_type = int(line[7:9], 16)
-            checksum = int(line[-3:-1], 16)
-
-            # check record length and parse data
-            if record_length != 0:
-                if len(line) != 12 + record_length * 2:
-                    raise exceptions.IhexFormatError(filename)
-                else:
-                    data = bytearray.fromhex(line[9 : 9 + record_length*2])
-            else:
-                data = b''
-
-            if record_type == DATA_RECORD:
-                # Data record
-                # 32-bit extended address
-                if extend_seg_address != 0:
-                    extend_address = extend_seg_address << 4
-                elif extend_lin_address != 0:
-                    extend_address = extend_lin_address << 16
-
-                if section_index == 0:
-                    # First section
-                    sections.append({
-                        'address': extend_address + address,
-                        'data': data
-                    })
-                    section_index += 1
-
-                elif extend_address + address == sections[section_index-1]['address'] + len(sections[section_index-1]['data']):
-                    # Add data to previous section
-                    sections[section_index-1]['data'] += data
-
-                else:
-                    # Start new section
-                    sections.append({
-                        'address': extend_address + address,
-                        'data': data
-                    })
-                    section_index += 1
-
-            elif record_type == EOF_RECORD:
-                # End of file record
-                if address == 0:
-                    eof_flag = True
-                else:
-                    raise exceptions.IhexFormatError(filename)
-
-            elif record_type == EXT_SEG_ADDR_RECORD:
-                # Extended Segment Address
-                extend_seg_address = int(line[9:13], 16)
-                pass
-
-            elif record_type == START_SEG_ADDR_RECORD:
-                # Start Segment Address
-                pass
-
-            elif record_type == EXT_LINEAR_ADDR_RECORD:
-                # Extended Linear Address
-                extend_lin_address = int(line[9:13], 16)
-                pass
-
-            elif record_type == START_LINEAR_ADDR_RECORD:
-                # Start Linear Address
-                pass
-
-        if not eof_flag:
-            raise exceptions.IhexFormatError(filename)
-
-    return sections
+            if base != page_addr:
+                if page is not None:
+                    yield {'address': page_addr, 'data': bytes(page)}
+                page_addr = base
+                page = bytearray(space_data * pgsz)
+            n = min(len(data) - offset, base + pgsz - addr)
+            page[addr - base : addr - base + n] = data[offset : offset + n]
+            offset += n
+    if page is not None:
+        yield {'address': page_addr, 'data': bytes(page)}
 
 
 def padding_space(h, pgsz: int, space_data: bytes) -> list: 
     """Padding each data block with `space_data` to let block size fit pgsz * N.
+
+    Blocks which share a page are merged.
     
     Args:
-        h (list): response from `serprog.ihex.parse`.
+        h (SparseImage or list): response from `serprog.ihex.parse`, or data blocks.
         pgsz (int): page size, e.g. 256, 512.
         space_data (bytes): the byte data used to padding.
     
     Returns:
         list: data blocks
     """
-    res = []
-    for sect in h:
-        sect_addr, sect_data = sect['address'], sect['data']
-
-        # (start address) not equal (pgsz * N)
-        # Pad before the data
-        start_padding_len = sect_addr % pgsz
-        start_padding = bytes(space_data * start_padding_len)
-        sect_data = start_padding + sect_data
-
-        # (end address + 1) not equal (pgsz * N)
-        # Pad after the data
-        end_padding_len = pgsz - len(sect_data) % pgsz if len(sect_data) % pgsz != 0 else 0
-        end_padding = bytes(space_data * end_padding_len)
-        sect_data = sect_data + end_padding
+    if not isinstance(h, SparseImage):
+        h = SparseImage.from_sections(h)
+    return [{'address': address, 'data': buf} for address, buf in h.runs(pgsz, space_data)]
 
-        res.append({'address': (sect_addr // pgsz) * pgsz, 'data': sect_data})
-
-    return res
 
-
-def cut_to_pages(h, pgsz):
+def cut_to_pages(h, pgsz, space_data: bytes = b'\xFF'):
     """Cut each data block to pages.
     
     Args:
-        h (list): response from `serprog.ihex.padding_space`.
+        h (SparseImage or list): response from `serprog.ihex.parse`,
+            or from `serprog.ihex.padding_space`.
         pgsz (int): page size, e.g. 256, 512.
+        space_data (bytes, optional): the byte data used to padding a SparseImage.
+            The default is b'\\xFF'.
     
     Returns:
-        list: data pages
+        list: data pages, 'data' is a read only memoryview
     """
+    if isinstance(h, SparseImage):
+        return list(h.pages(pgsz, space_data))
+
     res = []
     for sect in h:
-        sect_addr, sect_data = sect['address'], sect['data']
+        sect_addr, sect_data = sect['address'], memoryview(sect['data']).toreadonly()
         for i in range(0, len(sect_data), pgsz):
             page = {'address': sect_addr + i, 'data': sect_data[i : i + pgsz]}
             res.append(page)
     return res
 
 
+def drop_blank_pages(h, space_data: bytes) -> list:
+    """Drop the pages which only contain `space_data`, e.g. erased flash.
+    
+    Args:
+        h (list): response from `serprog.ihex.cut_to_pages`.
+        space_data (bytes): the byte data of blank memory.
+    
+    Returns:
+        list: data pages which are not blank
+    """
+    res = []
+    blank = b''
+    for page in h:
+        if len(blank) != len(page['data']):
+            blank = bytes(space_data * len(page['data']))
+        if page['data'] != blank:
+            res.append(page)
+    return res
+
+
 def is_ihex(filename: str) -> bool:
     """Check the file is ihex format.
     
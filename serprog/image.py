@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Programming image.
+
+An image is a programming file which has been parsed and cut to pages.
+It is read only after loading, so one image can be shared by several
+`serprog.loader.Loader` objects, e.g. when programming many ports at once.
+
+Programming files are ihex, Motorola S-record, ELF or raw binary. The
+format is detected from the first bytes of the file. ELF and raw binary
+files are memory mapped, their full pages are views of the file.
+Artifacts written by `serprog compile` (see `serprog.artifact`) are
+already cut to pages and are mapped without parsing.
+
+Loaded images are cached by path, size and modification time, so checking
+a file and programming it in the same run parses it only once.
+"""
+
+from serprog import artifact
+from serprog import elf
+from serprog import exceptions
+from serprog import ihex
+from serprog import srec
+from serprog.sparseimage import SparseImage
+
+import mmap
+import os
+import threading
+
+class Image():
+    """ Parsed programming file cut to pages.
+
+    Attributes:
+        filename (str): The programming file.
+        size (int): Bytes of data in the file, without padding.
+        pages (list): Pages as returned by `serprog.ihex.cut_to_pages`, in address order.
+            The page data are read only views of one padded buffer per run of pages.
+            For an artifact it is a `serprog.artifact.Pages`.
+    """
+    __slots__ = ('filename', 'size', 'pages')
+
+    def __init__(self, filename: str, size: int, pages: list):
+        self.filename = filename
+        self.size     = size
+        self.pages    = pages
+
+
+def detect(filename: str, base_address: int = None) -> str:
+    """ Detect the format of a programming file from its first bytes.
+
+    A file with the extension '.bin' is raw binary. A file of no other
+    format is also raw binary if `base_address` is given.
+
+    Args:
+        filename (str): The file to check.
+        base_address (int, optional): Load address of raw binary files. The default is None.
+
+    Returns:
+        str: 'artifact', 'ihex', 'srec', 'elf' or 'bin', None if the format is unknown.
+    """
+    with open(filename, 'rb') as f:
+        head = f.read(16)
+    if head.startswith(artifact.MAGIC):
+        return 'artifact'
+    if head.startswith(elf.MAGIC):
+        return 'elf'
+    if os.path.splitext(filename)[1].lower() == '.bin':
+        # any first bytes are valid
+        return 'bin'
+    text = head.lstrip()
+    if text.startswith(b':'):
+        return 'ihex'
+    if text[:1] == b'S' and text[1:2].isdigit():
+        return 'srec'
+    if base_address is not None:
+        return 'bin'
+    return None
+
+def parse_bin(filename: str, base_address: int) -> SparseImage:
+    """ Load a raw binary file to a sparse image.
+
+    Args:
+        filename (str): The file to load.
+        base_address (int): Address of the first byte.
+
+    Returns:
+        SparseImage: The file as one segment, a view of the mapped file.
+    """
+    img = SparseImage()
+    with open(filename, 'rb') as binfile:
+        if os.fstat(binfile.fileno()).st_size == 0:
+            return img
+        mm = mmap.mmap(binfile.fileno(), 0, access=mmap.ACCESS_READ)
+    img.add(base_address, memoryview(mm), copy=False)
+    return img
+
+def parse(filename: str, base_address: int = None) -> SparseImage:
+    """ Parse a programming file of any supported format.
+
+    Args:
+        filename (str): The file to parse.
+        base_address (int, optional): Load address of raw binary files, they
+            can not be parsed without it. The default is None.
+
+    Raises:
+        serprog.exceptions.ImageFormatError: The format is unknown, or the file is bad.
+        serprog.exceptions.BaseAddressError: A raw binary file without `base_address`.
+
+    Returns:
+        SparseImage: data segments with start address.
+    """
+    fmt = detect(filename, base_address)
+    if fmt == 'ihex':
+        return ihex.parse(filename)
+    if fmt == 'srec':
+        return srec.parse(filename)
+    if fmt == 'elf':
+        return elf.parse(filename)
+    if fmt == 'artifact':
+        # the padded pages as they are
+        img = SparseImage()
+        for page in artifact.load(filename)[2]:
+            img.add(page['address'], page['data'], copy=False)
+        return img
+    if fmt == 'bin':
+        if base_address is None:
+            raise exceptions.BaseAddressError(filename)
+        return parse_bin(filename, base_address)
+    raise exceptions.ImageFormatError(filename)
+
+def iter_records(filename: str, base_address: int = None):
+    """ Read the data of a programming file while it is parsed.
+
+    Text formats are read record by record, ELF and raw binary files are
+    mapped and read segment by segment.
+
+    Args:
+        filename (str): The file to read.
+        base_address (int, optional): Load address of raw binary files. The default is None.
+
+    Raises:
+        serprog.exceptions.ImageFormatError: Raised when the bad record is reached.
+
+    Yields:
+        tuple: (address, data) of each record or segment.
+    """
+    fmt = detect(filename, base_address)
+    if fmt == 'ihex':
+        yield from ihex.iter_records(filename)
+    elif fmt == 'srec':
+        yield from srec.iter_records(filename)
+    else:
+        for seg in parse(filename, base_address):
+            yield seg['address'], seg['data']
+
+
+# (abspath, pgsz, space_data, base_address) -> (st_size, st_mtime_ns, Image)
+_cache = dict()
+_cache_lock = threading.Lock()
+
+def load(filename: str, pgsz: int = 512, space_data: bytes = b'\xFF',
+         base_address: int = None) -> Image:
+    """ Parse a programming file and cut it to pages.
+
+    The image is taken from the cache if the file has the same size and
+    modification time as when it was loaded.
+
+    Args:
+        filename (str): The file to load.
+        pgsz (int, optional): page size. The default is 512.
+        space_data (bytes, optional): the byte data used to padding. The default is b'\\xFF'.
+        base_address (int, optional): Load address of raw binary files. The default is None.
+
+    Raises:
+        FileNotFoundError:
+        serprog.exceptions.ImageFormatError:
+
+    Returns:
+        Image: The loaded image.
+    """
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), pgsz, space_data, base_address)
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns):
+        return cached[2]
+
+    img = None
+    if detect(filename, base_address) == 'artifact':
+        art_pgsz, size, pages = artifact.load(filename)
+        if art_pgsz == pgsz:
+            img = Image(filename, size, pages)
+    if img is None:
+        data = parse(filename, base_address)
+        img = Image(filename, data.size, ihex.cut_to_pages(data, pgsz, space_data))
+
+    with _cache_lock:
+        _cache[key] = (st.st_size, st.st_mtime_ns, img)
+    return img
+
+def is_image(filename: str, base_address: int = None) -> bool:
+    """ Check the file is a programming file of a supported format.
+
+    The file is loaded with the default page size and kept in the cache,
+    so loading it again to program it costs nothing.
+
+    Args:
+        filename (str): The file to check.
+        base_address (int, optional): Load address of raw binary files. The default is None.
+
+    Returns:
+        bool: True or False.
+    """
+    try:
+        load(filename, base_address=base_address)
+    except exceptions.ImageFormatError:
+        return False
+    return True
+
+def clear_cache():
+    """ Drop all cached images.
+    """
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Link characterisation.
+
+Measures the link between the host and a device, to compare fixtures,
+hubs, cables and adapters:
+
+    - the round trip latency of CHK_PROTOCOL,
+    - the error rate of CHK_PROTOCOL probes at each candidate baud rate,
+    - the sustained throughput of page commands at several page sizes.
+
+Page throughput is measured with FLASH_VERIFY by default, which carries
+the same payload as FLASH_WRITE but leaves the flash as it is. With
+`write` the last flash sector is erased and really written, and erased
+again at the end.
+
+The baud rate is recommended by the throughput at `PAGE_SIZE`, the page
+size `serprog.loader.Loader` programs with. The other page sizes are
+only measured.
+"""
+
+from serprog import bootprotocol
+from serprog import device
+from serprog import exceptions
+from serprog.loader import CommandTrnasHandler
+
+import serial
+import time
+
+# flash page size of serprog.loader.Loader
+PAGE_SIZE = 512
+
+
+def percentiles(samples: list, qs: tuple = (0.5, 0.9, 0.99)) -> dict:
+    """ Percentiles of samples, by the nearest rank.
+
+    Returns:
+        dict: q -> value, and 'max'. Empty if there are no samples.
+    """
+    if not samples:
+        return dict()
+    ordered = sorted(samples)
+    res = {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in qs}
+    res['max'] = ordered[-1]
+    return res
+
+
+def round_trips(cth: CommandTrnasHandler, probes: int) -> tuple:
+    """ Send CHK_PROTOCOL probes one by one.
+
+    Args:
+        cth (CommandTrnasHandler): Handler of the opened port.
+        probes (int): Number of probes.
+
+    Returns:
+        tuple: (seconds of each answered probe, failed probes)
+    """
+    rtts = []
+    errors = 0
+    for _ in range(probes):
+        start = time.perf_counter()
+        try:
+            res, _ = cth.cmd_chk_protocol()
+        except exceptions.ComuError:
+            res = False
+        if res:
+            rtts.append(time.perf_counter() - start)
+        else:
+            errors += 1
+    return rtts, errors
+
+
+def page_throughput(cth: CommandTrnasHandler, address: int, pgsz: int, pages: int,
+                    window: int = 1, write: bool = False, sector_size: int = 0) -> dict:
+    """ Send page commands back to back.
+
+    Args:
+        cth (CommandTrnasHandler): Handler of the opened port.
+        address (int): Address of the pages, the start of a flash sector for `write`.
+        pgsz (int): Page size, set with FLASH_SET_PGSZ before.
+        pages (int): Number of pages.
+        window (int, optional): Commands sent before their responses are received. The default is 1.
+        write (bool, optional): FLASH_WRITE to the sector at `address`, erased
+            whenever it is full, instead of FLASH_VERIFY. The default is False.
+        sector_size (int, optional): Flash sector size, for `write`. The default is 0.
+
+    Raises:
+        exceptions.ComuError: No response.
+
+    Returns:
+        dict: 'pages', 'seconds' (without erases), 'page_s', 'KBps', 'erase_s'
+            (mean seconds of an erase, 0 without `write`) and 'errors' (negative
+            FLASH_WRITE responses, 0 without `write` as the answer of FLASH_VERIFY
+            depends on the flash content).
+    """
+    cmd = bootprotocol.CMD.FLASH_WRITE if write else bootprotocol.CMD.FLASH_VERIFY
+    put = cth.put_flash_write if write else cth.put_flash_verify
+    per_sector = max(1, sector_size // pgsz) if write else pages
+    data = bytes([0x5A]) * pgsz
+
+    seconds = erase_s = 0.0
+    erases = errors = 0
+    sent = 0
+    while sent < pages:
+        count = min(per_sector, pages - sent)
+        if write:
+            start = time.perf_counter()
+            res, _ = cth.cmd_flash_erase_sector(address // sector_size)
+            if res is False:
+                raise exceptions.ComuError
+            erase_s += time.perf_counter() - start
+            erases += 1
+
+        start = time.perf_counter()
+        inflight = 0
+        # a negative FLASH_VERIFY only says the flash holds other data
+        for i in range(count):
+            put(address + (i * pgsz if write else 0), data)
+            inflight += 1
+            if inflight == window:
+                errors += not cth.get_write_ack(cmd) and write
+                inflight -= 1
+        for _ in range(inflight):
+            errors += not cth.get_write_ack(cmd) and write
+        seconds += time.perf_counter() - start
+        sent += count
+
+    if write:
+        cth.cmd_flash_erase_sector(address // sector_size)
+    return {
+        'pages': pages,
+        'seconds': seconds,
+        'page_s': seconds / pages,
+        'KBps': pages * pgsz / 1024 / seconds,
+        'erase_s': erase_s / erases if erases else 0.0,
+        'errors': errors,
+    }
+
+
+def run(ser, device_type: int, baudrates: list, page_sizes: list, probes: int = 100,
+        pages: int = 64, window: int = 1, write: bool = False, progress=None) -> dict:
+    """ Characterise the link at each baud rate.
+
+    Every rate is probed with `probes` CHK_PROTOCOL. The page throughput
+    is measured at the rates without error, for each page size the
+    device accepts with FLASH_SET_PGSZ and for `PAGE_SIZE`. The device
+    must follow the baud rate of the host, see `serprog.loader.negotiate_baudrate`.
+    The port is left at the recommended rate and the page size is set back
+    to `PAGE_SIZE`.
+
+    Args:
+        ser (serial.Serial): The opened port, at a rate the device answers.
+        device_type (int): Device type, 0 detects it.
+        baudrates (list): Candidate rates, slowest first.
+        page_sizes (list): Candidate page sizes.
+        probes (int, optional): CHK_PROTOCOL probes per rate. The default is 100.
+        pages (int, optional): Pages per throughput measurement. The default is 64.
+        window (int, optional): Page commands sent before their responses. The default is 1.
+        write (bool, optional): Measure with FLASH_WRITE, see `page_throughput`. The default is False.
+        progress (callable, optional): Called with a message before each step. The default is None.
+
+    Raises:
+        exceptions.ComuError: The device does not respond at the first rate.
+
+    Returns:
+        dict: 'device_type', 'rates' (list of dict of 'baudrate', 'rtt' (percentiles),
+            'error_rate' and 'pages' (page size -> `page_throughput` result)),
+            and 'best' (dict of 'baudrate' and the throughput at `PAGE_SIZE`), None if no rate worked.
+    """
+    say = progress if progress is not None else (lambda msg: None)
+    cth = CommandTrnasHandler(ser)
+    cth.timeout = 0.5
+    # count the errors of the link, not recover from them
+    cth.retries = 0
+
+    ser.baudrate = baudrates[0]
+    cth.resync(0)
+    res, _ = cth.cmd_chk_protocol()
+    if res is False:
+        raise exceptions.ComuError
+    res, detected = cth.cmd_chk_device()
+    if res is False:
+        raise exceptions.ComuError
+    if device_type == 0:
+        device_type = detected
+    elif device_type != detected:
+        raise exceptions.CheckDeviceError(device_type, detected)
+    dev = device.device_list[device_type]
+    sector_size = dev['flash_sector_size']
+    # the last sector of the user application
+    address = dev['userapp_start'] + dev['userapp_size'] - sector_size
+
+    rates = []
+    for baudrate in baudrates:
+        say(f"{baudrate} baud: {probes} CHK_PROTOCOL probes")
+        try:
+            ser.baudrate = baudrate
+            cth.resync(0)
+            rtts, errors = round_trips(cth, probes)
+        except (ValueError, serial.SerialException, exceptions.ComuError):
+            # the port does not support the rate
+            rtts, errors = [], probes
+        rate = {'baudrate': baudrate, 'rtt': percentiles(rtts),
+                'error_rate': errors / probes, 'pages': dict()}
+        rates.append(rate)
+        if errors:
+            continue
+
+        try:
+            for pgsz in sorted(set(page_sizes) | {PAGE_SIZE}):
+                if not cth.cmd_flash_set_pgsz(pgsz):
+                    continue
+                say(f"{baudrate} baud: {pages} pages of {pgsz} bytes")
+                rate['pages'][pgsz] = page_throughput(cth, address, pgsz, pages, window,
+                                                      write, sector_size)
+            cth.cmd_flash_set_pgsz(PAGE_SIZE)
+        except exceptions.ComuError:
+            # lost a response under load
+            rate['error_rate'] = max(rate['error_rate'], 1 / probes)
+
+    best = None
+    for rate in rates:
+        tp = rate['pages'].get(PAGE_SIZE)
+        if rate['error_rate'] or tp is None:
+            continue
+        if best is None or tp['KBps'] > best['KBps']:
+            best = dict(tp, baudrate=rate['baudrate'])
+    if best is not None and ser.baudrate != best['baudrate']:
+        ser.baudrate = best['baudrate']
+        cth.resync(0)
+    return {'device_type': device_type, 'rates': rates, 'best': best}
@@ -1,24 +1,173 @@
 # -*- coding: utf-8 -*-
 """ Loader API
-CommandTrnasHandler Object is internal object of Loader.
+CommandTrnasHandler and SerialTransport are internal objects of Loader.
 """
 
+import collections
 import enum
+import math
 import os
+import threading
 import time
 import serial
-import sys
 import datetime
+import weakref
 from pathlib import Path
 
 from serprog import bootprotocol
+from serprog import checkpoint
 from serprog import device
+from serprog import eraseplan
 from serprog import exceptions
 from serprog import ihex
+from serprog import image
+from serprog import metrics
+from serprog import timing
 
 from typing import Union
 
-__all__ = ['Loader']
+__all__ = ['Loader', 'negotiate_baudrate']
+
+
+class SerialTransport():
+    """ Full-duplex packet transport over an opened serial object, thread
+    version of `serprog.aioloader.SerialTransport`.
+
+    A reader thread decodes the received bytes into a queue of complete
+    packets, while the caller encodes and writes the next frames. The
+    thread ends soon after the serial object is closed, or by `close`.
+    A port must be read by one transport only, use `of` to get it.
+
+    While the thread runs, the read timeout of the port is `POLL`. It is
+    set back to the timeout of the caller when the thread ends, so call
+    `close` before reading the port directly again.
+    """
+
+    # Seconds a read of the reader thread blocks, it notices the end as often.
+    POLL = 0.05
+
+    _ports = weakref.WeakKeyDictionary()
+    _ports_lock = threading.Lock()
+
+    def __init__(self, ser: serial.Serial):
+        """ Initialization
+        Args:
+            ser (serial.Serial): The serial object used for communication must be opened by the outside first.
+                Its read timeout is `POLL` until the reader thread ends.
+        """
+        self._ser = ser
+        self._pd = bootprotocol.Decoder()
+        self._packets = collections.deque()    # (packet, time it was received)
+        self._cond = threading.Condition()
+        self._stop = False
+        self._timeout = ser.timeout             # read timeout of the caller, set back at the end
+        ser.timeout = self.POLL
+        self._thread = threading.Thread(target=self._run, name='serprog-rx', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def of(cls, ser: serial.Serial):
+        """ The transport of a port, started if it has none or its thread ended.
+        """
+        with cls._ports_lock:
+            transport = cls._ports.get(ser)
+            if transport is None or not transport.is_alive:
+                transport = cls(ser)
+                cls._ports[ser] = transport
+            return transport
+
+    @property
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self):
+        ser = self._ser
+        try:
+            while not self._stop and ser.is_open:
+                chunk = ser.read(max(1, ser.in_waiting))
+                if not chunk:
+                    continue
+                now = time.monotonic()
+                with self._cond:
+                    packets = self._pd.feed(chunk)
+                    if packets:
+                        self._packets.extend([(packet, now) for packet in packets])
+                        self._cond.notify_all()
+        except Exception:
+            # the port is closed under the read, or gone
+            pass
+        finally:
+            try:
+                ser.timeout = self._timeout
+            except (ValueError, serial.SerialException):
+                # the port is gone
+                pass
+            with self._cond:
+                self._stop = True
+                self._cond.notify_all()
+
+    def write(self, data: bytes):
+        self._ser.write(data)
+
+    def get_packet(self, timeout: float) -> tuple:
+        """ Wait for the next packet.
+
+        Args:
+            timeout (float): Seconds to wait, `math.inf` waits until a packet arrives.
+
+        Raises:
+            exceptions.ComuError: Timeout, or the port is closed.
+
+        Returns:
+            tuple: (bootprotocol.Packet, `time.monotonic()` it was received)
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._packets:
+                remaining = deadline - time.monotonic()
+                if self._stop or remaining <= 0:
+                    raise exceptions.ComuError
+                self._cond.wait(None if remaining == math.inf else remaining)
+            return self._packets.popleft()
+
+    def clear(self):
+        """ Drop the bytes and packets received so far, the decoder starts over.
+
+        A chunk the reader thread is reading meanwhile is still decoded,
+        from the next header on.
+        """
+        self._ser.reset_input_buffer()
+        with self._cond:
+            self._pd = bootprotocol.Decoder()
+            self._packets.clear()
+
+    def drain(self, delay: float):
+        """ `clear` after waiting `delay` seconds for late bytes.
+        """
+        time.sleep(delay)
+        self.clear()
+
+    def close(self):
+        """ Stop the reader thread, the read timeout of the port is set back.
+        The serial object is closed by the outside.
+        """
+        self._stop = True
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+def _command(steps):
+    """ A command of `CommandTrnasHandler` run by its `run`.
+
+    `steps` is the generator method of the command, which the steps of
+    `Loader` use directly. The returned method runs it, blocking for
+    `CommandTrnasHandler` and as a coroutine for
+    `serprog.aioloader.AsyncCommandTrnasHandler`.
+    """
+    def method(self, *args, **kwargs):
+        return self.run(steps(self, *args, **kwargs))
+    method.__doc__ = steps.__doc__
+    return method
 
 
 class CommandTrnasHandler():
@@ -31,88 +180,203 @@ class CommandTrnasHandler():
 
     You can use the functions `cmd_xxx` to send commands and receive responses.
     For the parameters of each command, see the function and bootprotocol specifications.
+
+    Each command is written once as a generator, e.g. `_chk_device` of
+    `cmd_chk_device`, which does no I/O itself. It yields the calls of the
+    transport, a tuple of the method name and its arguments, and is sent
+    their results by `run`. So the same commands run over the blocking
+    `SerialTransport` and over `serprog.aioloader.SerialTransport`.
     """
 
-    def __init__(self, ser: serial.Serial):
+    # Commands which leave the device in the same state when they are run
+    # twice, so they can be sent again if their response is lost. The page
+    # commands carry the address of their page, erasing a sector again
+    # only happens before its pages are written. EEPROM_WRITE is not one,
+    # the device writes each page after the page before.
+    IDEMPOTENT = frozenset([
+        bootprotocol.CMD.CHK_PROTOCOL,
+        bootprotocol.CMD.CHK_DEVICE,
+        bootprotocol.CMD.FLASH_SET_PGSZ,
+        bootprotocol.CMD.FLASH_GET_PGSZ,
+        bootprotocol.CMD.FLASH_WRITE,
+        bootprotocol.CMD.FLASH_VERIFY,
+        bootprotocol.CMD.FLASH_ERASE_SECTOR,
+        bootprotocol.CMD.EEPROM_SET_PGSZ,
+        bootprotocol.CMD.EEPROM_GET_PGSZ,
+        bootprotocol.CMD.EXT_FLASH_WRITE,
+        bootprotocol.CMD.EXT_FLASH_VERIFY,
+    ])
+
+    def __init__(self, ser: serial.Serial, transport: SerialTransport = None):
         """ Initialization
         Args:
             ser (serial.Serial): The serial object used for communication must be opened by the outside first.
+                It is read by its `SerialTransport`, which manages its read timeout.
+            transport (optional): The transport of `ser`, with the methods of `SerialTransport`.
+                The default is None, `SerialTransport.of(ser)`.
         """
         self._ser = ser
-        self._pd = bootprotocol.Decoder()
+        self._transport = transport if transport is not None else SerialTransport.of(ser)
+        # responses to an earlier handler of the port are stale
+        self._transport.clear()
+        self._pe = bootprotocol.Encoder()
+        self._last_cmd = None
+        self._sent = collections.deque()    # (command, send time) waiting for a response
+        self._last_done = 0.0
+
+        # Counts, bytes, latencies and errors of each command.
+        self.metrics = metrics.Metrics()
+
+        # Seconds to wait for the response of a command.
         self.timeout = 5
+        # Times an `IDEMPOTENT` command is sent again after a timeout or a
+        # corrupted response, waiting `backoff` seconds first, doubled for
+        # each retry.
+        self.retries = 3
+        self.backoff = 0.01
+        # Commands that need a different timeout than `timeout`.
+        # `math.inf` waits until the device responds.
+        self.cmd_timeout = {
+            bootprotocol.CMD.FLASH_ERASE_ALL: 30,
+            bootprotocol.CMD.PROG_EXT_FLASH_BOOT: math.inf,
+        }
+
+    def run(self, steps):
+        """ Run a generator of transport calls, e.g. a command or a step of `Loader`.
+
+        Each yielded (method name, *args) is called on the transport and its
+        result is sent back, an exception of it is raised at the `yield`.
+
+        Args:
+            steps (generator): The generator.
 
-    def _get_packet(self):
-        """ Get Packet function (polling)
+        Returns:
+            The return value of the generator.
+        """
+        res, error = None, None
+        while True:
+            try:
+                call = steps.send(res) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                res, error = getattr(self._transport, call[0])(*call[1:]), None
+            except Exception as e:
+                res, error = None, e
+
+    @property
+    def stats(self) -> dict:
+        """ command -> [count, seconds] of the responses received, see `serprog.timing.measure`.
+
+        The time of a command runs from when it is sent, or the previous
+        response arrived if later, to its response.
+        """
+        return {cmd: [m.received - m.checksum_errors, m.service] for cmd, m in self.metrics.items()}
+
+    def _get_packet(self, timeout: float = None) -> bootprotocol.Packet:
+        """ Get Packet function
+
+        Takes the next packet decoded by the reader of the port, see
+        `SerialTransport`. Waiting does not use CPU, and the deadline is
+        measured with the monotonic wall clock.
+
+        Args:
+            timeout (float, optional): Seconds to wait. The default is the
+                timeout of the last sent command, see `cmd_timeout`.
 
         Raises:
-            exceptions.ComuError: Timeout or packet format error.
+            exceptions.ComuError: Timeout or packet checksum error.
 
         Returns:
-            [dict[serprog.alp.Command, bytearray]]: Packet object.
-
-        Packet object format:
-            res = {
-                'command': (serprog.alp.Command) command number,
-                'data': (bytearray) packet data.
-            }
-        """
-        if sys.platform == 'win32':
-            start_time = time.perf_counter()
-        elif sys.platform == 'linux':
-            start_time = time.process_time()
-
-        exec_time = 0
-        exit_flag = False
-        pac_decode_err_flag = False
-        packet = None
-
-        while exec_time < 3 and exit_flag is False:
-            ch = self._ser.read(1)
-
-            if len(ch) != 0:
-                self._pd.step(ch[0])
-
-            if self._pd.isDone():
-                packet = self._pd.getPacket()
-                exit_flag = True
-            elif self._pd.isError():
-                pac_decode_err_flag = True
-                exit_flag = True
-
-            if sys.platform == 'win32':
-                exec_time = time.perf_counter() - start_time
-            elif sys.platform == 'linux':
-                exec_time = time.process_time() - start_time
-
-        if exec_time > self.timeout:
-            # TODO: timeout error, packet format error
-            raise exceptions.ComuError
-
-        if pac_decode_err_flag:
+            bootprotocol.Packet: Packet object.
+        """
+        if timeout is None:
+            timeout = self.cmd_timeout.get(self._last_cmd, self.timeout)
+
+        try:
+            packet, now = yield ('get_packet', timeout)
+        except exceptions.ComuError:
+            # the commands waiting for a response are not timed
+            cmd = self._sent[0][0] if self._sent else self._last_cmd
+            if cmd is not None:
+                self.metrics.on_timeout(cmd)
+            self._sent.clear()
+            raise
+
+        if self._sent:
+            cmd, sent = self._sent.popleft()
+            self.metrics.on_received(cmd, len(bootprotocol.HEADER) + 4 + len(packet.data),
+                                     now - sent, now - max(sent, self._last_done), packet.error)
+            self._last_done = now
+        if packet.error:
             # packet decode error
             raise exceptions.ComuError
         # print('\033[93m' + '[_get_packet]' + '\033[0m', packet)
         return packet
 
-    def _block_get_packet(self):
-        """ Get Packet function (blocking mode), for the long time operation.
+    @property
+    def retry_count(self) -> int:
+        """ Commands sent again, see `_transfer`. """
+        return sum([m.retries for _, m in self.metrics.items()])
+
+    def _resync(self, delay: float):
+        """ Drop the bytes received so far, after waiting `delay` seconds for late ones.
+
+        The decoder starts over, so the next packet is searched from its header.
         """
-        packet = None
+        self._sent.clear()
+        yield ('drain', delay)
 
-        while True:
-            ch = self._ser.read(1)
+    resync = _command(_resync)
 
-            if len(ch) != 0:
-                self._pd.step(ch[0])
+    def _transfer(self, cmd: bootprotocol.CMD, data: bytes, page_addr: int = None,
+                  retries: int = None) -> bootprotocol.Packet:
+        """ Send a command and receive its response.
 
-            if self._pd.isDone():
-                packet = self._pd.getPacket()
-                break
-            elif self._pd.isError():
-                raise exceptions.ComuError
-        # print('\033[93m' + '[_block_get_packet]' + '\033[0m', packet)
-        return packet
+        After a timeout or a corrupted response of an `IDEMPOTENT` command
+        the stale bytes are dropped and the same packet is sent again, up to
+        `retries` times with backoff. Other commands are sent once, as the
+        device may have run them. Responses of other commands, e.g. late
+        ones of an earlier attempt, are skipped. No command may be
+        outstanding.
+
+        Args:
+            cmd (bootprotocol.CMD): Command.
+            data (bytes): Packet data, or the page of a page command.
+            page_addr (int, optional): Address of a page command, see `_put_page_packet`.
+                The default is None, not a page command.
+            retries (int, optional): Times the command is sent again. The default
+                is None, `retries` for an `IDEMPOTENT` command, otherwise 0.
+
+        Raises:
+            exceptions.ComuError: No valid response after the retries.
+
+        Returns:
+            bootprotocol.Packet: The response.
+        """
+        if retries is None:
+            retries = self.retries if cmd in self.IDEMPOTENT else 0
+        for attempt in range(retries + 1):
+            if attempt:
+                self.metrics.on_retry(cmd)
+                yield from self._resync(self.backoff * 2 ** (attempt - 1))
+            if page_addr is None:
+                yield from self._put_packet(cmd, data)
+            else:
+                yield from self._put_page_packet(cmd, page_addr, data)
+            try:
+                res = yield from self._get_packet()
+                while res.command != cmd:
+                    res = yield from self._get_packet()
+                return res
+            except exceptions.ComuError:
+                pass
+        raise exceptions.ComuError
+
+    def _block_get_packet(self) -> bootprotocol.Packet:
+        """ Get Packet function (blocking mode), for the long time operation.
+        """
+        return (yield from self._get_packet(math.inf))
 
     def _put_packet(self, cmd: Union[bootprotocol.CMD, int], data: bytearray):
         """ Put Packet function (polling)
@@ -123,151 +387,350 @@ class CommandTrnasHandler():
         """
         req_raw = bootprotocol.encode(cmd, data)
         # print('\033[93m' + '\n[_put_packet]' + '\033[0m', req_raw)
-        self._ser.write(req_raw)
+        self._last_cmd = cmd
+        self._sent.append((cmd, time.monotonic()))
+        self.metrics.on_sent(cmd, len(req_raw))
+        yield ('write', req_raw)
 
-    ###############################
+    def _put_page_packet(self, cmd: bootprotocol.CMD, page_addr: int, data: bytes):
+        """ Put Packet function for page commands, the data is the address and the page.
 
-    def cmd_chk_protocol(self):
-        self._put_packet(bootprotocol.CMD.CHK_PROTOCOL, b'test')
-        res = self._get_packet()
+        The packet is encoded into a reused buffer, without building the
+        payload first. The transport has written it when `write` returns.
+        """
+        self._last_cmd = cmd
+        self._sent.append((cmd, time.monotonic()))
+        req_raw = self._pe.encode(cmd, data, page_addr)
+        self.metrics.on_sent(cmd, len(req_raw))
+        yield ('write', req_raw)
+
+    ###############################
 
-        if res == None:
+    def _chk_protocol(self):
+        try:
+            res = yield from self._transfer(bootprotocol.CMD.CHK_PROTOCOL, b'test')
+        except exceptions.ComuError:
             return False, 0
-        elif res['command'] == bootprotocol.CMD.CHK_PROTOCOL and res['data'][0] == 0:
-            return True, res['data'][1]
+
+        if res.command == bootprotocol.CMD.CHK_PROTOCOL and res.data[0] == 0:
+            return True, res.data[1]
         else:
             return False, 0
 
-    def cmd_chk_device(self):
-        self._put_packet(bootprotocol.CMD.CHK_DEVICE, b'')
-        res = self._get_packet()
-        if res['command'] == bootprotocol.CMD.CHK_DEVICE and res['data'][0] == 0:
-            return True, res['data'][1]
+    def _chk_device(self):
+        res = yield from self._transfer(bootprotocol.CMD.CHK_DEVICE, b'')
+        if res.command == bootprotocol.CMD.CHK_DEVICE and res.data[0] == 0:
+            return True, res.data[1]
         else:
             return False, int(0)
 
-    def cmd_prog_end(self):
-        self._put_packet(bootprotocol.CMD.PROG_END, b'')
-        res = self._get_packet()
-        return res['command'] == bootprotocol.CMD.PROG_END and res['data'][0] == 0
-
-    def cmd_prog_ext_flash_boot(self):
-        self._put_packet(bootprotocol.CMD.PROG_EXT_FLASH_BOOT, b'')
-        res = self._block_get_packet() # waiting for a while ...
-        return res['command'] == bootprotocol.CMD.PROG_EXT_FLASH_BOOT and res['data'][0] == 0
-
-    def cmd_flash_set_pgsz(self, size):
-        self._put_packet(bootprotocol.CMD.FLASH_SET_PGSZ, size.to_bytes(4, 'little'))
-        res = self._get_packet()
-        return res['command'] == bootprotocol.CMD.FLASH_SET_PGSZ and res['data'][0] == 0
-
-    def cmd_flash_get_pgsz(self):
-        self._put_packet(bootprotocol.CMD.FLASH_GET_PGSZ, b'')
-        res = self._get_packet()
-        if res['command'] == bootprotocol.CMD.FLASH_GET_PGSZ and res['data'][0] == 0:
-            return True, int.from_bytes(res['data'][1:3], 'little')
+    def _prog_end(self):
+        """ End the programming, the device starts the application.
+
+        The device may leave the bootloader before its response is sent, so
+        a lost response is checked with CHK_PROTOCOL: a silent device has
+        ended, a responding one has not received PROG_END, which is sent
+        once more.
+
+        Raises:
+            exceptions.ComuError: No valid response of the second PROG_END.
+        """
+        try:
+            res = yield from self._transfer(bootprotocol.CMD.PROG_END, b'')
+        except exceptions.ComuError:
+            yield from self._resync(self.backoff)
+            try:
+                yield from self._transfer(bootprotocol.CMD.CHK_PROTOCOL, b'test', retries=0)
+            except exceptions.ComuError:
+                return True
+            res = yield from self._transfer(bootprotocol.CMD.PROG_END, b'')
+        return res.command == bootprotocol.CMD.PROG_END and res.data[0] == 0
+
+    def _prog_ext_flash_boot(self):
+        res = yield from self._transfer(bootprotocol.CMD.PROG_EXT_FLASH_BOOT, b'') # waiting for a while ...
+        return res.command == bootprotocol.CMD.PROG_EXT_FLASH_BOOT and res.data[0] == 0
+
+    def _flash_set_pgsz(self, size):
+        res = yield from self._transfer(bootprotocol.CMD.FLASH_SET_PGSZ, size.to_bytes(4, 'little'))
+        return res.command == bootprotocol.CMD.FLASH_SET_PGSZ and res.data[0] == 0
+
+    def _flash_get_pgsz(self):
+        res = yield from self._transfer(bootprotocol.CMD.FLASH_GET_PGSZ, b'')
+        if res.command == bootprotocol.CMD.FLASH_GET_PGSZ and res.data[0] == 0:
+            return True, int.from_bytes(res.data[1:3], 'little')
         else:
             return False, int(0)
 
+    cmd_chk_protocol        = _command(_chk_protocol)
+    cmd_chk_device          = _command(_chk_device)
+    cmd_prog_end            = _command(_prog_end)
+    cmd_prog_ext_flash_boot = _command(_prog_ext_flash_boot)
+    cmd_flash_set_pgsz      = _command(_flash_set_pgsz)
+    cmd_flash_get_pgsz      = _command(_flash_get_pgsz)
+
     ###############################
 
-    def cmd_flash_write(self, page_addr, data):
-        paylod = page_addr.to_bytes(4, 'little') + data
-        self._put_packet(bootprotocol.CMD.FLASH_WRITE, paylod)
-        res = self._get_packet()
-        return res['command'] == bootprotocol.CMD.FLASH_WRITE and res['data'][0] == 0
-
-    def cmd_flash_read(self):
-        self._put_packet(bootprotocol.CMD.FLASH_READ, b'')
-        res = self._get_packet()
-        if res['command'] == bootprotocol.CMD.FLASH_READ and res['data'][0] == 0:
-            return True, res['data']
+    def _flash_write(self, page_addr, data):
+        res = yield from self._transfer(bootprotocol.CMD.FLASH_WRITE, data, page_addr)
+        return res.data[0] == 0
+
+    def _put_flash_write(self, page_addr, data):
+        """ Send FLASH_WRITE without waiting for the response.
+
+        The response must be received later by `get_write_ack`, in the order
+        the commands were sent.
+        """
+        yield from self._put_page_packet(bootprotocol.CMD.FLASH_WRITE, page_addr, data)
+
+    def _get_write_ack(self, cmd: bootprotocol.CMD) -> bool:
+        """ Receive the response of the oldest outstanding FLASH_WRITE, EXT_FLASH_WRITE or FLASH_VERIFY.
+
+        Args:
+            cmd (bootprotocol.CMD): The command the response belongs to.
+
+        Raises:
+            exceptions.ComuError: Timeout or packet checksum error.
+
+        Returns:
+            bool: True, the page is written; False, the device refused it.
+        """
+        res = yield from self._get_packet(self.cmd_timeout.get(cmd, self.timeout))
+        return res.command == cmd and res.data[0] == 0
+
+    def _flash_read(self):
+        res = yield from self._transfer(bootprotocol.CMD.FLASH_READ, b'')
+        if res.command == bootprotocol.CMD.FLASH_READ and res.data[0] == 0:
+            return True, res.data
         else:
             return False, bytearray(b'')
 
-    def cmd_flash_erase_sector(self, num):
-        self._put_packet(bootprotocol.CMD.FLASH_ERASE_SECTOR,
-                         num.to_bytes(2, 'little'))
-        res = self._get_packet()
-        if res['command'] == bootprotocol.CMD.FLASH_ERASE_SECTOR and res['data'][0] == 0:
-            return True, int.from_bytes(res['data'][1:5], 'little')
+    def _flash_verify(self, page_addr, data):
+        """ Compare a page of the flash with `data` on the device.
+
+        Returns:
+            bool: True, the page already holds `data`; False, it differs.
+        """
+        res = yield from self._transfer(bootprotocol.CMD.FLASH_VERIFY, data, page_addr)
+        return res.command == bootprotocol.CMD.FLASH_VERIFY and res.data[0] == 0
+
+    def _put_flash_verify(self, page_addr, data):
+        """ Send FLASH_VERIFY without waiting for the response, see `put_flash_write`.
+        """
+        yield from self._put_page_packet(bootprotocol.CMD.FLASH_VERIFY, page_addr, data)
+
+    def _flash_erase_sector(self, num):
+        res = yield from self._transfer(bootprotocol.CMD.FLASH_ERASE_SECTOR, num.to_bytes(2, 'little'))
+        if res.command == bootprotocol.CMD.FLASH_ERASE_SECTOR and res.data[0] == 0:
+            return True, int.from_bytes(res.data[1:5], 'little')
         else:
             return False, int(0)
         
-    def cmd_flash_erase_all(self):
-        self._put_packet(bootprotocol.CMD.FLASH_ERASE_ALL, b'')
-        res = self._block_get_packet() # waiting for a while ...
-        return res['command'] == bootprotocol.CMD.FLASH_ERASE_ALL and res['data'][0] == 0
+    def _flash_erase_all(self):
+        res = yield from self._transfer(bootprotocol.CMD.FLASH_ERASE_ALL, b'') # waiting for a while ...
+        return res.command == bootprotocol.CMD.FLASH_ERASE_ALL and res.data[0] == 0
+
+    cmd_flash_write         = _command(_flash_write)
+    put_flash_write         = _command(_put_flash_write)
+    get_write_ack           = _command(_get_write_ack)
+    cmd_flash_read          = _command(_flash_read)
+    cmd_flash_verify        = _command(_flash_verify)
+    put_flash_verify        = _command(_put_flash_verify)
+    cmd_flash_erase_sector  = _command(_flash_erase_sector)
+    cmd_flash_erase_all     = _command(_flash_erase_all)
 
     ###############################
 
-    def cmd_ext_flash_fopen(self):
-        self._put_packet(bootprotocol.CMD.EXT_FLASH_FOPEN, b'fopen')
-        res = self._get_packet()
-        return res['command'] == bootprotocol.CMD.EXT_FLASH_FOPEN and res['data'][0] == 0
+    def _ext_flash_fopen(self):
+        res = yield from self._transfer(bootprotocol.CMD.EXT_FLASH_FOPEN, b'fopen')
+        return res.command == bootprotocol.CMD.EXT_FLASH_FOPEN and res.data[0] == 0
 
-    def cmd_ext_flash_write(self, page_addr, data):
-        paylod = page_addr.to_bytes(4, 'little') + data
-        self._put_packet(bootprotocol.CMD.EXT_FLASH_WRITE, paylod)
-        res = self._get_packet()
-        return res['command'] == bootprotocol.CMD.EXT_FLASH_WRITE and res['data'][0] == 0
+    def _ext_flash_write(self, page_addr, data):
+        res = yield from self._transfer(bootprotocol.CMD.EXT_FLASH_WRITE, data, page_addr)
+        return res.data[0] == 0
+
+    def _put_ext_flash_write(self, page_addr, data):
+        """ Send EXT_FLASH_WRITE without waiting for the response, see `put_flash_write`.
+        """
+        yield from self._put_page_packet(bootprotocol.CMD.EXT_FLASH_WRITE, page_addr, data)
 
     def cmd_ext_flash_read(self):
         pass
 
-    def cmd_ext_flash_fclose(self):
+    def _ext_flash_verify(self, page_addr, data):
+        """ Compare a page of the external flash with `data` on the device, see `cmd_flash_verify`.
+        """
+        res = yield from self._transfer(bootprotocol.CMD.EXT_FLASH_VERIFY, data, page_addr)
+        return res.command == bootprotocol.CMD.EXT_FLASH_VERIFY and res.data[0] == 0
+
+    def _ext_flash_fclose(self):
         now = datetime.datetime.now()
         t_stamp = bytearray([now.minute, now.hour, now.day, now.month, (now.year - 2000)])
-        self._put_packet(bootprotocol.CMD.EXT_FLASH_FCLOSE, t_stamp)
-        res = self._get_packet()
-        if res['command'] == bootprotocol.CMD.EXT_FLASH_FCLOSE and res['data'][0] == 0:
+        res = yield from self._transfer(bootprotocol.CMD.EXT_FLASH_FCLOSE, t_stamp)
+        if res.command == bootprotocol.CMD.EXT_FLASH_FCLOSE and res.data[0] == 0:
             return True
         else:
             return False
 
+    cmd_ext_flash_fopen     = _command(_ext_flash_fopen)
+    cmd_ext_flash_write     = _command(_ext_flash_write)
+    put_ext_flash_write     = _command(_put_ext_flash_write)
+    cmd_ext_flash_verify    = _command(_ext_flash_verify)
+    cmd_ext_flash_fclose    = _command(_ext_flash_fclose)
+
     ###############################
 
-    def cmd_eeprom_set_pgsz(self, size):
-        self._put_packet(bootprotocol.CMD.EEPROM_SET_PGSZ, size.to_bytes(4, 'little'))
-        res = self._get_packet()
-        return res['command'] == bootprotocol.CMD.EEPROM_SET_PGSZ and res['data'][0] == 0
+    def _eeprom_set_pgsz(self, size):
+        res = yield from self._transfer(bootprotocol.CMD.EEPROM_SET_PGSZ, size.to_bytes(4, 'little'))
+        return res.command == bootprotocol.CMD.EEPROM_SET_PGSZ and res.data[0] == 0
 
-    def cmd_eeprom_get_pgsz(self):
-        self._put_packet(bootprotocol.CMD.EEPROM_GET_PGSZ, b'')
-        res = self._get_packet()
-        if res['command'] == bootprotocol.CMD.EEPROM_GET_PGSZ and res['data'][0] == 0:
-            return True, int.from_bytes(res['data'][1:3], 'little')
+    def _eeprom_get_pgsz(self):
+        res = yield from self._transfer(bootprotocol.CMD.EEPROM_GET_PGSZ, b'')
+        if res.command == bootprotocol.CMD.EEPROM_GET_PGSZ and res.data[0] == 0:
+            return True, int.from_bytes(res.data[1:3], 'little')
         else:
             return False, int(0)
 
-    def cmd_eeprom_write(self, page_data):
-        self._put_packet(bootprotocol.CMD.EEPROM_WRITE, page_data)
-        res = self._get_packet()
-        if res['command'] == bootprotocol.CMD.EEPROM_WRITE and res['data'][0] == 0:
-            return True, int.from_bytes(res['data'][1:5], 'little')
+    def _eeprom_write(self, page_data):
+        res = yield from self._transfer(bootprotocol.CMD.EEPROM_WRITE, page_data)
+        if res.command == bootprotocol.CMD.EEPROM_WRITE and res.data[0] == 0:
+            return True, int.from_bytes(res.data[1:5], 'little')
         else:
             return False, int(0)
 
-    def cmd_eeprom_read(self):
-        self._put_packet(bootprotocol.CMD.EEPROM_READ, b'')
-        res = self._get_packet()
-        if res['command'] == bootprotocol.CMD.EEPROM_READ and res['data'][0] == 0:
-            return True, int.from_bytes(res['data'][1:5], 'little')
+    def _eeprom_read(self):
+        res = yield from self._transfer(bootprotocol.CMD.EEPROM_READ, b'')
+        if res.command == bootprotocol.CMD.EEPROM_READ and res.data[0] == 0:
+            return True, int.from_bytes(res.data[1:5], 'little')
         else:
             return False, int(0)
 
-    def cmd_eeprom_erase(self):
-        self._put_packet(bootprotocol.CMD.EEPROM_ERASE, b'')
-        res = self._get_packet()
-        if res['command'] == bootprotocol.CMD.EEPROM_ERASE and res['data'][0] == 0:
-            return True, int.from_bytes(res['data'][1:5], 'little')
+    def _eeprom_erase(self):
+        res = yield from self._transfer(bootprotocol.CMD.EEPROM_ERASE, b'')
+        if res.command == bootprotocol.CMD.EEPROM_ERASE and res.data[0] == 0:
+            return True, int.from_bytes(res.data[1:5], 'little')
         else:
             return False, int(0)
 
-    def cmd_eeprom_erase_all(self):
-        self._put_packet(bootprotocol.CMD.EEPROM_ERASE_ALL, b'')
-        res = self._get_packet()
-        return res['command'] == bootprotocol.CMD.EEPROM_ERASE_ALL and res['data'][0] == 0
+    def _eeprom_erase_all(self):
+        res = yield from self._transfer(bootprotocol.CMD.EEPROM_ERASE_ALL, b'')
+        return res.command == bootprotocol.CMD.EEPROM_ERASE_ALL and res.data[0] == 0
+
+    cmd_eeprom_set_pgsz     = _command(_eeprom_set_pgsz)
+    cmd_eeprom_get_pgsz     = _command(_eeprom_get_pgsz)
+    cmd_eeprom_write        = _command(_eeprom_write)
+    cmd_eeprom_read         = _command(_eeprom_read)
+    cmd_eeprom_erase        = _command(_eeprom_erase)
+    cmd_eeprom_erase_all    = _command(_eeprom_erase_all)
+
+
+def negotiate_baudrate(ser: serial.Serial, baudrates: list = None, probes: int = 8) -> int:
+    """ Find the fastest baud rate the link sustains.
+
+    Starts at the first (safe) rate and steps up while every CHK_PROTOCOL
+    probe is answered without timeout or checksum error. The device must
+    follow the host rate by itself, e.g. a USB-CDC bootloader or an
+    auto-baud UART, as the protocol has no command to change it.
+
+    Args:
+        ser (serial.Serial): The opened serial object. It is left at the chosen rate.
+        baudrates (list, optional): Candidate rates, slowest first. The default is `device.baudrate_list`.
+        probes (int, optional): CHK_PROTOCOL probes per rate. The default is 8.
+
+    Raises:
+        exceptions.ComuError: The device does not respond at the first rate.
+
+    Returns:
+        int: The chosen baud rate.
+    """
+    if baudrates is None:
+        baudrates = device.baudrate_list
+
+    def link_ok(rate):
+        ser.baudrate = rate
+        ser.reset_input_buffer()
+        cth = CommandTrnasHandler(ser)
+        cth.timeout = 0.2
+        cth.retries = 0
+        for _ in range(probes):
+            res, _ = cth.cmd_chk_protocol()
+            if res is False:
+                return False
+        return True
+
+    if not link_ok(baudrates[0]):
+        raise exceptions.ComuError
+    best = baudrates[0]
+    for rate in baudrates[1:]:
+        try:
+            ok = link_ok(rate)
+        except (exceptions.ComuError, ValueError, serial.SerialException):
+            ok = False
+        if not ok:
+            break
+        best = rate
+    if ser.baudrate != best:
+        ser.baudrate = best
+        ser.reset_input_buffer()
+    return best
+
+
+class _PageStream():
+    """ Pages of a programming file, parsed while they are programmed.
+
+    Pages are read from the file when they are first indexed. Only the
+    pages from the oldest unreleased one to the last read one are kept, so
+    the records of the file must be in ascending page order.
+    """
+
+    def __init__(self, filename: str, pgsz: int, space_data: bytes, base_address: int = None):
+        self.size = 0               # data bytes read so far
+        self._pages = dict()
+        self._count = 0             # pages read so far
+        self._done = False
+        self._iter = ihex.iter_pages(self._records(filename, base_address), pgsz, space_data, filename)
+        size = os.path.getsize(filename)
+        if image.detect(filename, base_address) in ('ihex', 'srec'):
+            # A data record of 16 bytes is about 44 characters.
+            size = size * 16 / 44
+        self.estimate = max(1, math.ceil(size / pgsz))
+
+    def _records(self, filename, base_address):
+        for address, data in image.iter_records(filename, base_address):
+            self.size += len(data)
+            yield address, data
+
+    @property
+    def available(self):
+        """ Number of pages read so far. """
+        return self._count
+
+    @property
+    def exhausted(self):
+        """ The whole file has been read. """
+        return self._done
+
+    def fetch(self, idx: int) -> bool:
+        """ Read pages until page `idx`.
+
+        Returns:
+            bool: True, page `idx` exists; False, the file ends before it.
+        """
+        while self._count <= idx and not self._done:
+            try:
+                self._pages[self._count] = next(self._iter)
+                self._count += 1
+            except StopIteration:
+                self._done = True
+        return idx < self._count
+
+    def release(self, idx: int):
+        """ Forget the pages before page `idx`. """
+        for i in [i for i in self._pages if i < idx]:
+            del self._pages[i]
+
+    def __getitem__(self, idx: int) -> dict:
+        self.fetch(idx)
+        return self._pages[idx]
 
 
 class Loader():
@@ -278,8 +741,11 @@ class Loader():
         exceptions.DeviceTypeError: The detected device is a different type than the specified device.
         FileNotFoundError: Can't find flash or eeprom programming file (image).
         exceptions.ComuError: Communication error.
-        exceptions.FlashIsNotIhexError: The flash programming file (image) is not intel hex format.
-        exceptions.EepromIsNotIhexError: The eeprom programming file (image) is not intel hex format.
+        exceptions.FlashIsNotIhexError: The flash programming file (image) is not in a supported format.
+        exceptions.EepromIsNotIhexError: The eeprom programming file (image) is not in a supported format.
+        exceptions.ImageRangeError: The flash image is not in the application area of the device.
+        exceptions.ArtifactHashError: A page of an artifact does not match its hash.
+        exceptions.SectorSizeError: The application area of the device does not start at a sector.
     """
     _device_type       = int()
     _device_name       = str()
@@ -293,6 +759,10 @@ class Loader():
     _ext_flash_file    = str()
     _eeprom_file       = str()
 
+    _flash_image       = None
+    _ext_flash_image   = None
+    _eeprom_image      = None
+
     class _Stage(enum.IntEnum):
         """ Programming transaction management object status
         """
@@ -316,6 +786,47 @@ class Loader():
     _eeprom_pages       = list()
     _eeprom_page_idx    = int()
 
+    # pipelined page writes
+    _window    = 1      # max outstanding FLASH_WRITE / EXT_FLASH_WRITE
+    _send_idx  = 0      # next page of the current stage to send
+    _inflight  = None   # sent page indexes waiting for the response
+    _acked     = None   # page indexes acknowledged while recovering
+    _sync_idx  = 0      # page sent when no write was outstanding
+
+    # pages are not sent ahead across a multiple of this, so a lost
+    # response only puts the pages since the last one in doubt
+    SYNC_PAGES = 64
+
+    # flash erase
+    _is_erase_all   = bool()
+    _is_delta       = bool()
+    _flash_sectors  = list()    # erase plan, see `eraseplan.plan`
+    _sector_idx     = 0
+    _sector_dirty   = bool()
+    _skipped_pages  = 0
+    _blank_pages    = 0
+
+    _is_ext_flash_stream = bool()
+    _is_finished         = bool()
+
+    # resume, see `serprog.checkpoint`
+    _checkpoint_file = None
+    _checkpoint      = None
+    _image_hashes    = None     # region -> `checkpoint.image_hash`
+    _checkpoint_time = 0.0
+    _is_resume       = bool()
+    _resumed_pages   = 0
+    # pages of each region acknowledged in order, and the regions finished
+    _flash_acked     = 0
+    _ext_flash_acked = 0
+    _eeprom_acked    = 0
+    _flash_done      = bool()
+    _ext_flash_done  = bool()
+    _eeprom_done     = bool()
+
+    # seconds between two writes of the checkpoint
+    CHECKPOINT_INTERVAL = 0.5
+
     # output info
     _flash_size     = int(0)
     _ext_flash_size = int(0)
@@ -333,6 +844,17 @@ class Loader():
         flash_file:         str = '',
         ext_flash_file:     str = '',
         eeprom_file:        str = '',
+        window:             int = 1,
+        is_delta:           bool = False,
+        is_erase_all:       bool = False,
+        flash_image:        image.Image = None,
+        ext_flash_image:    image.Image = None,
+        eeprom_image:       image.Image = None,
+        is_ext_flash_stream: bool = False,
+        base_address:       int = None,
+        timing_profile:     timing.Profile = None,
+        checkpoint_file:    str = None,
+        is_resume:          bool = False,
     ):
         """ Initialization
 
@@ -353,10 +875,40 @@ class Loader():
                 The flash image. The default is ''.
             eeprom_file (str, optional):
                 The eeprom image. The default is ''.
+            window (int, optional):
+                Max number of FLASH_WRITE / EXT_FLASH_WRITE sent before their
+                responses are received. Falls back to 1 after an error. The default is 1.
+            is_delta (bool, optional):
+                Only erase and program the flash sectors whose content differs
+                from the flash image. The default is False.
+            is_erase_all (bool, optional):
+                Erase the whole flash before programming, instead of only the
+                sectors the flash image touches. The default is False.
+            flash_image (image.Image, optional):
+                The loaded flash image, used instead of loading `flash_file`. The default is None.
+            ext_flash_image (image.Image, optional):
+                The loaded external flash image, used instead of loading `ext_flash_file`. The default is None.
+            eeprom_image (image.Image, optional):
+                The loaded eeprom image, used instead of loading `eeprom_file`. The default is None.
+            is_ext_flash_stream (bool, optional):
+                Parse `ext_flash_file` while programming it, only a few pages are kept in memory.
+                `total_steps` is estimated from the file size until the file is read. The default is False.
+            base_address (int, optional):
+                Load address of raw binary files, required by them. The default is None.
+            timing_profile (timing.Profile, optional):
+                Measured times used for `prog_time` and `eta`, the times of
+                this programming are added to it when it finishes. The default
+                is None, the times of the device list.
+            checkpoint_file (str, optional):
+                Keep the acknowledged pages of each region in this file while
+                programming, it is removed when the programming finishes. The default is None.
+            is_resume (bool, optional):
+                Continue the programming of `checkpoint_file` if it is of the same
+                device and images. The default is False.
         """
+        self._start_time = time.monotonic()
         self._ser = ser
-
-        self._cth = CommandTrnasHandler(ser)
+        self._cth = None
 
         self._device_type       = device_type
         self._is_flash_prog     = is_flash_prog
@@ -366,10 +918,28 @@ class Loader():
         self._flash_file        = flash_file
         self._ext_flash_file    = ext_flash_file
         self._eeprom_file       = eeprom_file
-
-        self._prepare()
-
-        self._prog_time
+        self._flash_image       = flash_image
+        self._ext_flash_image   = ext_flash_image
+        self._eeprom_image      = eeprom_image
+        self._is_ext_flash_stream = is_ext_flash_stream and is_ext_flash_prog and ext_flash_image is None
+        self._base_address      = base_address
+        self._timing_profile    = timing_profile
+        self._checkpoint_file   = checkpoint_file
+        self._is_resume         = is_resume
+        if flash_image is not None:
+            self._flash_file = flash_image.filename
+        if ext_flash_image is not None:
+            self._ext_flash_file = ext_flash_image.filename
+        if eeprom_image is not None:
+            self._eeprom_file = eeprom_image.filename
+        self._window            = max(1, window)
+        self._window_size       = self._window
+        self._inflight          = collections.deque()
+        self._acked             = set()
+        self._is_delta          = is_delta
+        self._is_erase_all      = is_erase_all and not is_delta
+
+        self._open()
 
     @property
     def stage(self):
@@ -383,18 +953,33 @@ class Loader():
     def device_name(self):
         return self._device_name
 
+    @property
+    def baudrate(self):
+        return self._ser.baudrate
+
     @property
     def total_steps(self):
         return self._total_steps
 
+    @property
+    def cur_step(self):
+        return self._cur_step
+
     @property
     def flash_size(self):
         return self._flash_size
 
     @property
     def ext_flash_size(self):
+        if self._is_ext_flash_stream and not self._ext_flash_pages.exhausted:
+            # estimated
+            return self._ext_flash_pages.estimate * 512
         return self._ext_flash_size
 
+    @property
+    def is_finished(self):
+        return self._is_finished
+
     @property
     def eeprom_size(self):
         return self._eeprom_size
@@ -403,10 +988,74 @@ class Loader():
     def prog_time(self):
         return self._prog_time
 
+    @property
+    def eta(self):
+        """ Estimated seconds to finish, from the pages not written yet. """
+        if self._is_finished:
+            return 0.0
+        if self._is_ext_flash_stream and not self._ext_flash_pages.exhausted:
+            ext_flash_pages = self._ext_flash_pages.estimate
+        else:
+            ext_flash_pages = len(self._ext_flash_pages)
+        return self._estimate(len(self._flash_pages) - self._flash_page_idx,
+                              ext_flash_pages - self._ext_flash_page_idx,
+                              len(self._eeprom_pages) - self._eeprom_page_idx,
+                              overhead=False)
+
+    @property
+    def elapsed(self):
+        """ Seconds since the loader was created, until it finished. """
+        if self._is_finished:
+            return self._elapsed
+        return time.monotonic() - self._start_time
+
+    @property
+    def metrics(self):
+        """ Metrics of the commands sent so far, see `serprog.metrics`. """
+        return self._cth.metrics
+
+    @property
+    def prog_times(self):
+        """ Seconds of each command used by the estimate, see `serprog.timing`. """
+        return dict(self._times)
+
+    @property
+    def retries(self):
+        """ Commands sent again after a timeout or a corrupted response. """
+        return self._cth.retry_count
+
+    @property
+    def resumed_pages(self):
+        """ Pages not programmed again because the checkpoint has them. """
+        return self._resumed_pages
+
+    @property
+    def skipped_pages(self):
+        return self._skipped_pages
+
+    @property
+    def blank_pages(self):
+        return self._blank_pages
+
+    @property
+    def erase_sectors(self):
+        return len(self._flash_sectors)
+
+    @property
+    def erase_size(self):
+        sector_size = device.device_list[self._device_type]['flash_sector_size']
+        return eraseplan.erase_size(self._flash_sectors, sector_size)
+
     @property
     def ext_flash_file(self):
         return Path(self._ext_flash_file).stem
 
+    def _open(self):
+        """ Connect to the device and prepare the programming, see `_prepare`.
+        """
+        self._cth = CommandTrnasHandler(self._ser)
+        self._prepare()
+
     def _prepare(self):
         """ Preparation function before programming.
 
@@ -414,52 +1063,208 @@ class Loader():
         2. Check the flash and eeprom burning files
         3. Detection device
         4. Generate action list
+
+        The files are read by `_prepare_images`, the device is prepared by
+        the steps of `_prepare_steps`.
+        """
+        self._prepare_images()
+        self._cth.run(self._prepare_steps())
+
+    def _prepare_images(self):
+        """ Check the parameters and load the images, without I/O of the port.
         """
         if self._device_type > len(device.device_list):
             raise exceptions.DeviceTypeError(self._device_type)
 
-        if self._is_flash_prog and os.path.isfile(self._flash_file) is False:
+        if self._is_flash_prog and self._flash_image is None and \
+                os.path.isfile(self._flash_file) is False:
             raise FileNotFoundError
 
-        if self._is_ext_flash_prog and os.path.isfile(self._ext_flash_file) is False:
+        if self._is_ext_flash_prog and self._ext_flash_image is None and \
+                os.path.isfile(self._ext_flash_file) is False:
             raise FileNotFoundError
 
-        if self._is_eeprom_prog:
+        if self._is_eeprom_prog and self._eeprom_image is None:
             if os.path.isfile(self._eeprom_file) is False:
                 raise FileNotFoundError
 
         self._prepare_flash()
         self._prepare_ext_flash()
         self._prepare_eeprom()
-        self._prepare_device()
+
+        self._image_hashes = dict()
+        if self._checkpoint_file:
+            for region, is_prog, filename in (
+                    (checkpoint.FLASH, self._is_flash_prog, self._flash_file),
+                    (checkpoint.EXT_FLASH, self._is_ext_flash_prog, self._ext_flash_file),
+                    (checkpoint.EEPROM, self._is_eeprom_prog, self._eeprom_file)):
+                if is_prog:
+                    self._image_hashes[region] = checkpoint.image_hash(filename, self._base_address)
+
+    def _prepare_steps(self):
+        """ Detect the device, plan the erases and resume the checkpoint, see `CommandTrnasHandler.run`.
+        """
+        yield from self._prepare_device()
+        self._check_flash_range()
+
+        if self._is_flash_prog and not self._is_erase_all:
+            # All pages of the image decide the sectors to erase, and in delta mode
+            # the sectors to program, so a sector of blank pages is erased too.
+            dev = device.device_list[self._device_type]
+            sector_size = dev['flash_sector_size']
+            if dev['userapp_start'] % sector_size:
+                # the first sector would erase the end of the bootloader
+                raise exceptions.SectorSizeError(self._device_name, sector_size, dev['userapp_start'])
+            self._flash_sectors = eraseplan.plan(self._flash_image.pages, sector_size)
+            writes = 0
+            for sector in self._flash_sectors:
+                sector_pages = self._flash_image.pages[sector['start']:sector['end']]
+                sector['write_start'] = writes
+                writes += len(ihex.drop_blank_pages(sector_pages, b'\xFF'))
+                sector['write_end'] = writes
+
+        yield from self._prepare_checkpoint()
 
         # Stage
         stg_list = list()
-        if self._is_flash_prog:
+        if self._is_flash_prog and self._flash_image.pages:
             stg_list.append(self._Stage.FLASH_PROG)
-            self._total_steps += len(self._flash_pages)
-        if self._is_ext_flash_prog:
+            self._total_steps += self._flash_steps
+            self._cur_step += self._flash_page_idx
+        if self._is_ext_flash_stream:
+            ext_flash_pages = self._ext_flash_pages.estimate
+        else:
+            ext_flash_pages = len(self._ext_flash_pages)
+        if self._is_ext_flash_prog and ext_flash_pages:
             stg_list.append(self._Stage.EXT_FLASH_PROG)
-            self._total_steps += len(self._ext_flash_pages)
+            self._total_steps += ext_flash_pages
+            self._cur_step += self._ext_flash_page_idx
         if self._is_eeprom_prog:
             stg_list.append(self._Stage.EEPROM_PROG)
             self._total_steps += len(self._eeprom_pages)
         if self._is_ext_flash_boot:
             stg_list.append(self._Stage.EXT_FLASH_BOOT)
+            self._total_steps += 1
         stg_list.append(self._Stage.END)
         self._total_steps += 1
         self._stage_iter = iter(stg_list)
         self._stage = next(self._stage_iter)
 
         # prog time
-        if self._device_type == 1: # D_ATSAME54_DEVB
-            self._prog_time = len(self._flash_pages) * 0.23 + \
-                                len(self._eeprom_pages) * 0.05 + \
-                                len(self._ext_flash_pages) * 0.3 + 4.5
-        if self._device_type == 2: # D_NUM487KM_DEVB
-            self._prog_time = len(self._flash_pages) * 0.14 + \
-                                len(self._eeprom_pages) * 0.05 + \
-                                len(self._ext_flash_pages) * 0.2 + 3.3
+        self._times = timing.default_times(self._device_type, self.baudrate)
+        if self._timing_profile is not None:
+            self._times.update(self._timing_profile.get(self.device_name, self.baudrate, self._window))
+        self._prog_time = self._estimate(len(self._flash_pages) - self._flash_page_idx,
+                                         max(0, ext_flash_pages - self._ext_flash_page_idx),
+                                         len(self._eeprom_pages))
+
+    def _estimate(self, flash_pages: int, ext_flash_pages: int, eeprom_pages: int,
+                  overhead: bool = True) -> float:
+        """ Seconds to program the given pages, with the erases they need.
+        """
+        if not self._is_flash_prog:
+            flash_pages = 0
+        erase_sectors = 0
+        if flash_pages and not self._is_erase_all:
+            erase_sectors = len(self._flash_sectors) - self._sector_idx
+        return timing.estimate(
+            self._times,
+            flash_pages=flash_pages,
+            erase_sectors=erase_sectors,
+            erase_all=self._is_erase_all and flash_pages == len(self._flash_pages) and flash_pages > 0,
+            verify_pages=flash_pages if self._is_delta else 0,
+            ext_flash_pages=ext_flash_pages if self._is_ext_flash_prog else 0,
+            eeprom_pages=eeprom_pages if self._is_eeprom_prog else 0,
+            overhead=overhead,
+        )
+
+    def _prepare_checkpoint(self):
+        """ Resume the programming of the checkpoint, and start a new one.
+        """
+        if not self._checkpoint_file:
+            return
+        images = self._image_hashes
+        self._checkpoint = checkpoint.Checkpoint(self._checkpoint_file, self._device_name, images)
+        if self._is_resume:
+            cp = checkpoint.Checkpoint.load(self._checkpoint_file)
+            if cp is not None and cp.matches(self._device_name, images):
+                yield from self._resume(cp)
+        self._checkpoint_time = time.monotonic()
+
+    def _resume(self, cp: checkpoint.Checkpoint):
+        """ Continue after the acknowledged pages of a checkpoint.
+
+        The flash is continued if the last acknowledged page is found on the
+        device, otherwise it is programmed from the start. A finished region
+        is not programmed at all. The eeprom can not be checked, and the
+        open external flash file may be gone with a reset of the device or
+        be an older closed file, so an unfinished eeprom or external flash
+        is programmed from the start, the external flash after FOPEN.
+
+        Args:
+            cp (checkpoint.Checkpoint): The checkpoint, of the same device and images.
+        """
+        if self._is_flash_prog:
+            n = min(cp.pages(checkpoint.FLASH), len(self._flash_pages))
+            page = self._flash_pages[n - 1] if n else None
+            if n and (yield from self._cth._flash_verify(page['address'], page['data'])):
+                self._resumed_pages += n
+                if cp.done(checkpoint.FLASH):
+                    self._is_flash_prog = False
+                    self._flash_done = True
+                    self._checkpoint.update(checkpoint.FLASH, n, True)
+                else:
+                    # the sector of page n is erased and partly written
+                    self._flash_page_idx = n
+                    self._flash_acked = n
+                    while self._sector_idx < len(self._flash_sectors):
+                        sector = self._flash_sectors[self._sector_idx]
+                        if sector['write_end'] > n or sector['write_start'] >= n:
+                            break
+                        self._sector_idx += 1
+                    self._sector_dirty = True
+
+        if self._is_eeprom_prog and cp.done(checkpoint.EEPROM):
+            self._resumed_pages += len(self._eeprom_pages)
+            self._is_eeprom_prog = False
+            self._eeprom_done = True
+            self._checkpoint.update(checkpoint.EEPROM, len(self._eeprom_pages), True)
+
+        if self._is_ext_flash_prog and cp.done(checkpoint.EXT_FLASH):
+            n = cp.pages(checkpoint.EXT_FLASH)
+            pages = self._ext_flash_pages
+            if self._is_ext_flash_stream:
+                exists = n > 0 and pages.fetch(n - 1)
+            else:
+                exists = 0 < n <= len(pages)
+            # the closed file is kept by the device
+            if exists and (yield from self._cth._ext_flash_verify(pages[n - 1]['address'], pages[n - 1]['data'])):
+                self._resumed_pages += n
+                self._is_ext_flash_prog = False
+                self._ext_flash_done = True
+                self._checkpoint.update(checkpoint.EXT_FLASH, n, True)
+
+    def _save_checkpoint(self):
+        """ Write the acknowledged pages of each region to the checkpoint.
+
+        A region is done when its stage has acknowledged its last page,
+        the stages do not run in the order of `_Stage`.
+        """
+        cp = self._checkpoint
+        if cp is None:
+            return
+        if self._is_flash_prog:
+            cp.update(checkpoint.FLASH, self._flash_acked, self._flash_done)
+        if self._is_eeprom_prog:
+            cp.update(checkpoint.EEPROM, self._eeprom_acked, self._eeprom_done)
+        if self._is_ext_flash_prog:
+            cp.update(checkpoint.EXT_FLASH, self._ext_flash_acked, self._ext_flash_done)
+        try:
+            cp.save()
+        except OSError:
+            # programming goes on, it just can not be resumed
+            self._checkpoint = None
+        self._checkpoint_time = time.monotonic()
 
     def _prepare_device(self):
         """ Check if the device matches the set device number.
@@ -468,10 +1273,10 @@ class Loader():
             exceptions.ComuError: Unable to communicate
             exceptions.CheckDeviceError: Device comparison error.
         """
-        res, self._protocol_version = self._cth.cmd_chk_protocol()
+        res, self._protocol_version = yield from self._cth._chk_protocol()
 
         if res and self._protocol_version == 1:
-            res2, detected_device = self._cth.cmd_chk_device()
+            res2, detected_device = yield from self._cth._chk_device()
             if res2 is False:
                 raise exceptions.ComuError()
         else:
@@ -487,115 +1292,344 @@ class Loader():
 
         self._device_name = device.device_list[self._device_type]['name']
 
+    def _check_flash_range(self):
+        """ Check the flash image is in the application area of the device, before anything is erased.
+
+        Raises:
+            exceptions.ImageRangeError: A page is outside of the area, e.g. on the bootloader.
+        """
+        if not self._is_flash_prog or not self._flash_image.pages:
+            return
+        dev = device.device_list[self._device_type]
+        start = dev['userapp_start']
+        end = start + dev['userapp_size']
+        # pages are in address order
+        first, last = self._flash_image.pages[0], self._flash_image.pages[-1]
+        if first['address'] < start:
+            raise exceptions.ImageRangeError(self._flash_file, first['address'], start, end)
+        if last['address'] + len(last['data']) > end:
+            raise exceptions.ImageRangeError(self._flash_file, max(last['address'], end), start, end)
+
     def _prepare_flash(self):
         """ Process flash programming file
 
         Raises:
-            exceptions.FlashIsNotIhexError: flash image file is not in intel hex format.
+            exceptions.FlashIsNotIhexError: flash image file is not in a supported format.
 
-        1. Detect whether it is intel hex format
-        2. Take out the data
-        3. padding_space
-        4. cut_to_pages
+        1. Detect the format, ihex, S-record, ELF or raw binary
+        2. Take out the data to a SparseImage
+        3. cut_to_pages, the gaps of the pages are padded
         """
         if self._is_flash_prog:
-            try:
-                blocks = ihex.parse(self._flash_file)
-                self._flash_size = sum([len(block['data']) for block in blocks])
-                blocks = ihex.padding_space(blocks, 512, bytes.fromhex('FF'))
-                self._flash_pages = ihex.cut_to_pages(blocks, 512)
-            except Exception:
-                raise exceptions.FlashIsNotIhexError(self._flash_file)
+            if self._flash_image is None:
+                try:
+                    self._flash_image = image.load(self._flash_file, base_address=self._base_address)
+                except Exception:
+                    raise exceptions.FlashIsNotIhexError(self._flash_file)
+            self._flash_size = self._flash_image.size
+            # The sectors of the image are erased before programming, blank
+            # pages need not be written. They are still in the erase plan.
+            pages = ihex.drop_blank_pages(self._flash_image.pages, b'\xFF')
+            self._blank_pages = len(self._flash_image.pages) - len(pages)
+            # pages of an image are in address order, so pages of a sector are adjacent
+            self._flash_pages = pages
+
+    @property
+    def _flash_steps(self) -> int:
+        """ Steps of the flash stage, one per written page, at least one for the erase. """
+        return max(1, len(self._flash_pages))
     
     def _prepare_ext_flash(self):
         """ Process external flash programming files
 
         The basic operation is the same as _prepare_flash, and the difference will only be made when sending subsequent packets.
         """
-        if self._is_ext_flash_prog:
+        if self._is_ext_flash_prog and self._is_ext_flash_stream:
+            self._ext_flash_pages = _PageStream(self._ext_flash_file, 512, b'\xFF', self._base_address)
             try:
-                blocks = ihex.parse(self._ext_flash_file)
-                self._ext_flash_size = sum([len(block['data']) for block in blocks])
-                blocks = ihex.padding_space(blocks, 512, bytes.fromhex('FF'))
-                self._ext_flash_pages = ihex.cut_to_pages(blocks, 512)
-            except Exception:
+                self._ext_flash_pages.fetch(0)
+            except exceptions.ImageFormatError:
                 raise exceptions.FlashIsNotIhexError(self._ext_flash_file)
+        elif self._is_ext_flash_prog:
+            if self._ext_flash_image is None:
+                try:
+                    self._ext_flash_image = image.load(self._ext_flash_file, base_address=self._base_address)
+                except Exception:
+                    raise exceptions.FlashIsNotIhexError(self._ext_flash_file)
+            self._ext_flash_size = self._ext_flash_image.size
+            self._ext_flash_pages = self._ext_flash_image.pages
 
     def _prepare_eeprom(self):
         # TODO Discuss eeprom programming specifications, and complete.
         """ Process eeprom programming file.
 
         Raises:
-            exceptions.EepromIsNotIhexError: eeprom image file is not in intel hex format
+            exceptions.EepromIsNotIhexError: eeprom image file is not in a supported format
 
-        1. Detect whether it is intel hex format
-        2. Take out the data
-        3. padding_space
-        4. cut_to_pages
+        1. Detect the format, ihex, S-record, ELF or raw binary
+        2. Take out the data to a SparseImage
+        3. cut_to_pages, the gaps of the pages are padded
         """
         if self._is_eeprom_prog:
+            if self._eeprom_image is None:
+                try:
+                    self._eeprom_image = image.load(self._eeprom_file, base_address=self._base_address)
+                except Exception:
+                    raise exceptions.EepromIsNotIhexError(self._eeprom_file)
+            self._eeprom_size = self._eeprom_image.size
+            self._eeprom_pages = self._eeprom_image.pages
+
+    def _write_page(self, pages: list, idx: int, cmd: bootprotocol.CMD, end: int = None):
+        """ Write page `idx` of `pages`, keeping up to `window` writes outstanding.
+
+        Pages are sent ahead of `idx` and their responses are matched in
+        order. When a response is missing or negative the window falls back
+        to 1: the remaining responses are drained and the failed page is
+        written again, waiting for each response from then on.
+        Matching in order relies on the device answering every write, with
+        a negative response if it cannot program the page. A lost or
+        corrupted response may shift the ones after it, so the pages
+        acknowledged since the last time no write was outstanding are
+        verified, and written again if they differ.
+
+        Args:
+            pages (list): Pages of the current stage.
+            idx (int): The page which must be written when this returns.
+            cmd (bootprotocol.CMD): FLASH_WRITE or EXT_FLASH_WRITE.
+            end (int, optional): Pages from `end` on are not sent ahead.
+                The default is all pages.
+
+        Raises:
+            exceptions.ComuError: Communication error.
+        """
+        if cmd == bootprotocol.CMD.FLASH_WRITE:
+            put, write = self._cth._put_flash_write, self._cth._flash_write
+            verify = self._cth._flash_verify
+        else:
+            put, write = self._cth._put_ext_flash_write, self._cth._ext_flash_write
+            verify = self._cth._ext_flash_verify
+
+        if end is None:
+            end = len(pages)
+        end = min(end, idx - idx % self.SYNC_PAGES + self.SYNC_PAGES)
+        if idx == 0:
+            self._acked.clear()
+
+        if idx in self._acked:
+            # acknowledged while recovering from an error
+            self._acked.discard(idx)
+            return
+
+        if not self._inflight:
+            self._send_idx = idx
+            self._sync_idx = idx
+        if self._window == 1 and not self._inflight:
+            yield from write(pages[idx]['address'], pages[idx]['data'])
+            self._send_idx = idx + 1
+            return
+
+        while self._send_idx < end and len(self._inflight) < self._window:
+            yield from put(pages[self._send_idx]['address'], pages[self._send_idx]['data'])
+            self._inflight.append(self._send_idx)
+            self._send_idx += 1
+
+        self._inflight.popleft()
+        lost = False
+        try:
+            ok = yield from self._cth._get_write_ack(cmd)
+        except exceptions.ComuError:
+            ok = False
+            lost = True
+        if ok:
+            return
+
+        # Fall back to one outstanding write.
+        self._window = 1
+        while self._inflight:
+            i = self._inflight.popleft()
             try:
-                blocks = ihex.parse(self._eeprom_file)
-                self._eeprom_size = sum([len(block['data']) for block in blocks])
-                blocks = ihex.padding_space(blocks, 512, bytes.fromhex('FF'))
-                self._eeprom_pages = ihex.cut_to_pages(blocks, 512)
-            except Exception:
-                raise exceptions.EepromIsNotIhexError(self._eeprom_file)
+                if (yield from self._cth._get_write_ack(cmd)):
+                    self._acked.add(i)
+            except exceptions.ComuError:
+                lost = True
+                self._inflight.clear()
+        if lost:
+            # the responses may be shifted, trust none of them
+            yield from self._cth._resync(self._cth.backoff)
+            self._acked.clear()
+            for i in range(self._sync_idx, idx):
+                if not (yield from verify(pages[i]['address'], pages[i]['data'])):
+                    if (yield from write(pages[i]['address'], pages[i]['data'])) is False:
+                        raise exceptions.ComuError
+        if (yield from write(pages[idx]['address'], pages[idx]['data'])) is False:
+            raise exceptions.ComuError
+        self._send_idx = idx + 1
 
-    def _do_flash_prog_step(self):
-        address = self._flash_pages[self._flash_page_idx]['address']
-        data = self._flash_pages[self._flash_page_idx]['data']
+    def _begin_sector(self, sector: dict):
+        """ Erase the flash sector of the current page.
+
+        In delta mode the image pages of the sector are compared with the
+        device first, and the sector is only erased if any of them differs.
 
-        if self._flash_page_idx == 0:
-            self._cth.cmd_flash_erase_all()
-        self._cth.cmd_flash_write(address, data)
+        Args:
+            sector (dict): The current sector of `_flash_sectors`.
+        """
+        dirty = True
+        if self._is_delta:
+            dirty = False
+            for page in self._flash_image.pages[sector['start']:sector['end']]:
+                if not (yield from self._cth._flash_verify(page['address'], page['data'])):
+                    dirty = True
+                    break
+
+        if dirty:
+            res, address = yield from self._cth._flash_erase_sector(sector['sector'])
+            if res is False:
+                raise exceptions.ComuError
+            # the device echoes the erased address, another one means the
+            # sector size of the device list does not match the part
+            sector_size = device.device_list[self._device_type]['flash_sector_size']
+            if address != sector['sector'] * sector_size:
+                raise exceptions.ComuError
+        else:
+            self._skipped_pages += sector['write_end'] - sector['write_start']
+        self._sector_dirty = dirty
 
+    def _begin_blank_sectors(self):
+        """ Erase the sectors from the current one on which only hold blank pages of the image.
+        """
+        while self._sector_idx < len(self._flash_sectors):
+            sector = self._flash_sectors[self._sector_idx]
+            if sector['write_start'] != sector['write_end']:
+                break
+            yield from self._begin_sector(sector)
+            self._sector_idx += 1
+
+    def _do_flash_prog_step(self):
+        idx = self._flash_page_idx
+        is_last = idx + 1 >= self._flash_steps
+        if self._is_erase_all:
+            if idx == 0 and (yield from self._cth._flash_erase_all()) is False:
+                raise exceptions.ComuError
+            if idx < len(self._flash_pages):
+                yield from self._write_page(self._flash_pages, idx, bootprotocol.CMD.FLASH_WRITE)
+        else:
+            # erase each sector right before programming its pages
+            yield from self._begin_blank_sectors()
+            if idx < len(self._flash_pages):
+                sector = self._flash_sectors[self._sector_idx]
+                if idx == sector['write_start']:
+                    yield from self._begin_sector(sector)
+                if self._sector_dirty:
+                    yield from self._write_page(self._flash_pages, idx,
+                                                bootprotocol.CMD.FLASH_WRITE, sector['write_end'])
+                if idx + 1 == sector['write_end']:
+                    self._sector_idx += 1
+            if is_last:
+                yield from self._begin_blank_sectors()
+
+        # page idx is acknowledged, or needs no write
         self._flash_page_idx += 1
+        self._flash_acked = min(self._flash_page_idx, len(self._flash_pages))
         self._cur_step += 1
 
-        if self._flash_page_idx == len(self._flash_pages):
+        if is_last:
+            self._flash_done = True
             self._stage = next(self._stage_iter)
 
     def _do_ext_flash_prog_step(self):
         # Programming to external flash, the actual action content is the same as flash_prog
-        address = self._ext_flash_pages[self._ext_flash_page_idx]['address']
-        data = self._ext_flash_pages[self._ext_flash_page_idx]['data']
+        pages = self._ext_flash_pages
+        idx = self._ext_flash_page_idx
+        if idx == 0:
+            yield from self._cth._ext_flash_fopen()
 
-        if self._ext_flash_page_idx == 0:
-            self._cth.cmd_ext_flash_fopen()
-        self._cth.cmd_ext_flash_write(address, data)
+        if self._is_ext_flash_stream:
+            # read the pages of the window ahead
+            try:
+                pages.fetch(idx + self._window)
+            except exceptions.ImageFormatError:
+                raise exceptions.FlashIsNotIhexError(self._ext_flash_file)
+            # the pages since the last sync may be written again
+            pages.release(min(idx, self._sync_idx))
+            end = pages.available
+            is_last = pages.exhausted and idx + 1 == end
+        else:
+            end = len(pages)
+            is_last = idx + 1 == end
+        yield from self._write_page(pages, idx, bootprotocol.CMD.EXT_FLASH_WRITE, end)
 
+        # page idx is acknowledged, the pages after it may only be sent
         self._ext_flash_page_idx += 1
+        self._ext_flash_acked = self._ext_flash_page_idx
         self._cur_step += 1
 
-        if self._ext_flash_page_idx == len(self._ext_flash_pages):
-            self._cth.cmd_ext_flash_fclose()
+        if is_last:
+            if self._is_ext_flash_stream:
+                # replace the estimated steps by the real ones
+                self._total_steps += end - pages.estimate
+                self._ext_flash_size = pages.size
+            yield from self._cth._ext_flash_fclose()
+            self._ext_flash_done = True
             self._stage = next(self._stage_iter)
 
     def _do_ext_flash_boot_step(self):
         # Send external flash programming to internal flash command
-        self._cth.cmd_prog_ext_flash_boot()
+        yield from self._cth._prog_ext_flash_boot()
+        self._cur_step += 1
+        self._stage = next(self._stage_iter)
 
     def _do_eeprom_prog_step(self):
-        self._cth.cmd_eeprom_write(self._eeprom_pages[self._eeprom_page_idx])
+        yield from self._cth._eeprom_write(self._eeprom_pages[self._eeprom_page_idx]['data'])
 
         self._eeprom_page_idx += 1
+        self._eeprom_acked = self._eeprom_page_idx
         self._cur_step += 1
         if self._eeprom_page_idx == len(self._eeprom_pages):
+            self._eeprom_done = True
             self._stage = next(self._stage_iter)
 
     def _do_prog_end_step(self):
-        self._cth.cmd_prog_end()
+        yield from self._cth._prog_end()
         self._cur_step += 1
+        self._elapsed = time.monotonic() - self._start_time
+        self._is_finished = True
+        if self._timing_profile is not None:
+            self._timing_profile.update(self.device_name, self.baudrate, self._window_size,
+                                        timing.measure(self._cth.stats, self._elapsed))
+
+    def _step(self):
+        """ The next step of the programming, see `CommandTrnasHandler.run`.
+        """
+        stage = self.stage
+        if stage == self._Stage.FLASH_PROG:
+            yield from self._do_flash_prog_step()
+        elif stage == self._Stage.EEPROM_PROG:
+            yield from self._do_eeprom_prog_step()
+        elif stage == self._Stage.EXT_FLASH_PROG:
+            yield from self._do_ext_flash_prog_step()
+        elif stage == self._Stage.EXT_FLASH_BOOT:
+            yield from self._do_ext_flash_boot_step()
+        elif stage == self._Stage.END:
+            yield from self._do_prog_end_step()
 
     def do_step(self):
-        if self.stage == self._Stage.FLASH_PROG:
-            self._do_flash_prog_step()
-        elif self.stage == self._Stage.EEPROM_PROG:
-            self._do_eeprom_prog_step()
-        elif self.stage == self._Stage.EXT_FLASH_PROG:
-            self._do_ext_flash_prog_step()
-        elif self.stage == self._Stage.EXT_FLASH_BOOT:
-            self._do_ext_flash_boot_step()
-        elif self.stage == self._Stage.END:
-            self._do_prog_end_step()
+        stage = self.stage
+        try:
+            self._cth.run(self._step())
+        except Exception:
+            # keep what is acknowledged, for a resume
+            self._save_checkpoint()
+            raise
+        self._step_done(stage)
+
+    def _step_done(self, stage: _Stage):
+        """ Keep the checkpoint after a step of `stage`, remove it when finished.
+        """
+        if self._checkpoint is None:
+            return
+        if self._is_finished:
+            self._checkpoint.remove()
+        elif stage != self.stage or \
+                time.monotonic() - self._checkpoint_time >= self.CHECKPOINT_INTERVAL:
+            self._save_checkpoint()
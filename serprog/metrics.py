@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Per-command metrics.
+
+`CommandTrnasHandler` counts for each command the packets sent, the bytes
+sent and received, the timeouts, checksum errors and retries, and a
+histogram of the latency from sending the command to its complete response.
+
+The metrics of one or more programmings are written as JSON, or as a
+Prometheus textfile (for the textfile collector of node_exporter) when
+the file name ends with '.prom'.
+"""
+
+from serprog import bootprotocol
+
+import bisect
+import json
+import math
+import os
+
+# upper bounds of the latency buckets, seconds
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, math.inf)
+
+
+class CommandMetrics():
+    """ Metrics of one command.
+
+    Attributes:
+        sent (int): Packets sent.
+        received (int): Responses received, with or without error.
+        tx_bytes (int): Bytes sent.
+        rx_bytes (int): Bytes of the responses.
+        latency (float): Seconds from sending to the complete response, summed.
+        service (float): Seconds the device spent on the command, summed. A
+            pipelined command is timed from the previous response on.
+        buckets (list): Responses of each latency bucket of `BUCKETS`, not cumulative.
+        timeouts (int): Responses which did not arrive in time.
+        checksum_errors (int): Responses with a bad checksum.
+        retries (int): Times the command was sent again after an error.
+    """
+    __slots__ = ('sent', 'received', 'tx_bytes', 'rx_bytes', 'latency', 'service',
+                 'buckets', 'timeouts', 'checksum_errors', 'retries')
+
+    def __init__(self):
+        self.sent            = 0
+        self.received        = 0
+        self.tx_bytes        = 0
+        self.rx_bytes        = 0
+        self.latency         = 0.0
+        self.service         = 0.0
+        self.buckets         = [0] * len(BUCKETS)
+        self.timeouts        = 0
+        self.checksum_errors = 0
+        self.retries         = 0
+
+    def merge(self, other):
+        """ Add the metrics of `other` to this one. """
+        for name in self.__slots__:
+            if name == 'buckets':
+                self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+            else:
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self) -> dict:
+        """ The metrics as a dict of plain values, buckets are cumulative. """
+        res = {name: getattr(self, name) for name in self.__slots__ if name != 'buckets'}
+        res['buckets'] = dict()
+        total = 0
+        for le, n in zip(BUCKETS, self.buckets):
+            total += n
+            res['buckets']['+Inf' if le == math.inf else str(le)] = total
+        return res
+
+
+class Metrics():
+    """ Metrics of all commands of a connection, indexed by command. """
+
+    def __init__(self):
+        self._cmds = dict()
+
+    def __getitem__(self, cmd) -> CommandMetrics:
+        if cmd not in self._cmds:
+            self._cmds[cmd] = CommandMetrics()
+        return self._cmds[cmd]
+
+    def __contains__(self, cmd):
+        return cmd in self._cmds
+
+    def __iter__(self):
+        return iter(self._cmds)
+
+    def items(self):
+        return self._cmds.items()
+
+    def on_sent(self, cmd, nbytes: int):
+        m = self[cmd]
+        m.sent += 1
+        m.tx_bytes += nbytes
+
+    def on_received(self, cmd, nbytes: int, latency: float, service: float, error: bool = False):
+        m = self[cmd]
+        m.received += 1
+        m.rx_bytes += nbytes
+        if error:
+            m.checksum_errors += 1
+            return
+        m.latency += latency
+        m.service += service
+        m.buckets[bisect.bisect_left(BUCKETS, latency)] += 1
+
+    def on_timeout(self, cmd):
+        self[cmd].timeouts += 1
+
+    def on_retry(self, cmd):
+        self[cmd].retries += 1
+
+    def merge(self, other):
+        """ Add the metrics of `other` to this one. """
+        for cmd, m in other.items():
+            self[cmd].merge(m)
+
+    def as_dict(self) -> dict:
+        """ The metrics as a dict of command name -> `CommandMetrics.as_dict()`. """
+        return {_cmd_name(cmd): m.as_dict() for cmd, m in self._cmds.items()}
+
+
+def _cmd_name(cmd) -> str:
+    try:
+        return bootprotocol.CMD(cmd).name
+    except ValueError:
+        return f'0x{cmd:02X}'
+
+
+def to_json(runs: list) -> str:
+    """ Format the metrics of programmings as JSON.
+
+    Args:
+        runs (list): (labels, Metrics) of each programming, labels is a dict
+            such as {'port': 'COM3', 'device': 'ATSAME54_DEVB'}.
+
+    Returns:
+        str: {"runs": [{<labels>, "commands": {...}}, ...]}
+    """
+    res = []
+    for labels, m in runs:
+        run = dict(labels)
+        run['commands'] = m.as_dict()
+        res.append(run)
+    return json.dumps({'runs': res}, indent=2)
+
+
+def _labels(labels: dict) -> str:
+    items = []
+    for k, v in labels.items():
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        items.append(f'{k}="{v}"')
+    return '{' + ','.join(items) + '}'
+
+
+# name, help, CommandMetrics attribute
+_COUNTERS = (
+    ('serprog_command_sent_total', 'Packets sent.', 'sent'),
+    ('serprog_command_tx_bytes_total', 'Bytes sent.', 'tx_bytes'),
+    ('serprog_command_rx_bytes_total', 'Bytes of the responses.', 'rx_bytes'),
+    ('serprog_command_timeouts_total', 'Responses which did not arrive in time.', 'timeouts'),
+    ('serprog_command_checksum_errors_total', 'Responses with a bad checksum.', 'checksum_errors'),
+    ('serprog_command_retries_total', 'Times a command was sent again after an error.', 'retries'),
+)
+
+
+def to_prometheus(runs: list) -> str:
+    """ Format the metrics of programmings in the Prometheus text format.
+
+    Args:
+        runs (list): (labels, Metrics) of each programming, see `to_json`.
+            Numeric labels are written as labels too.
+
+    Returns:
+        str: The text, series are labelled with the run labels and 'command'.
+    """
+    lines = []
+    for name, text, attr in _COUNTERS:
+        lines.append(f'# HELP {name} {text}')
+        lines.append(f'# TYPE {name} counter')
+        for labels, m in runs:
+            for cmd, cm in m.items():
+                lbl = _labels({**labels, 'command': _cmd_name(cmd)})
+                lines.append(f'{name}{lbl} {getattr(cm, attr)}')
+
+    name = 'serprog_command_latency_seconds'
+    lines.append(f'# HELP {name} Seconds from sending a command to its complete response.')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, m in runs:
+        for cmd, cm in m.items():
+            series = {**labels, 'command': _cmd_name(cmd)}
+            total = 0
+            for le, n in zip(BUCKETS, cm.buckets):
+                total += n
+                lbl = _labels({**series, 'le': '+Inf' if le == math.inf else str(le)})
+                lines.append(f'{name}_bucket{lbl} {total}')
+            lines.append(f'{name}_sum{_labels(series)} {cm.latency!r}')
+            lines.append(f'{name}_count{_labels(series)} {total}')
+    return '\n'.join(lines) + '\n'
+
+
+def write(filename: str, runs: list):
+    """ Write the metrics of programmings, Prometheus text if `filename`
+    ends with '.prom', otherwise JSON.
+
+    The file is written next to `filename` first and then renamed, so a
+    collector never reads a half written file.
+
+    Args:
+        filename (str): The file to write.
+        runs (list): (labels, Metrics) of each programming, see `to_json`.
+    """
+    if filename.endswith('.prom'):
+        text = to_prometheus(runs)
+    else:
+        text = to_json(runs)
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'w') as f:
+        f.write(text)
+    os.replace(tmpname, filename)
@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+"""Simulated bootloader.
+
+`Bootloader` implements every command of `bootprotocol.CMD` on memory:
+the internal flash and eeprom of a device of `device.device_list`, and
+the external flash as the image files of a file system, like the
+LittleFS of the boards. It answers with the delays of a real link: the
+bytes take their time on the wire at the baud rate, and each command
+takes its time on the device. Responses can be dropped or corrupted at
+random to test the error handling.
+
+It is reached in two ways, both work with `serprog prog -p` unchanged:
+
+    sim://ATSAME54_DEVB?latency=FLASH_ERASE_ALL:0.5&error_rate=0.01
+        a pyserial URL, the bootloader runs in the programming process.
+        The options are the arguments of `Bootloader`, see `from_options`.
+
+    serprog simulate -d ATSAME54_DEVB
+        a pseudo terminal served by `PtyServer`, e.g. /dev/pts/3, for
+        programs which only open device files (POSIX only).
+"""
+
+from serprog import bootprotocol
+from serprog import device
+
+import collections
+import os
+import random
+import select
+import threading
+import time
+
+
+CMD = bootprotocol.CMD
+
+# Seconds each command takes on the device, others take no time.
+DEFAULT_LATENCY = {
+    CMD.FLASH_WRITE:            0.002,
+    CMD.FLASH_VERIFY:           0.0005,
+    CMD.FLASH_ERASE_SECTOR:     0.02,
+    CMD.FLASH_ERASE_ALL:        0.5,
+    CMD.EEPROM_WRITE:           0.005,
+    CMD.EEPROM_ERASE:           0.005,
+    CMD.EEPROM_ERASE_ALL:       0.05,
+    CMD.EXT_FLASH_WRITE:        0.004,
+    CMD.EXT_FLASH_VERIFY:       0.001,
+    CMD.EXT_FLASH_ERASE_SECTOR: 0.04,
+    CMD.EXT_FLASH_FCLOSE:       0.01,
+    CMD.EXT_FLASH_HEX_DEL:      0.01,
+    CMD.PROG_EXT_FLASH_BOOT:    1.0,
+}
+
+EEPROM_SIZE = 4096
+EXT_FLASH_SECTOR_SIZE = 4096
+# name of the image file on the external flash
+EXT_FLASH_FILE = 'image'
+
+_OK = b'\x00'
+_FAIL = b'\x01'
+
+
+def parse_latency(text: str) -> dict:
+    """ Parse command latencies, e.g. "FLASH_ERASE_ALL:0.5,FLASH_WRITE:0.001".
+
+    Raises:
+        ValueError: Unknown command or bad number.
+
+    Returns:
+        dict: CMD -> seconds.
+    """
+    res = dict()
+    for item in text.split(','):
+        if not item:
+            continue
+        name, sep, seconds = item.replace('=', ':').partition(':')
+        if not sep or name.upper() not in CMD.__members__:
+            raise ValueError(f'bad latency {item!r}')
+        res[CMD[name.upper()]] = float(seconds)
+    return res
+
+
+class Bootloader():
+    """ Memory model and command handler of a simulated bootloader.
+
+    Attributes:
+        flash (bytearray): The internal flash, from address 0.
+        eeprom (bytearray): The eeprom. EEPROM_WRITE carries only the page, which
+            is written after the page before, from address 0 after CHK_DEVICE.
+        files (dict): name -> {page address: data} of the external flash files.
+        counts (collections.Counter): Commands handled.
+    """
+
+    def __init__(self, device_type: int = 1, latency: dict = None, error_rate: float = 0.0,
+                 drop_rate: float = 0.0, max_baudrate: int = None, seed: int = None):
+        """ Initialization
+
+        Args:
+            device_type (int, optional): Device type of `device.device_list`. The default is 1.
+            latency (dict, optional): CMD -> seconds, changes `DEFAULT_LATENCY`. The default is None.
+            error_rate (float, optional): Probability of a response with a bad checksum. The default is 0.
+            drop_rate (float, optional): Probability of a response which is not sent. The default is 0.
+            max_baudrate (int, optional): Faster baud rates corrupt every response,
+                like a link which does not sustain them. The default is None, no limit.
+            seed (int, optional): Seed of the injected errors. The default is None.
+        """
+        if not 0 < device_type < len(device.device_list):
+            raise ValueError(f'bad device type {device_type}')
+        dev = device.device_list[device_type]
+        self.device_type  = device_type
+        self.app_start    = dev['userapp_start']
+        self.app_end      = dev['userapp_start'] + dev['userapp_size']
+        self.sector_size  = dev['flash_sector_size']
+        self.protocol_version = dev['protocol_version']
+
+        self.flash        = bytearray(b'\xFF' * self.app_end)
+        self.eeprom       = bytearray(b'\xFF' * EEPROM_SIZE)
+        self.flash_pgsz   = 512
+        self.eeprom_pgsz  = 512
+        self.files        = dict()
+        self.counts       = collections.Counter()
+        self._file        = None        # pages of the open external flash file
+        self._last_addr   = self.app_start
+        self._eeprom_addr = 0           # address of the next EEPROM_WRITE
+
+        self.latency      = dict(DEFAULT_LATENCY)
+        self.latency.update(latency or {})
+        self.error_rate   = error_rate
+        self.drop_rate    = drop_rate
+        self.max_baudrate = max_baudrate
+        self._random      = random.Random(seed)
+        self._pd          = bootprotocol.Decoder()
+        self._busy        = 0.0         # time the device finishes the last command
+
+    @classmethod
+    def from_options(cls, name: str, options: dict):
+        """ Create a bootloader from the options of a 'sim://' URL.
+
+        Args:
+            name (str): Device name or number, the host of the URL.
+            options (dict): 'latency' (see `parse_latency`), 'error_rate',
+                'drop_rate', 'max_baud' and 'seed', as strings.
+
+        Raises:
+            ValueError: Unknown device or option.
+        """
+        device_type = device.get_device_by_str(name or 'ATSAME54_DEVB')
+        if device_type < 1:
+            raise ValueError(f'unknown device {name!r}')
+        kwargs = dict()
+        for key, value in options.items():
+            if key == 'latency':
+                kwargs['latency'] = parse_latency(value)
+            elif key in ('error_rate', 'drop_rate'):
+                kwargs[key] = float(value)
+            elif key == 'max_baud':
+                kwargs['max_baudrate'] = int(value)
+            elif key == 'seed':
+                kwargs['seed'] = int(value)
+            else:
+                raise ValueError(f'unknown option {key!r}')
+        return cls(device_type, **kwargs)
+
+    def feed(self, data: bytes, now: float, baudrate: int = None) -> list:
+        """ Receive bytes from the host.
+
+        Args:
+            data (bytes): The bytes, starting to arrive at `now`.
+            now (float): `time.monotonic()` of the write.
+            baudrate (int, optional): The baud rate of the link, None sends
+                without wire time. The default is None.
+
+        Returns:
+            list: (time.monotonic() the response is received, frame) of each
+                answered packet.
+        """
+        byte_time = 10 / baudrate if baudrate else 0.0
+        corrupt = bool(self.max_baudrate and baudrate and baudrate > self.max_baudrate)
+        res = []
+        received = 0
+        for packet in self._pd.feed(data):
+            # the whole request has arrived, or the device is still busy
+            received += len(bootprotocol.HEADER) + 4 + len(packet.data)
+            start = max(now + received * byte_time, self._busy)
+            if packet.error:
+                frame = bootprotocol.encode(packet.command, _FAIL)
+            else:
+                self.counts[packet.command] += 1
+                frame = bootprotocol.encode(packet.command, self.handle(packet.command, bytes(packet.data)))
+                start += self.latency.get(packet.command, 0.0)
+            self._busy = start
+
+            r = self._random.random()
+            if r < self.drop_rate:
+                continue
+            if corrupt or r < self.drop_rate + self.error_rate:
+                frame = frame[:-1] + bytes([frame[-1] ^ 0xFF])
+            res.append((start + len(frame) * byte_time, frame))
+        return res
+
+    ###############################
+
+    def _in_app(self, address: int, size: int) -> bool:
+        return self.app_start <= address and address + size <= self.app_end
+
+    def handle(self, cmd: int, data: bytes) -> bytes:
+        """ Run a command.
+
+        Args:
+            cmd (int): The command.
+            data (bytes): The data of the request.
+
+        Returns:
+            bytes: The data of the response, a status byte (0 is success) and the result.
+        """
+        try:
+            method = getattr(self, '_cmd_' + CMD(cmd).name.lower())
+        except (ValueError, AttributeError):
+            # unknown command
+            return _FAIL
+        try:
+            return method(data)
+        except (IndexError, ValueError):
+            # too short request
+            return _FAIL
+
+    def _cmd_chk_protocol(self, data):
+        return bytes([0, self.protocol_version])
+
+    def _cmd_chk_device(self, data):
+        # the host starts a programming
+        self._eeprom_addr = 0
+        return bytes([0, self.device_type])
+
+    def _cmd_prog_end(self, data):
+        return _OK
+
+    def _cmd_prog_ext_flash_boot(self, data):
+        pages = self.files.get(EXT_FLASH_FILE)
+        if not pages or not all(self._in_app(a, len(d)) for a, d in pages.items()):
+            return _FAIL
+        self.flash[self.app_start:self.app_end] = b'\xFF' * (self.app_end - self.app_start)
+        for address, page in pages.items():
+            self.flash[address : address + len(page)] = page
+        return _OK
+
+    def _cmd_flash_set_pgsz(self, data):
+        self.flash_pgsz = int.from_bytes(data[:4], 'little')
+        return _OK
+
+    def _cmd_flash_get_pgsz(self, data):
+        return _OK + self.flash_pgsz.to_bytes(2, 'little')
+
+    def _cmd_flash_write(self, data):
+        address, page = int.from_bytes(data[:4], 'little'), data[4:]
+        if len(data) < 4 or not self._in_app(address, len(page)):
+            return _FAIL
+        # programming only clears bits, like NOR flash
+        old = int.from_bytes(self.flash[address : address + len(page)], 'little')
+        new = old & int.from_bytes(page, 'little')
+        self.flash[address : address + len(page)] = new.to_bytes(len(page), 'little')
+        self._last_addr = address
+        return _OK
+
+    def _cmd_flash_read(self, data):
+        address = int.from_bytes(data[:4], 'little') if len(data) >= 4 else self._last_addr
+        if not self._in_app(address, self.flash_pgsz):
+            return _FAIL
+        return _OK + bytes(self.flash[address : address + self.flash_pgsz])
+
+    def _cmd_flash_verify(self, data):
+        address, page = int.from_bytes(data[:4], 'little'), data[4:]
+        if len(data) < 4 or not self._in_app(address, len(page)):
+            return _FAIL
+        return _OK if self.flash[address : address + len(page)] == page else _FAIL
+
+    def _cmd_flash_erase_sector(self, data):
+        address = int.from_bytes(data[:2], 'little') * self.sector_size
+        if len(data) < 2 or not self._in_app(address, self.sector_size):
+            return _FAIL
+        self.flash[address : address + self.sector_size] = b'\xFF' * self.sector_size
+        return _OK + address.to_bytes(4, 'little')
+
+    def _cmd_flash_erase_all(self, data):
+        self.flash[self.app_start:self.app_end] = b'\xFF' * (self.app_end - self.app_start)
+        return _OK
+
+    def _cmd_eeprom_set_pgsz(self, data):
+        self.eeprom_pgsz = int.from_bytes(data[:4], 'little')
+        return _OK
+
+    def _cmd_eeprom_get_pgsz(self, data):
+        return _OK + self.eeprom_pgsz.to_bytes(2, 'little')
+
+    def _cmd_eeprom_write(self, data):
+        address = self._eeprom_addr
+        if not data or address + len(data) > EEPROM_SIZE:
+            return _FAIL
+        self.eeprom[address : address + len(data)] = data
+        self._eeprom_addr += len(data)
+        return _OK + address.to_bytes(4, 'little')
+
+    def _cmd_eeprom_read(self, data):
+        address = int.from_bytes(data[:4], 'little') if len(data) >= 4 else 0
+        if address + 4 > EEPROM_SIZE:
+            return _FAIL
+        return _OK + bytes(self.eeprom[address : address + 4])
+
+    def _cmd_eeprom_erase(self, data):
+        address = int.from_bytes(data[:4], 'little') if len(data) >= 4 else 0
+        address -= address % self.eeprom_pgsz
+        if address + self.eeprom_pgsz > EEPROM_SIZE:
+            return _FAIL
+        self.eeprom[address : address + self.eeprom_pgsz] = b'\xFF' * self.eeprom_pgsz
+        return _OK + address.to_bytes(4, 'little')
+
+    def _cmd_eeprom_erase_all(self, data):
+        self.eeprom[:] = b'\xFF' * EEPROM_SIZE
+        return _OK
+
+    def _cmd_ext_flash_fopen(self, data):
+        self._file = dict()
+        return _OK
+
+    def _cmd_ext_flash_fclose(self, data):
+        if self._file is None:
+            return _FAIL
+        self.files[EXT_FLASH_FILE] = self._file
+        self._file = None
+        return _OK
+
+    def _cmd_ext_flash_write(self, data):
+        if self._file is None or len(data) < 4:
+            return _FAIL
+        self._file[int.from_bytes(data[:4], 'little')] = bytes(data[4:])
+        return _OK
+
+    def _ext_pages(self):
+        return self._file if self._file is not None else self.files.get(EXT_FLASH_FILE, {})
+
+    def _cmd_ext_flash_read(self, data):
+        page = self._ext_pages().get(int.from_bytes(data[:4], 'little'))
+        return _FAIL if page is None else _OK + page
+
+    def _cmd_ext_flash_verify(self, data):
+        page = self._ext_pages().get(int.from_bytes(data[:4], 'little'))
+        return _OK if len(data) >= 4 and page == data[4:] else _FAIL
+
+    def _cmd_ext_flash_erase_sector(self, data):
+        sector = int.from_bytes(data[:2], 'little')
+        pages = self._ext_pages()
+        for address in [a for a in pages if a // EXT_FLASH_SECTOR_SIZE == sector]:
+            del pages[address]
+        return _OK
+
+    def _cmd_ext_flash_hex_del(self, data):
+        return _OK if self.files.pop(EXT_FLASH_FILE, None) is not None else _FAIL
+
+
+def _termios_speeds() -> dict:
+    import termios
+    return {getattr(termios, name): int(name[1:]) for name in dir(termios)
+            if name[0] == 'B' and name[1:].isdigit()}
+
+
+class PtyServer():
+    """ Serve a bootloader on a pseudo terminal (POSIX only).
+
+    Programs open `path` like a serial port. The wire time follows the
+    baud rate they set on it, unless `baudrate` is given.
+    """
+
+    def __init__(self, bootloader: Bootloader, baudrate: int = None):
+        import pty
+        import tty
+        self.bootloader = bootloader
+        self._baudrate = baudrate
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        self._speeds = _termios_speeds()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _link_baudrate(self) -> int:
+        if self._baudrate:
+            return self._baudrate
+        import termios
+        return self._speeds.get(termios.tcgetattr(self._slave)[4])
+
+    def _run(self):
+        pending = list()    # (ready time, frame), in order
+        while not self._stop.is_set():
+            timeout = 0.1
+            if pending:
+                timeout = min(timeout, max(0.0, pending[0][0] - time.monotonic()))
+            readable, _, _ = select.select([self._master], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(self._master, 65536)
+                except OSError:
+                    data = b''
+                if data:
+                    pending += self.bootloader.feed(data, time.monotonic(), self._link_baudrate())
+            now = time.monotonic()
+            while pending and pending[0][0] <= now:
+                os.write(self._master, pending.pop(0)[1])
+
+    def close(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""Sparse memory image.
+
+A sparse image holds the data of a programming file as sorted,
+non-overlapping segments. Records can be added in any order, adjacent
+records are merged into one segment, and pages are generated in one pass
+over the segments.
+
+Records after the last segment are appended in constant time. Records
+before it are kept aside and merged in one pass at the next read, a
+sort and one join per segment, so building an image is O(n log n) in the
+records and linear in the data regardless of their order. A balanced
+tree would merge each record in O(log n) at once, but it is not needed
+for images which are read after they are built.
+
+Segments are normally copied into bytearrays. Large buffers such as a
+memory mapped file can be added without copying, those segments are only
+copied when other data is merged into them.
+"""
+
+from serprog import exceptions
+
+from bisect import bisect_right
+
+class SparseImage():
+    """ Data segments sorted by address.
+
+    Iterating the image yields its segments as dicts of 'address' and
+    'data', the same as the data blocks of `serprog.ihex.parse` used to be.
+    """
+    __slots__ = ('_starts', '_datas', '_pending')
+
+    def __init__(self):
+        self._starts  = list()  # start address of each segment, ascending
+        self._datas   = list()  # bytearray, or buffer added with copy=False, of each segment
+        self._pending = list()  # (address, data) added before the last segment, see `merge`
+
+    @classmethod
+    def from_sections(cls, h):
+        """ Build an image from data blocks with start address.
+
+        Args:
+            h (iterable): dicts of 'address' and 'data'.
+
+        Raises:
+            serprog.exceptions.ImageOverlapError:
+
+        Returns:
+            SparseImage: The image.
+        """
+        img = cls()
+        for sect in h:
+            img.add(sect['address'], sect['data'])
+        img.merge()
+        return img
+
+    @property
+    def size(self) -> int:
+        """ Bytes of data, without gaps. """
+        self.merge()
+        return sum([len(data) for data in self._datas])
+
+    def __len__(self):
+        self.merge()
+        return len(self._starts)
+
+    def __iter__(self):
+        self.merge()
+        for start, data in zip(self._starts, self._datas):
+            yield {'address': start, 'data': data}
+
+    def _own(self, i: int):
+        # a buffer added with copy=False is copied before it is changed
+        if type(self._datas[i]) is not bytearray:
+            self._datas[i] = bytearray(self._datas[i])
+
+    def add(self, address: int, data: bytes, copy: bool = True):
+        """ Add data at an address.
+
+        Data which follows the last segment is appended to it or starts a
+        new segment. Data before the end of the last segment is kept aside
+        until the next read of the image, or `merge`.
+
+        Args:
+            address (int): Start address of the data.
+            data (bytes): The data.
+            copy (bool, optional): False keeps `data` itself as a segment
+                without merging it, it must not change afterwards. The default is True.
+
+        Raises:
+            serprog.exceptions.ImageOverlapError: The data overlaps data already added.
+                Data kept aside is checked when it is merged.
+        """
+        if not len(data):
+            return
+        starts, datas = self._starts, self._datas
+
+        if starts:
+            last_end = starts[-1] + len(datas[-1])
+            if address < last_end:
+                self._pending.append((address, bytearray(data) if copy else data))
+                return
+            # records in ascending order
+            if copy and address == last_end:
+                self._own(-1)
+                datas[-1] += data
+                return
+
+        starts.append(address)
+        datas.append(bytearray(data) if copy else data)
+
+    def merge(self):
+        """ Merge the data kept aside by `add` into the segments.
+
+        The pieces are sorted, and each run of adjacent segments and pieces
+        is joined into one segment at once.
+
+        Raises:
+            serprog.exceptions.ImageOverlapError: The data overlaps.
+        """
+        if not self._pending:
+            return
+        pieces = sorted(self._pending, key=lambda piece: piece[0])
+        self._pending = list()
+        pieces += zip(self._starts, self._datas)
+        # both parts are sorted, so this sort only merges them
+        pieces.sort(key=lambda piece: piece[0])
+
+        starts, datas = list(), list()
+        run = list()
+        run_end = None
+        for address, data in pieces:
+            if run and address < run_end:
+                raise exceptions.ImageOverlapError(address, len(data))
+            if run and address == run_end:
+                run.append(data)
+            else:
+                if run:
+                    datas.append(run[0] if len(run) == 1 else bytearray(b''.join(run)))
+                starts.append(address)
+                run = [data]
+                run_end = address
+            run_end += len(data)
+        datas.append(run[0] if len(run) == 1 else bytearray(b''.join(run)))
+        self._starts, self._datas = starts, datas
+
+    def update(self, records):
+        """ Add many records, the same as `add` for each of them.
+
+        Records in ascending order are appended without a search. The
+        records added out of order are merged at the end.
+
+        Args:
+            records (iterable): (address, data) records.
+
+        Raises:
+            serprog.exceptions.ImageOverlapError: The data overlaps data already added.
+        """
+        starts, datas = self._starts, self._datas
+        end = None
+        for address, data in records:
+            if address == end:
+                last += data
+                end += len(data)
+            else:
+                self.add(address, data)
+                if datas and type(datas[-1]) is bytearray:
+                    last = datas[-1]
+                    end = starts[-1] + len(last)
+                else:
+                    end = None
+        self.merge()
+
+    def read(self, address: int, size: int, space_data: bytes = b'\xFF') -> bytes:
+        """ Read a range of the image, gaps are filled with `space_data`.
+
+        Args:
+            address (int): Start address.
+            size (int): Bytes to read.
+            space_data (bytes, optional): the byte data of the gaps. The default is b'\\xFF'.
+
+        Returns:
+            bytes: The data.
+        """
+        self.merge()
+        res = bytearray(space_data * size)
+        end = address + size
+        i = max(bisect_right(self._starts, address) - 1, 0)
+        while i < len(self._starts) and self._starts[i] < end:
+            start, data = self._starts[i], self._datas[i]
+            lo = max(start, address)
+            hi = min(start + len(data), end)
+            if lo < hi:
+                res[lo - address : hi - address] = data[lo - start : hi - start]
+            i += 1
+        return bytes(res)
+
+    def _groups(self, pgsz: int):
+        """ Group the segments to runs of adjacent pages.
+
+        Yields:
+            tuple: (first segment, last segment + 1, run start address, run end address)
+        """
+        i = 0
+        count = len(self._starts)
+        while i < count:
+            run_start = self._starts[i] - self._starts[i] % pgsz
+            run_end = -(-(self._starts[i] + len(self._datas[i])) // pgsz) * pgsz
+            j = i + 1
+            while j < count and self._starts[j] - self._starts[j] % pgsz <= run_end:
+                run_end = -(-(self._starts[j] + len(self._datas[j])) // pgsz) * pgsz
+                j += 1
+            yield i, j, run_start, run_end
+            i = j
+
+    def runs(self, pgsz: int, space_data: bytes = b'\xFF'):
+        """ Pad the image to runs of adjacent whole pages.
+
+        Segments which share a page or are in adjacent pages are copied into
+        one buffer, the gaps are filled with `space_data`.
+
+        Args:
+            pgsz (int): page size, e.g. 256, 512.
+            space_data (bytes, optional): the byte data used to padding. The default is b'\\xFF'.
+
+        Yields:
+            tuple: (address, bytearray) of each run, both multiples of `pgsz`.
+        """
+        self.merge()
+        for i, j, run_start, run_end in self._groups(pgsz):
+            buf = bytearray(space_data * (run_end - run_start))
+            for k in range(i, j):
+                offset = self._starts[k] - run_start
+                buf[offset : offset + len(self._datas[k])] = self._datas[k]
+            yield run_start, buf
+
+    def pages(self, pgsz: int, space_data: bytes = b'\xFF'):
+        """ Cut the image to pages in ascending address order.
+
+        Only pages containing data are generated. The pages are read only
+        views of the buffers of `runs`, nothing is copied per page. A run of
+        one page aligned segment added with copy=False is not copied at all,
+        except for its last partial page. Time is linear in the image size.
+
+        Args:
+            pgsz (int): page size, e.g. 256, 512.
+            space_data (bytes, optional): the byte data used to padding. The default is b'\\xFF'.
+
+        Yields:
+            dict: data page, 'data' is a memoryview.
+        """
+        self.merge()
+        for i, j, run_start, run_end in self._groups(pgsz):
+            data = self._datas[i]
+            if j == i + 1 and run_start == self._starts[i] and type(data) is not bytearray:
+                view = memoryview(data).toreadonly()
+                full = len(view) - len(view) % pgsz
+                for offset in range(0, full, pgsz):
+                    yield {'address': run_start + offset, 'data': view[offset : offset + pgsz]}
+                if full < len(view):
+                    page = bytearray(space_data * pgsz)
+                    page[:len(view) - full] = view[full:]
+                    yield {'address': run_start + full, 'data': memoryview(page).toreadonly()}
+                continue
+
+            buf = bytearray(space_data * (run_end - run_start))
+            for k in range(i, j):
+                offset = self._starts[k] - run_start
+                buf[offset : offset + len(self._datas[k])] = self._datas[k]
+            view = memoryview(buf).toreadonly()
+            for offset in range(0, len(buf), pgsz):
+                yield {'address': run_start + offset, 'data': view[offset : offset + pgsz]}
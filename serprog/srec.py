@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Motorola S-record functions.
+
+This module provides functions to handle S-record files (.srec, .s19,
+.s28, .s37), the same as `serprog.ihex` does for ihex files.
+
+Each line is a record "S" + type + count + address + data + checksum.
+The count is the number of bytes after it, and the checksum is the ones'
+complement of the low byte of the sum of count, address and data.
+"""
+
+from serprog import exceptions
+from serprog.sparseimage import SparseImage
+
+# address bytes of each record type
+_ADDR_SIZE = {
+    0: 2,   # header
+    1: 2,   # data, 16 bits address
+    2: 3,   # data, 24 bits address
+    3: 4,   # data, 32 bits address
+    5: 2,   # record count
+    6: 3,   # record count
+    7: 4,   # start address, end of S3 file
+    8: 3,   # start address, end of S2 file
+    9: 2,   # start address, end of S1 file
+}
+
+
+def iter_records(filename: str):
+    """ Read the data records of an S-record file one by one.
+
+    Args:
+        filename (str): The file to read.
+
+    Raises:
+        serprog.exceptions.SrecFormatError: Raised when the bad record is reached.
+
+    Yields:
+        tuple: (address, data) of each data record.
+    """
+    with open(filename, 'r') as srecfile:
+        lineno = 0
+        for lineno, line in enumerate(srecfile, 1):
+            line = line.rstrip()
+            if not line:
+                continue
+            if len(line) < 4 or line[0] != 'S' or not line[1].isdigit():
+                raise exceptions.SrecFormatError(filename, lineno)
+            record_type = int(line[1])
+            try:
+                record = bytes.fromhex(line[2:])
+            except ValueError:
+                raise exceptions.SrecFormatError(filename, lineno)
+
+            addr_size = _ADDR_SIZE.get(record_type)
+            if addr_size is None or record[0] != len(record) - 1 or record[0] < addr_size + 1:
+                raise exceptions.SrecFormatError(filename, lineno)
+            if sum(record) & 0xFF != 0xFF:
+                # checksum error
+                raise exceptions.SrecFormatError(filename, lineno)
+
+            if record_type in (1, 2, 3):
+                data = record[1 + addr_size : -1]
+                if data:
+                    yield int.from_bytes(record[1 : 1 + addr_size], 'big'), data
+            elif record_type in (7, 8, 9):
+                return
+
+    # no termination record
+    raise exceptions.SrecFormatError(filename, lineno + 1)
+
+
+def parse(filename: str) -> SparseImage:
+    """ Parse S-record file to a sparse image.
+
+    Args:
+        filename (str): The file to parse.
+
+    Raises:
+        serprog.exceptions.SrecFormatError: `lineno` is the line of the bad record,
+            or 0 when records overlap.
+
+    Returns:
+        SparseImage: data segments with start address.
+    """
+    img = SparseImage()
+    try:
+        img.update(iter_records(filename))
+    except exceptions.ImageOverlapError as e:
+        raise exceptions.SrecFormatError(filename) from e
+    return img
+
+
+def is_srec(filename: str) -> bool:
+    """Check the file is S-record format.
+
+    Args:
+        filename (str): The file to check.
+
+    Returns:
+        bool: True or False.
+    """
+    try:
+        parse(filename)
+    except exceptions.SrecFormatError:
+        return False
+    return True
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Programming time model.
+
+The time of a programming is a fixed overhead plus the time of each
+command: per page written, per sector erased, per page verified. The
+loader measures these times while it programs, and a `Profile` keeps a
+moving average of them per device, baud rate and write window in a JSON
+file, so the next estimate is based on what the fixture really does.
+
+Until a device has been measured, the times of its 'prog_time' entry in
+`serprog.device.device_list` are used.
+"""
+
+from serprog import bootprotocol
+from serprog import device
+
+import json
+import os
+import threading
+
+# command -> time key
+CMD_KEYS = {
+    bootprotocol.CMD.FLASH_WRITE:           'flash_page',
+    bootprotocol.CMD.FLASH_VERIFY:          'verify_page',
+    bootprotocol.CMD.FLASH_ERASE_SECTOR:    'erase_sector',
+    bootprotocol.CMD.FLASH_ERASE_ALL:       'erase_all',
+    bootprotocol.CMD.EXT_FLASH_WRITE:       'ext_flash_page',
+    bootprotocol.CMD.EEPROM_WRITE:          'eeprom_page',
+}
+
+def page_wire_time(baudrate: int) -> float:
+    """ Seconds on the wire of a 512-byte page write and its response.
+    """
+    # header, command, length, address, data, checksum + response
+    frame = len(bootprotocol.HEADER) + 3 + 4 + 512 + 1 + \
+            len(bootprotocol.HEADER) + 3 + 1 + 1
+    return frame * 10 / baudrate
+
+def default_times(device_type: int, baudrate: int) -> dict:
+    """ Times of a device which has not been measured.
+
+    The page times of the device list are measured at 115200 baud, their
+    wire part is scaled to `baudrate`. Erase and verify are included in
+    the page times.
+
+    Args:
+        device_type (int): Device type.
+        baudrate (int): Baud rate of the serial port.
+
+    Returns:
+        dict: Seconds of each time key, and 'overhead'.
+    """
+    times = dict(device.device_list[device_type]['prog_time'])
+    wire = page_wire_time(baudrate) - page_wire_time(115200)
+    for key in ('flash_page', 'ext_flash_page', 'eeprom_page'):
+        if times[key]:
+            times[key] += wire
+    times.update({'verify_page': 0.0, 'erase_sector': 0.0, 'erase_all': 0.0})
+    return times
+
+def measure(stats: dict, elapsed: float) -> dict:
+    """ Times of a finished programming.
+
+    Args:
+        stats (dict): command -> [count, seconds], see
+            `serprog.loader.CommandTrnasHandler.stats`.
+        elapsed (float): Seconds of the whole programming.
+
+    Returns:
+        dict: Seconds of each measured time key, and 'overhead' for the
+            time not spent in those commands.
+    """
+    times = dict()
+    spent = 0.0
+    for cmd, (count, seconds) in stats.items():
+        key = CMD_KEYS.get(cmd)
+        if key is not None and count:
+            times[key] = seconds / count
+            spent += seconds
+    times['overhead'] = max(0.0, elapsed - spent)
+    return times
+
+def estimate(times: dict, flash_pages: int = 0, erase_sectors: int = 0, erase_all: bool = False,
+             verify_pages: int = 0, ext_flash_pages: int = 0, eeprom_pages: int = 0,
+             overhead: bool = True) -> float:
+    """ Seconds to program.
+
+    Args:
+        times (dict): Seconds of each time key, see `default_times`.
+        flash_pages (int, optional): Flash pages to write. The default is 0.
+        erase_sectors (int, optional): Flash sectors to erase. The default is 0.
+        erase_all (bool, optional): Erase the whole flash. The default is False.
+        verify_pages (int, optional): Flash pages to verify. The default is 0.
+        ext_flash_pages (int, optional): External flash pages to write. The default is 0.
+        eeprom_pages (int, optional): Eeprom pages to write. The default is 0.
+        overhead (bool, optional): Include the fixed overhead. The default is True.
+
+    Returns:
+        float: Seconds.
+    """
+    return flash_pages * times['flash_page'] + \
+           erase_sectors * times['erase_sector'] + \
+           (times['erase_all'] if erase_all else 0) + \
+           verify_pages * times['verify_page'] + \
+           ext_flash_pages * times['ext_flash_page'] + \
+           eeprom_pages * times['eeprom_page'] + \
+           (times['overhead'] if overhead else 0)
+
+
+def default_path() -> str:
+    """ The profile file, $SERPROG_TIMING or ~/.serprog/timing.json.
+    """
+    path = os.environ.get('SERPROG_TIMING')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), '.serprog', 'timing.json')
+
+
+class Profile():
+    """ Measured times of each device, baud rate and write window.
+
+    The file maps a device name to keys "<baud rate>/<window>", each with
+    the seconds of the time keys and the number of programmings 'runs',
+    and to 'baudrate', the rate negotiated last for the device.
+    It is safe to update a profile from several threads.
+    """
+
+    # weight of the newest programming in the moving average
+    ALPHA = 0.3
+
+    def __init__(self, path: str = None):
+        self.path = path if path is not None else default_path()
+        self._devices = dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str = None):
+        """ Read a profile, a missing or broken file is an empty profile.
+
+        Args:
+            path (str, optional): The profile file. The default is `default_path()`.
+
+        Returns:
+            Profile: The profile.
+        """
+        profile = cls(path)
+        try:
+            with open(profile.path, 'r') as f:
+                devices = json.load(f)
+            if isinstance(devices, dict):
+                profile._devices = devices
+        except (OSError, ValueError):
+            pass
+        return profile
+
+    def save(self):
+        """ Write the profile.
+
+        Raises:
+            OSError: The file can not be written.
+        """
+        with self._lock:
+            text = json.dumps(self._devices, indent=2, sort_keys=True)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmpname = self.path + '.tmp'
+        with open(tmpname, 'w') as f:
+            f.write(text)
+        os.replace(tmpname, self.path)
+
+    def get(self, device_name: str, baudrate: int, window: int = 1) -> dict:
+        """ Measured times of a device.
+
+        Returns:
+            dict: Seconds of each measured time key, empty if never measured.
+        """
+        with self._lock:
+            entry = self._devices.get(device_name, {}).get(f'{baudrate}/{window}', {})
+            return {k: v for k, v in entry.items() if k != 'runs'}
+
+    def update(self, device_name: str, baudrate: int, window: int, times: dict):
+        """ Add the times of a programming to the moving average.
+
+        Args:
+            device_name (str): Device name.
+            baudrate (int): Baud rate of the serial port.
+            window (int): Write window of the programming.
+            times (dict): Seconds of each time key, from `measure`.
+        """
+        with self._lock:
+            entry = self._devices.setdefault(device_name, {}).setdefault(f'{baudrate}/{window}', {})
+            for key, seconds in times.items():
+                if key in entry:
+                    entry[key] += self.ALPHA * (seconds - entry[key])
+                else:
+                    entry[key] = seconds
+            entry['runs'] = entry.get('runs', 0) + 1
+
+    def baudrate(self, device_name: str) -> int:
+        """ The baud rate negotiated last for a device.
+
+        Returns:
+            int: The baud rate, None if never negotiated.
+        """
+        with self._lock:
+            rate = self._devices.get(device_name, {}).get('baudrate')
+            return rate if isinstance(rate, int) else None
+
+    def set_baudrate(self, device_name: str, baudrate: int):
+        """ Keep the baud rate negotiated for a device, used by default next time. """
+        with self._lock:
+            self._devices.setdefault(device_name, {})['baudrate'] = baudrate
+
+    def entries(self) -> list:
+        """ All measured entries.
+
+        Returns:
+            list: (device name, baud rate, window, times with 'runs') in name and rate order.
+        """
+        res = []
+        with self._lock:
+            for name, keys in sorted(self._devices.items()):
+                for key, entry in keys.items():
+                    if not isinstance(entry, dict):
+                        continue
+                    baudrate, _, window = key.partition('/')
+                    res.append((name, int(baudrate), int(window or 1), dict(entry)))
+        res.sort(key=lambda e: (e[0], e[1], e[2]))
+        return res
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""Wire-level trace recorder and replay.
+
+`TraceSerial` wraps an opened serial port and records every chunk written
+to and read from it with the time since the previous record. A trace is
+replayed without hardware by `ReplaySerial`, which answers the writes of
+a `serprog.loader.Loader` with the recorded responses, either at the
+recorded pace or as fast as possible.
+
+File layout, all integers little endian:
+
+    header   magic (8), version (2), meta size (4), meta (JSON)
+    records  kind (1), microseconds since the previous record (4),
+             size (4), data (size), until the end of the file
+
+The meta holds the arguments of the programming, so it can be run again.
+"""
+
+from serprog import bootprotocol
+from serprog import exceptions
+
+import json
+import struct
+import threading
+import time
+
+MAGIC = b'SPRGTRC\x00'
+VERSION = 1
+
+TX   = 0    # bytes written to the port
+RX   = 1    # bytes read from the port
+BAUD = 2    # baud rate changed, data is the rate (4 bytes)
+
+_HEADER = struct.Struct('<8sHI')    # magic, version, meta size
+_RECORD = struct.Struct('<BII')     # kind, delta us, size
+
+
+class TraceSerial():
+    """ Serial port which records its traffic to a trace file.
+
+    Everything but `read`, `write`, `baudrate`, `timeout` and `close` is
+    passed to the wrapped port. It may be read and written by different
+    threads, see `serprog.loader.SerialTransport`.
+    """
+
+    def __init__(self, ser, filename: str, meta: dict = None):
+        """ Initialization
+
+        Args:
+            ser (serial.Serial): The opened serial port.
+            filename (str): The trace file to write.
+            meta (dict, optional): JSON serializable arguments of the
+                programming, stored in the trace header. The default is None.
+        """
+        self._ser = ser
+        self._file = open(filename, 'wb')
+        self._lock = threading.Lock()
+        self._last = time.monotonic()
+        meta = dict(meta or {}, baudrate=ser.baudrate)
+        text = json.dumps(meta).encode()
+        self._file.write(_HEADER.pack(MAGIC, VERSION, len(text)))
+        self._file.write(text)
+
+    def _record(self, kind: int, data: bytes):
+        with self._lock:
+            if self._file.closed:
+                return
+            now = time.monotonic()
+            delta = min(int((now - self._last) * 1e6), 0xFFFFFFFF)
+            self._last = now
+            self._file.write(_RECORD.pack(kind, delta, len(data)))
+            self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._ser, name)
+
+    @property
+    def baudrate(self):
+        return self._ser.baudrate
+
+    @baudrate.setter
+    def baudrate(self, rate):
+        self._ser.baudrate = rate
+        self._record(BAUD, rate.to_bytes(4, 'little'))
+
+    @property
+    def timeout(self):
+        return self._ser.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._ser.timeout = timeout
+
+    def write(self, data) -> int:
+        n = self._ser.write(data)
+        self._record(TX, data)
+        return n
+
+    def read(self, size: int = 1) -> bytes:
+        data = self._ser.read(size)
+        if data:
+            self._record(RX, data)
+        return data
+
+    def close(self):
+        self._ser.close()
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class Trace():
+    """ A loaded trace.
+
+    Attributes:
+        meta (dict): The arguments of the programming, and 'baudrate'.
+        records (list): (kind, seconds since the start, data) of each record.
+    """
+    __slots__ = ('meta', 'records')
+
+    def __init__(self, meta: dict, records: list):
+        self.meta    = meta
+        self.records = records
+
+    @property
+    def duration(self) -> float:
+        """ Seconds from the start to the last record. """
+        return self.records[-1][1] if self.records else 0.0
+
+    def count(self, kind: int) -> int:
+        return len([r for r in self.records if r[0] == kind])
+
+
+def load(filename: str) -> Trace:
+    """ Read a trace file.
+
+    A record cut off at the end, e.g. by a crash, is dropped.
+
+    Args:
+        filename (str): The trace to read.
+
+    Raises:
+        serprog.exceptions.TraceFormatError: Not a trace or an unknown version.
+
+    Returns:
+        Trace: The trace.
+    """
+    with open(filename, 'rb') as f:
+        buf = f.read()
+    if len(buf) < _HEADER.size:
+        raise exceptions.TraceFormatError(filename)
+    magic, version, meta_size = _HEADER.unpack_from(buf)
+    if magic != MAGIC or version != VERSION:
+        raise exceptions.TraceFormatError(filename)
+    try:
+        meta = json.loads(buf[_HEADER.size : _HEADER.size + meta_size])
+    except ValueError:
+        raise exceptions.TraceFormatError(filename)
+
+    records = []
+    t = 0
+    pos = _HEADER.size + meta_size
+    while pos + _RECORD.size <= len(buf):
+        kind, delta, size = _RECORD.unpack_from(buf, pos)
+        pos += _RECORD.size
+        if pos + size > len(buf):
+            break
+        t += delta
+        records.append((kind, t / 1e6, buf[pos : pos + size]))
+        pos += size
+    return Trace(meta, records)
+
+
+def decode(trace: Trace) -> tuple:
+    """ Feed the received bytes of a trace through `bootprotocol.Decoder`.
+
+    Returns:
+        tuple: (packets, packets with checksum error, seconds spent decoding)
+    """
+    pd = bootprotocol.Decoder()
+    packets = errors = 0
+    start = time.perf_counter()
+    for kind, _, data in trace.records:
+        if kind == RX:
+            for packet in pd.feed(data):
+                packets += 1
+                if packet.error:
+                    errors += 1
+    return packets, errors, time.perf_counter() - start
+
+
+class ReplaySerial():
+    """ Serial port which answers with the responses of a trace.
+
+    The received records between two written records are released when
+    the first one is written, so a loader doing the same programming
+    reads the same bytes. With `realtime` each of them is released after
+    the delay it had from the previous write, otherwise at once.
+
+    It may be read and written by different threads.
+
+    Attributes:
+        mismatches (int): Writes which differ from the trace, or exceed it.
+    """
+
+    def __init__(self, trace: Trace, realtime: bool = True):
+        self.timeout = None
+        self.baudrate = trace.meta.get('baudrate', 115200)
+        self.port = 'replay'
+        self.is_open = True
+        self.mismatches = 0
+        self._records = trace.records
+        self._realtime = realtime
+        self._pos = 0                   # next record
+        self._rx = bytearray()          # released, not read yet
+        self._anchor = (time.monotonic(), 0.0)     # (now, trace time) of the last write
+        self._cond = threading.Condition()         # notified by writes
+
+    def _release(self) -> float:
+        """ Move the due received records to the buffer.
+
+        Returns:
+            float: Seconds until the next received record is due, None if
+                there is none before the next write.
+        """
+        while self._pos < len(self._records):
+            kind, t, data = self._records[self._pos]
+            if kind == TX:
+                return None
+            if kind == RX:
+                if self._realtime:
+                    wait = self._anchor[0] + (t - self._anchor[1]) - time.monotonic()
+                    if wait > 0:
+                        return wait
+                self._rx += data
+            self._pos += 1
+        return None
+
+    @property
+    def in_waiting(self) -> int:
+        with self._cond:
+            self._release()
+            return len(self._rx)
+
+    def read(self, size: int = 1) -> bytes:
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                wait = self._release()
+                if self._rx:
+                    data = bytes(self._rx[:size])
+                    del self._rx[:size]
+                    return data
+                if wait is None and deadline is None:
+                    # nothing more until the next write, as the device did
+                    raise exceptions.ComuError
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return b''
+                    wait = remaining if wait is None else min(wait, remaining)
+                # a write releases the next responses
+                self._cond.wait(wait)
+
+    def write(self, data) -> int:
+        with self._cond:
+            n = self._write(data)
+            self._cond.notify_all()
+            return n
+
+    def _write(self, data) -> int:
+        # the responses to the previous writes are released at once
+        while self._pos < len(self._records) and self._records[self._pos][0] != TX:
+            kind, _, rx = self._records[self._pos]
+            if kind == RX:
+                self._rx += rx
+            self._pos += 1
+        if self._pos == len(self._records):
+            self.mismatches += 1
+            return len(data)
+        _, t, tx = self._records[self._pos]
+        if tx != bytes(data):
+            self.mismatches += 1
+        self._pos += 1
+        self._anchor = (time.monotonic(), t)
+        return len(data)
+
+    def reset_input_buffer(self):
+        # the trace only holds the bytes which were read
+        pass
+
+    def close(self):
+        self.is_open = False
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""pyserial URL handlers of serprog, registered by `serprog` when it is imported."""
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""pyserial handler of 'sim://' URLs, a port to a simulated bootloader.
+
+URL format: sim://<device name or number>[?option=value[&...]], the
+options are those of `serprog.simulator.Bootloader.from_options`, e.g.
+
+    sim://NUM487KM_DEVB?latency=FLASH_WRITE:0.001&drop_rate=0.01&seed=1
+"""
+
+from serprog import simulator
+
+from serial.serialutil import SerialBase, SerialException, PortNotOpenError
+
+import numbers
+import threading
+import time
+import urllib.parse
+
+
+class Serial(SerialBase):
+    """ Serial port connected to a `simulator.Bootloader` in this process.
+
+    The responses arrive when the bootloader would send them, at the
+    baud rate of the port. It may be read and written by different threads.
+
+    Attributes:
+        bootloader (simulator.Bootloader): The simulated device.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.bootloader = None
+        self._rx = bytearray()
+        self._pending = list()      # (time the frame is received, frame), in order
+        self._cond = threading.Condition()  # notified by writes and close
+        super(Serial, self).__init__(*args, **kwargs)
+
+    def open(self):
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        if self._port is None:
+            raise SerialException("Port must be configured before it can be used.")
+        self.from_url(self.port)
+        self._reconfigure_port()
+        self._rx.clear()
+        self._pending.clear()
+        self.is_open = True
+
+    def from_url(self, url: str):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != 'sim':
+            raise SerialException(f'expected a string in the form "sim://<device>[?option=value]": {url!r}')
+        options = {k: v[-1] for k, v in urllib.parse.parse_qs(parts.query, True).items()}
+        try:
+            self.bootloader = simulator.Bootloader.from_options(parts.netloc, options)
+        except ValueError as e:
+            raise SerialException(f'{url!r}: {e}')
+
+    def _reconfigure_port(self):
+        if not isinstance(self._baudrate, numbers.Integral) or not 0 < self._baudrate < 2 ** 32:
+            raise ValueError("invalid baudrate: {!r}".format(self._baudrate))
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+    def _release(self):
+        now = time.monotonic()
+        while self._pending and self._pending[0][0] <= now:
+            self._rx += self._pending.pop(0)[1]
+
+    @property
+    def in_waiting(self) -> int:
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self._cond:
+            self._release()
+            return len(self._rx)
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.is_open:
+            raise PortNotOpenError()
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        with self._cond:
+            while self.is_open:
+                self._release()
+                if len(self._rx) >= size:
+                    break
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    break
+                # wait for the next frame or write, a device which never answers blocks forever
+                wait = self._pending[0][0] - now if self._pending else None
+                if deadline is not None:
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._cond.wait(wait)
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            return data
+
+    def write(self, data) -> int:
+        if not self.is_open:
+            raise PortNotOpenError()
+        frames = self.bootloader.feed(bytes(data), time.monotonic(), self._baudrate)
+        with self._cond:
+            self._pending += frames
+            self._cond.notify_all()
+        return len(data)
+
+    def reset_input_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self._cond:
+            self._release()
+            self._rx.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    @property
+    def out_waiting(self) -> int:
+        return 0
+
+    def _update_break_state(self):
+        pass
+
+    def _update_rts_state(self):
+        pass
+
+    def _update_dtr_state(self):
+        pass
+
+    @property
+    def cts(self):
+        return True
+
+    @property
+    def dsr(self):
+        return True
+
+    @property
+    def ri(self):
+        return False
+
+    @property
+    def cd(self):
+        return True
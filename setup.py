@@ -20,7 +20,7 @@ setuptools.setup(
     author_email = 'cyyang023@gmail.com',
     url = 'https://github.com/cy023/SerProg',
     license = 'MIT',
-    packages = ['serprog'],
+    packages = ['serprog', 'serprog.urlhandler'],
     zip_safe = False,
     entry_points = {
         'console_scripts': [
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+
+import pytest
+
+from serprog import cmdline
+
+
+def ihex_text(blocks) -> str:
+    """ Intel hex text of {address: data}, or of (address, data) in file order. """
+    if isinstance(blocks, dict):
+        blocks = blocks.items()
+    lines = []
+    for address, data in blocks:
+        for i in range(0, len(data), 16):
+            addr = address + i
+            ext = bytes([2, 0, 0, 4]) + (addr >> 16).to_bytes(2, 'big')
+            rec = bytes([len(data[i:i + 16])]) + (addr & 0xFFFF).to_bytes(2, 'big') + b'\x00' + data[i:i + 16]
+            for r in (ext, rec):
+                lines.append(':' + (r + bytes([-sum(r) & 0xFF])).hex().upper())
+    lines.append(':00000001FF')
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.fixture
+def write_ihex(tmp_path):
+    """ Write an ihex file of `ihex_text(blocks)`, returns its path. """
+    def write(blocks, name='app.hex', newline='\n'):
+        path = tmp_path / name
+        path.write_bytes(ihex_text(blocks).replace('\n', newline).encode('ascii'))
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    """ The timing profile and the checkpoints of the CLI in `tmp_path`. """
+    monkeypatch.setenv('SERPROG_TIMING', str(tmp_path / 'timing.json'))
+    monkeypatch.setenv('SERPROG_CHECKPOINTS', str(tmp_path / 'checkpoints'))
+    return tmp_path
+
+
+@pytest.fixture
+def cli_args():
+    """ Parse and check the arguments of a sub-command, `valid` is the expected result of the check. """
+    def parse(*argv, valid=True):
+        parser = argparse.ArgumentParser()
+        cmdline.parser_init(parser)
+        args = parser.parse_args(argv)
+        check = getattr(cmdline, 'chk_{0}_args'.format(args.subcmd.replace('-', '_')))
+        assert (check(args) is not False) == valid
+        return args
+    return parse
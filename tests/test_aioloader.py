@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import time
+
+import pytest
+import serial
+
+from serprog import aioloader, exceptions
+
+
+@pytest.fixture
+def flash_file(tmp_path):
+    data = bytes(i * 7 % 251 for i in range(0x4000))
+    path = tmp_path / 'app.bin'
+    path.write_bytes(data)
+    return str(path), data
+
+
+def test_program_retries_like_loader(flash_file):
+    filename, data = flash_file
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB?error_rate=0.05&seed=7', baudrate=921600, timeout=1)
+    l = aioloader.AsyncLoader(ser, device_type=1, is_flash_prog=True, flash_file=filename,
+                              base_address=0x10000, window=4)
+    asyncio.run(l.program())
+    ser.close()
+    assert l.is_finished
+    assert l.retries > 0
+    assert bytes(ser.bootloader.flash[0x10000:0x10000 + len(data)]) == data
+
+
+def test_read_timeout_is_set_back(flash_file):
+    filename, data = flash_file
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB', baudrate=921600, timeout=1.5)
+    l = aioloader.AsyncLoader(ser, device_type=1, is_flash_prog=True, flash_file=filename,
+                              base_address=0x10000)
+
+    async def prog():
+        await l.prepare()
+        assert ser.timeout == aioloader.SerialTransport.POLL
+        await l.program()
+    asyncio.run(prog())
+    assert ser.timeout == 1.5
+    ser.close()
+
+
+def test_cancel_keeps_checkpoint(flash_file, tmp_path):
+    filename, data = flash_file
+    cp = str(tmp_path / 'cp.json')
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB?latency=FLASH_WRITE:0.01', baudrate=921600, timeout=1)
+    kwargs = dict(device_type=1, is_flash_prog=True, flash_file=filename, base_address=0x10000,
+                  checkpoint_file=cp)
+
+    async def cancelled():
+        l = aioloader.AsyncLoader(ser, **kwargs)
+        task = asyncio.ensure_future(l.program())
+        while l.cur_step < 4:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(cancelled())
+    with open(cp) as f:
+        assert json.load(f)['regions']['flash']['pages'] >= 4
+
+    l = aioloader.AsyncLoader(ser, is_resume=True, **kwargs)
+    asyncio.run(l.program())
+    ser.close()
+    assert l.resumed_pages >= 4
+    assert not os.path.exists(cp)
+    assert bytes(ser.bootloader.flash[0x10000:0x10000 + len(data)]) == data
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='pseudo terminal')
+def test_get_packet_fails_when_port_is_gone():
+    import pty
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    ser = serial.Serial(os.ttyname(slave), 115200)
+    os.close(slave)
+
+    async def wait():
+        transport = aioloader.SerialTransport(ser)
+        asyncio.get_running_loop().call_later(0.05, os.close, master)
+        start = time.monotonic()
+        with pytest.raises(exceptions.ComuError):
+            await transport.get_packet(5)
+        return time.monotonic() - start
+    try:
+        assert asyncio.run(wait()) < 1
+    finally:
+        ser.close()
+
+
+def test_one_loop_programs_many_ports(flash_file):
+    filename, data = flash_file
+    ports = [serial.serial_for_url(f'sim://ATSAME54_DEVB?seed={i}', baudrate=921600, timeout=1) for i in range(3)]
+
+    async def prog(ser):
+        l = aioloader.AsyncLoader(ser, device_type=1, is_flash_prog=True, flash_file=filename,
+                                  base_address=0x10000, window=4)
+        await l.program()
+        return l
+
+    async def gang():
+        return await asyncio.gather(*[prog(ser) for ser in ports])
+    loaders = asyncio.run(gang())
+
+    assert all(l.is_finished for l in loaders)
+    for ser in ports:
+        ser.close()
+        assert bytes(ser.bootloader.flash[0x10000:0x10000 + len(data)]) == data
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='pseudo terminals are POSIX only')
+def test_program_pty(flash_file):
+    from serprog import simulator
+    filename, data = flash_file
+    server = simulator.PtyServer(simulator.Bootloader(), baudrate=921600).start()
+    try:
+        ser = serial.Serial(server.path, 921600, timeout=1)
+        l = aioloader.AsyncLoader(ser, device_type=1, is_flash_prog=True, flash_file=filename,
+                                  base_address=0x10000, window=4)
+        asyncio.run(l.program())
+        ser.close()
+    finally:
+        server.close()
+    assert l.is_finished
+    assert bytes(server.bootloader.flash[0x10000:0x10000 + len(data)]) == data
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import serial
+
+from serprog import artifact, business, exceptions, image, loader
+
+DATA = {0x10000: bytes(i * 7 % 251 for i in range(0x1000)), 0x14000: b'\x5A' * 100}
+
+
+@pytest.fixture
+def compiled(tmp_path, write_ihex, cli_args, capsys):
+    filename = write_ihex(DATA)
+    output = str(tmp_path / 'app.sprg')
+    business.do_compile(cli_args('compile', '-i', filename, '-o', output))
+    assert 'Pages are 9 of 512 bytes' in capsys.readouterr().out
+    return filename, output
+
+
+def pages_of(img):
+    return [(p['address'], bytes(p['data'])) for p in img.pages]
+
+
+def program(filename):
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB', baudrate=921600, timeout=1)
+    l = loader.Loader(ser, device_type=1, is_flash_prog=True, flash_file=filename)
+    while not l.is_finished:
+        l.do_step()
+    ser.close()
+    return ser.bootloader
+
+
+def test_artifact_round_trip(compiled):
+    filename, output = compiled
+    assert image.detect(output) == 'artifact'
+    assert artifact.verify(output) == []
+
+    img = image.load(output)
+    assert isinstance(img.pages, artifact.Pages)
+    assert img.size == image.load(filename).size
+    assert pages_of(img) == pages_of(image.load(filename))
+    # another page size is cut from the padded pages of the artifact
+    assert pages_of(image.load(output, 1024)) == pages_of(image.load(filename, 1024))
+
+    bl = program(output)
+    for address, data in DATA.items():
+        assert bytes(bl.flash[address:address + len(data)]) == data
+
+
+def test_corrupted_page_is_not_programmed(compiled):
+    _, output = compiled
+    _, _, pages = artifact.load(output)
+    with open(output, 'r+b') as f:
+        # the last byte of page 3
+        f.seek(-512 * 5 - 1, 2)
+        byte = f.read(1)
+        f.seek(-1, 1)
+        f.write(bytes([byte[0] ^ 0x01]))
+    assert artifact.verify(output) == [3]
+
+    _, _, pages = artifact.load(output)
+    assert pages[2]['address'] == 0x10400
+    with pytest.raises(exceptions.ArtifactHashError) as e:
+        pages[3]
+    assert e.value.address == 0x10600
+
+    image.clear_cache()
+    with pytest.raises(exceptions.ArtifactHashError):
+        program(output)
+
+
+def test_truncated_artifact(compiled):
+    _, output = compiled
+    with open(output, 'r+b') as f:
+        f.truncate(4096 + 512)
+    with pytest.raises(exceptions.ImageFormatError):
+        artifact.load(output)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import copy
+
+import pytest
+import serial
+
+from serprog import business, device, exceptions, loader, timing
+
+
+@pytest.fixture
+def flash_file(tmp_path):
+    path = tmp_path / 'app.bin'
+    path.write_bytes(bytes(range(256)) * 8)
+    return str(path)
+
+
+def test_negotiate_stops_below_max_baud():
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB?max_baud=921600', baudrate=115200, timeout=1)
+    assert loader.negotiate_baudrate(ser, probes=2) == 921600
+    assert ser.baudrate == 921600
+    ser.close()
+
+
+def test_negotiate_fails_without_response():
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB?drop_rate=1', baudrate=115200, timeout=1)
+    with pytest.raises(exceptions.ComuError):
+        loader.negotiate_baudrate(ser, probes=1)
+    ser.close()
+
+
+def test_profile_keeps_baudrate(tmp_path):
+    path = str(tmp_path / 'timing.json')
+    profile = timing.Profile(path)
+    assert profile.baudrate('ATSAME54_DEVB') is None
+    profile.set_baudrate('ATSAME54_DEVB', 460800)
+    profile.save()
+    assert timing.Profile.load(path).baudrate('ATSAME54_DEVB') == 460800
+
+
+def test_auto_baud_is_saved_in_profile_only(home, cli_args, flash_file):
+    device_list = copy.deepcopy(device.device_list)
+    args = cli_args('prog', '-d', 'ATSAME54_DEVB', '-p', 'sim://ATSAME54_DEVB?max_baud=460800',
+                    '-b', 'auto', '-f', flash_file, '--base-address', '0x10000')
+    business.do_prog(args)
+
+    assert device.device_list == device_list
+    assert timing.Profile.load().baudrate('ATSAME54_DEVB') == 460800
+
+    # the next run without --baud opens the port at the saved rate
+    args = cli_args('prog', '-d', 'ATSAME54_DEVB', '-p', 'sim://ATSAME54_DEVB',
+                    '-f', flash_file, '--base-address', '0x10000')
+    ser = business._open_port('sim://ATSAME54_DEVB', args, timing.Profile.load())
+    assert ser.baudrate == 460800
+    ser.close()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from serprog import benchmark, ihex
+
+
+def test_write_ihex(tmp_path):
+    filename = str(tmp_path / 'bench.hex')
+    benchmark.write_ihex(filename, 0x12345)
+    assert ihex.parse(filename).size == 0x12345
+    # one block, across the 64 KB boundaries of the extended address records
+    [block] = benchmark.reference_parse(filename)
+    assert block['address'] == 0x10000
+    assert len(block['data']) == 0x12345
+
+
+def test_small_run(tmp_path, capsys):
+    res = {
+        'decoder': benchmark.bench_decoder(packets=10, repeat=1),
+        'encoder': benchmark.bench_encoder(packets=10, repeat=1),
+        'ihex': benchmark.bench_ihex((4096, 70000), repeat=1),
+        'loader': benchmark.bench_loader(4096, baudrates=(921600,), windows=(1, 8)),
+    }
+    assert res['decoder']['bytes'] == 10 * len(benchmark.bootprotocol.encode(0, bytes(512)))
+    assert res['decoder']['step_MBps'] > 0 and res['decoder']['feed_MBps'] > 0
+    assert res['encoder']['encode_us'] > 0 and res['encoder']['encoder_us'] > 0
+    assert [r['bytes'] for r in res['ihex']] == [4096, 70000]
+    assert all(r['parse_s'] > 0 and r['reference_parse_s'] > 0 for r in res['ihex'])
+    assert [(r['window'], r['pages']) for r in res['loader']] == [(1, 8), (8, 8)]
+
+    benchmark.report(res)
+    out = capsys.readouterr().out
+    assert 'Decoder' in out and 'window  8' in out
+
+    filename = str(tmp_path / 'bench.json')
+    benchmark.write(filename, res)
+    with open(filename) as f:
+        assert json.load(f) == res
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import serial
+
+from serprog import loader
+from serprog.bootprotocol import CMD
+
+
+def test_blank_pages_are_erased_not_written(tmp_path):
+    # sector 0: data, a blank page, data; sector 1: blank; sector 2: data
+    data = bytearray(b'\xA5' * 0x6000)
+    data[0x0200:0x0400] = b'\xFF' * 0x200
+    data[0x2000:0x4000] = b'\xFF' * 0x2000
+    path = tmp_path / 'app.bin'
+    path.write_bytes(data)
+
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB', baudrate=921600, timeout=1)
+    bl = ser.bootloader
+    # left over by an older application
+    bl.flash[0x10000:0x16000] = b'\x00' * 0x6000
+
+    l = loader.Loader(ser, device_type=1, is_flash_prog=True, flash_file=str(path),
+                      base_address=0x10000)
+    while not l.is_finished:
+        l.do_step()
+    ser.close()
+
+    assert l.blank_pages == 1 + 16
+    assert bl.counts[CMD.FLASH_WRITE] == 48 - l.blank_pages
+    assert bl.counts[CMD.FLASH_ERASE_SECTOR] == 3
+    assert bytes(bl.flash[0x10000:0x16000]) == data
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import serial
+
+from serprog import bootprotocol, loader
+from serprog.bootprotocol import CMD
+
+
+def corrupt(frame: bytes) -> bytes:
+    return frame[:-1] + bytes([frame[-1] ^ 0xFF])
+
+
+def step_all(pd: bootprotocol.Decoder, frame: bytes):
+    for ch in frame:
+        pd.step(ch)
+
+
+def test_step_checksum_error_is_cleared_by_next_packet():
+    pd = bootprotocol.Decoder()
+    step_all(pd, corrupt(bootprotocol.encode(CMD.CHK_DEVICE, b'\x00\x01')))
+    assert pd.isDone()
+    assert pd.isError()
+    pd.getPacket()
+
+    step_all(pd, bootprotocol.encode(CMD.CHK_DEVICE, b'\x00\x01'))
+    assert pd.isDone()
+    assert not pd.isError()
+    assert pd.getPacket() == {'command': CMD.CHK_DEVICE, 'data': b'\x00\x01'}
+
+
+def test_step_checksum_of_empty_packet():
+    pd = bootprotocol.Decoder()
+    step_all(pd, bootprotocol.encode(CMD.PROG_END, b''))
+    assert pd.isDone()
+    assert not pd.isError()
+
+
+def test_feed_checksum_error():
+    pd = bootprotocol.Decoder()
+    good = bootprotocol.encode(CMD.FLASH_WRITE, b'\x00')
+    packets = pd.feed(corrupt(good) + good)
+    assert [(p.command, bytes(p.data), p.error) for p in packets] == [
+        (CMD.FLASH_WRITE, b'\x00', True),
+        (CMD.FLASH_WRITE, b'\x00', False),
+    ]
+
+
+def test_feed_resyncs_on_next_header():
+    pd = bootprotocol.Decoder()
+    frame = bootprotocol.encode(CMD.CHK_PROTOCOL, b'\x00\x01')
+    # garbage, a partial header and a header with an unknown command
+    noise = b'\x12\x34' + bootprotocol.HEADER[:2] + b'\x00' + bootprotocol.HEADER + b'\xEE'
+    packets = pd.feed(noise + frame)
+    assert len(packets) == 1
+    assert packets[0].command == CMD.CHK_PROTOCOL
+    assert bytes(packets[0].data) == b'\x00\x01'
+    assert not packets[0].error
+
+
+def test_feed_chunked_like_step():
+    data = bytes(range(256)) * 2
+    frame = bootprotocol.encode(CMD.FLASH_VERIFY, data) + bootprotocol.encode(CMD.PROG_END, b'\x00')
+    pd = bootprotocol.Decoder()
+    packets = []
+    for i in range(len(frame)):
+        packets += pd.feed(frame[i:i + 1])
+    assert [(p.command, bytes(p.data), p.error) for p in packets] == [
+        (CMD.FLASH_VERIFY, data, False),
+        (CMD.PROG_END, b'\x00', False),
+    ]
+
+
+@pytest.mark.parametrize('chunk', [1, 2, 3, 7, 64, 4096])
+def test_feed_chunks_of_device_responses(chunk):
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB', baudrate=921600, timeout=1)
+    bl = ser.bootloader
+    bl.flash[0x10000:0x10200] = bytes(range(256)) * 2
+    requests = [(CMD.CHK_PROTOCOL, b''), (CMD.CHK_DEVICE, b''),
+                (CMD.FLASH_READ, (0x10000).to_bytes(4, 'little')), (CMD.PROG_END, b'')]
+    expected = [(cmd, bl.handle(cmd, data)) for cmd, data in requests]
+
+    ser.write(b''.join([bootprotocol.encode(cmd, data) for cmd, data in requests]))
+    received = b''
+    while len(received) < sum([len(bootprotocol.encode(cmd, data)) for cmd, data in expected]):
+        received += ser.read(max(1, ser.in_waiting))
+    ser.close()
+
+    pd = bootprotocol.Decoder()
+    packets = []
+    for i in range(0, len(received), chunk):
+        # a memoryview of the read buffer, as the transports pass it
+        packets += pd.feed(memoryview(received)[i:i + chunk])
+    assert [(p.command, bytes(p.data), p.error) for p in packets] == \
+        [(cmd, data, False) for cmd, data in expected]
+
+
+@pytest.mark.parametrize('size', [0, 1, 255, 256, 257, 512, 4099])
+def test_checksum_is_the_byte_sum(size):
+    data = bytes([0xFF]) * size
+    assert bootprotocol.checksum(data) == sum(data) % 256
+    data = bytes(i * 31 % 256 for i in range(size))
+    assert bootprotocol.checksum(memoryview(data)) == sum(data) % 256
+
+
+def test_encoder_frame_of_page_view():
+    page = memoryview(bytes(range(256)) * 2).toreadonly()
+    pe = bootprotocol.Encoder(size=16)
+    frame = pe.encode(CMD.FLASH_WRITE, page, 0x10200)
+    assert bytes(frame) == bootprotocol.encode(CMD.FLASH_WRITE, (0x10200).to_bytes(4, 'little') + bytes(page))
+    kept = bytes(frame)
+
+    # the frame buffer is reused by the next packet
+    frame = pe.encode(CMD.CHK_PROTOCOL, b'test')
+    assert bytes(frame) == bootprotocol.encode(CMD.CHK_PROTOCOL, b'test')
+    assert bytes(pe.encode(CMD.FLASH_WRITE, page, 0x10200)) == kept
+
+
+def test_page_views_are_written_to_the_device():
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB', baudrate=921600, timeout=1)
+    buf = bytearray(range(256)) * 4
+    cth = loader.CommandTrnasHandler(ser)
+    for offset in (0, 512):
+        view = memoryview(buf)[offset:offset + 512].toreadonly()
+        assert cth.cmd_flash_write(0x10000 + offset, view) is True
+    assert bytes(ser.bootloader.flash[0x10000:0x10400]) == buf
+    ser.close()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+import serial
+
+from serprog import exceptions, loader
+from serprog.bootprotocol import CMD
+
+
+class Unplugged(Exception):
+    pass
+
+
+def unplug_after(bl, cmd, count):
+    """ Fail the write of the host when the device gets `cmd` for the `count`th time. """
+    handle = bl.handle
+    def hooked(c, data):
+        if c == cmd and bl.counts[cmd] == count:
+            bl.handle = handle
+            raise Unplugged
+        return handle(c, data)
+    bl.handle = hooked
+
+
+def program(ser, **kwargs):
+    l = loader.Loader(ser, device_type=1, **kwargs)
+    while not l.is_finished:
+        l.do_step()
+    return l
+
+
+@pytest.fixture
+def port():
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB', baudrate=921600, timeout=1)
+    yield ser
+    ser.close()
+
+
+@pytest.fixture
+def images(write_ihex, tmp_path):
+    flash = bytes(i * 7 % 251 for i in range(0x3000))
+    ext_flash = bytes(i * 13 % 253 for i in range(0x2000))
+    eeprom = bytes(i * 3 % 247 for i in range(0x800))
+    return dict(
+        flash_file=write_ihex({0x10000: flash}, 'app.hex'),
+        ext_flash_file=write_ihex({0x10000: ext_flash}, 'ext.hex'),
+        eeprom_file=write_ihex({0: eeprom}, 'eeprom.hex'),
+        checkpoint_file=str(tmp_path / 'cp.json'),
+    ), (flash, ext_flash, eeprom)
+
+
+def test_flash_resumes_after_acknowledged_pages(port, images):
+    kwargs, (flash, _, _) = images
+    kwargs = dict(flash_file=kwargs['flash_file'], checkpoint_file=kwargs['checkpoint_file'])
+    bl = port.bootloader
+    unplug_after(bl, CMD.FLASH_WRITE, 10)
+    with pytest.raises(Unplugged):
+        program(port, is_flash_prog=True, **kwargs)
+    assert os.path.exists(kwargs['checkpoint_file'])
+
+    writes = bl.counts[CMD.FLASH_WRITE]
+    l = program(port, is_flash_prog=True, is_resume=True, **kwargs)
+    assert l.resumed_pages == 9
+    assert bl.counts[CMD.FLASH_WRITE] - writes == 24 - 9
+    assert bytes(bl.flash[0x10000:0x13000]) == flash
+    assert not os.path.exists(kwargs['checkpoint_file'])
+
+
+def test_ext_flash_and_eeprom_restart_after_reset(port, images):
+    kwargs, (flash, ext_flash, eeprom) = images
+    regions = dict(is_flash_prog=True, is_ext_flash_prog=True, is_eeprom_prog=True)
+    bl = port.bootloader
+
+    # the device keeps an older file, which starts with the same pages
+    program(port, is_ext_flash_prog=True, ext_flash_file=kwargs['ext_flash_file'])
+    bl.files['image'] = {a: d for a, d in bl.files['image'].items() if a < 0x11400}
+
+    unplug_after(bl, CMD.EXT_FLASH_WRITE, bl.counts[CMD.EXT_FLASH_WRITE] + 10)
+    with pytest.raises(Unplugged):
+        program(port, **regions, **kwargs)
+    # the device is reset, the open file is lost
+    bl._file = None
+
+    fopens = bl.counts[CMD.EXT_FLASH_FOPEN]
+    l = program(port, **regions, is_resume=True, **kwargs)
+    assert l.resumed_pages == 24
+    assert bl.counts[CMD.EXT_FLASH_FOPEN] == fopens + 1
+    assert sorted(bl.files['image']) == list(range(0x10000, 0x12000, 512))
+    assert b''.join([bl.files['image'][a] for a in sorted(bl.files['image'])]) == ext_flash
+    assert bytes(bl.eeprom[:len(eeprom)]) == eeprom
+    assert bytes(bl.flash[0x10000:0x13000]) == flash
+
+
+def test_eeprom_restarts_after_interruption(port, images):
+    kwargs, (_, _, eeprom) = images
+    kwargs = dict(eeprom_file=kwargs['eeprom_file'], checkpoint_file=kwargs['checkpoint_file'])
+    bl = port.bootloader
+    unplug_after(bl, CMD.EEPROM_WRITE, 3)
+    with pytest.raises(Unplugged):
+        program(port, is_eeprom_prog=True, **kwargs)
+
+    writes = bl.counts[CMD.EEPROM_WRITE]
+    l = program(port, is_eeprom_prog=True, is_resume=True, **kwargs)
+    assert l.resumed_pages == 0
+    assert bl.counts[CMD.EEPROM_WRITE] - writes == 4
+    assert bytes(bl.eeprom[:len(eeprom)]) == eeprom
+
+
+def test_finished_ext_flash_is_skipped(port, images):
+    kwargs, (_, ext_flash, eeprom) = images
+    kwargs = dict(ext_flash_file=kwargs['ext_flash_file'], eeprom_file=kwargs['eeprom_file'],
+                  checkpoint_file=kwargs['checkpoint_file'])
+    bl = port.bootloader
+    # the eeprom is programmed after the external flash
+    unplug_after(bl, CMD.EEPROM_WRITE, 2)
+    with pytest.raises(Unplugged):
+        program(port, is_ext_flash_prog=True, is_eeprom_prog=True, **kwargs)
+
+    fopens = bl.counts[CMD.EXT_FLASH_FOPEN]
+    l = program(port, is_ext_flash_prog=True, is_eeprom_prog=True, is_resume=True, **kwargs)
+    assert l.resumed_pages == 16
+    assert bl.counts[CMD.EXT_FLASH_FOPEN] == fopens
+    assert bytes(bl.eeprom[:len(eeprom)]) == eeprom
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import serial
+
+from serprog import loader
+from serprog.bootprotocol import CMD
+
+SECTOR_PAGES = 0x2000 // 512     # ATSAME54_DEVB
+
+
+def program(ser, filename, **kwargs):
+    l = loader.Loader(ser, device_type=1, is_flash_prog=True, flash_file=filename, **kwargs)
+    while not l.is_finished:
+        l.do_step()
+    return l
+
+
+@pytest.fixture
+def port():
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB', baudrate=921600, timeout=1)
+    yield ser
+    ser.close()
+
+
+@pytest.fixture
+def image():
+    return bytearray(i * 7 % 251 for i in range(0x6000))
+
+
+def test_delta_skips_matching_sectors(port, image, write_ihex):
+    bl = port.bootloader
+    program(port, write_ihex({0x10000: bytes(image)}))
+
+    # one byte of the second sector changes
+    image[0x2345] ^= 0xFF
+    filename = write_ihex({0x10000: bytes(image)}, 'new.hex')
+    bl.counts.clear()
+    l = program(port, filename, is_delta=True)
+
+    assert bytes(bl.flash[0x10000:0x16000]) == image
+    assert l.skipped_pages == 2 * SECTOR_PAGES
+    assert bl.counts[CMD.FLASH_ERASE_SECTOR] == 1
+    assert bl.counts[CMD.FLASH_WRITE] == SECTOR_PAGES
+    assert bl.counts[CMD.FLASH_ERASE_ALL] == 0
+
+
+def test_delta_of_programmed_image_writes_nothing(port, image, write_ihex):
+    bl = port.bootloader
+    filename = write_ihex({0x10000: bytes(image)})
+    program(port, filename)
+    bl.counts.clear()
+    l = program(port, filename, is_delta=True)
+
+    assert l.skipped_pages == 3 * SECTOR_PAGES
+    assert bl.counts[CMD.FLASH_ERASE_SECTOR] == 0
+    assert bl.counts[CMD.FLASH_WRITE] == 0
+
+
+def test_without_delta_every_sector_is_written(port, image, write_ihex):
+    bl = port.bootloader
+    filename = write_ihex({0x10000: bytes(image)})
+    program(port, filename)
+    bl.counts.clear()
+    l = program(port, filename)
+
+    assert l.skipped_pages == 0
+    assert bl.counts[CMD.FLASH_ERASE_SECTOR] == 3
+    assert bl.counts[CMD.FLASH_WRITE] == 3 * SECTOR_PAGES
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import serial
+
+from serprog import device, eraseplan, exceptions, loader
+from serprog.bootprotocol import CMD
+
+SECTOR = 0x2000     # ATSAME54_DEVB
+
+
+def pages_at(*addresses, pgsz=512):
+    return [{'address': a, 'data': b'\x00' * pgsz} for a in addresses]
+
+
+def test_plan_groups_pages_by_sector():
+    pages = pages_at(0x10000, 0x10200, 0x11E00, 0x12000, 0x16000)
+    assert eraseplan.plan(pages, SECTOR) == [
+        {'sector': 8, 'start': 0, 'end': 3},
+        {'sector': 9, 'start': 3, 'end': 4},
+        {'sector': 11, 'start': 4, 'end': 5},
+    ]
+    assert eraseplan.erase_size(eraseplan.plan(pages, SECTOR), SECTOR) == 3 * SECTOR
+
+
+def test_plan_of_no_pages():
+    assert eraseplan.plan([], SECTOR) == []
+
+
+def program(ser, filename, **kwargs):
+    l = loader.Loader(ser, device_type=1, is_flash_prog=True, flash_file=filename,
+                      base_address=0x10000, **kwargs)
+    while not l.is_finished:
+        l.do_step()
+    return l
+
+
+@pytest.fixture
+def port():
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB', baudrate=921600, timeout=1)
+    yield ser
+    ser.close()
+
+
+@pytest.fixture
+def two_sectors(write_ihex):
+    # the first and the third sector of the application, the second is not touched
+    first, third = bytes(range(256)) * 4, bytes(range(256)) * 2
+    return write_ihex({0x10000: first, 0x14000: third}), first, third
+
+
+def test_only_touched_sectors_are_erased(port, two_sectors):
+    filename, first, third = two_sectors
+    bl = port.bootloader
+    bl.flash[0x10000:0x16000] = b'\x00' * 0x6000
+    l = program(port, filename)
+    assert bl.counts[CMD.FLASH_ERASE_SECTOR] == 2
+    assert bl.counts[CMD.FLASH_ERASE_ALL] == 0
+    assert l.erase_sectors == 2
+    assert bytes(bl.flash[0x10000:0x10400]) == first
+    assert bytes(bl.flash[0x10400:0x12000]) == b'\xFF' * (SECTOR - 0x400)
+    # not in the image, kept
+    assert bytes(bl.flash[0x12000:0x14000]) == b'\x00' * SECTOR
+    assert bytes(bl.flash[0x14000:0x14200]) == third
+
+
+def test_erase_all(port, two_sectors):
+    filename, first, third = two_sectors
+    bl = port.bootloader
+    program(port, filename, is_erase_all=True)
+    assert bl.counts[CMD.FLASH_ERASE_SECTOR] == 0
+    assert bl.counts[CMD.FLASH_ERASE_ALL] == 1
+    assert bytes(bl.flash[0x10000:0x10400]) == first
+    assert bytes(bl.flash[0x14000:0x14200]) == third
+
+
+def test_erased_address_must_match_the_sector(port, two_sectors):
+    filename = two_sectors[0]
+    # the part has larger sectors than the device list, sector 8 is at 0x20000
+    port.bootloader.sector_size = 0x4000
+    with pytest.raises(exceptions.ComuError):
+        program(port, filename)
+
+
+def test_application_area_must_start_at_a_sector(port, two_sectors, monkeypatch):
+    filename = two_sectors[0]
+    monkeypatch.setitem(device.device_list[1], 'flash_sector_size', 0x3000)
+    with pytest.raises(exceptions.SectorSizeError):
+        program(port, filename)
+
+
+@pytest.mark.parametrize('dev', device.device_list[1:], ids=lambda d: d['name'])
+def test_device_list_sectors(dev):
+    assert dev['userapp_start'] % dev['flash_sector_size'] == 0
+    assert dev['userapp_size'] % dev['flash_sector_size'] == 0
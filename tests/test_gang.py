@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from serprog import business
+from serprog.bootprotocol import CMD
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """ The serial objects opened by the CLI, by port. """
+    ports = dict()
+    open_port = business._open_port
+    def record(port, *args, **kwargs):
+        ports[port] = open_port(port, *args, **kwargs)
+        return ports[port]
+    monkeypatch.setattr(business, '_open_port', record)
+    return ports
+
+
+def test_gang_programs_every_port(home, cli_args, opened, tmp_path, capsys):
+    data = bytes(i * 7 % 251 for i in range(0x4000))
+    path = tmp_path / 'app.bin'
+    path.write_bytes(data)
+    ports = ['sim://ATSAME54_DEVB?seed=1', 'sim://ATSAME54_DEVB?seed=2&error_rate=0.05']
+    business.do_prog(cli_args('prog', '-d', 'ATSAME54_DEVB', '-p', *ports, '-b', '921600',
+                              '-f', str(path), '--base-address', '0x10000'))
+
+    assert '2 of 2 ports programmed.' in capsys.readouterr().out
+    for port in ports:
+        bl = opened[port].bootloader
+        assert bytes(bl.flash[0x10000:0x14000]) == data
+        assert bl.counts[CMD.PROG_END] == 1
+
+
+def test_gang_failure_does_not_stop_other_ports(home, cli_args, opened, tmp_path, capsys):
+    data = bytes(i * 7 % 251 for i in range(0x4000))
+    path = tmp_path / 'app.bin'
+    path.write_bytes(data)
+    ports = ['sim://ATSAME54_DEVB', 'sim://NUM487KM_DEVB']
+    with pytest.raises(SystemExit) as e:
+        business.do_prog(cli_args('prog', '-d', 'ATSAME54_DEVB', '-p', *ports, '-b', '921600',
+                                  '-f', str(path), '--base-address', '0x10000'))
+    assert e.value.code == 1
+
+    out = capsys.readouterr().out
+    assert "Device is not match, detected 'NUM487KM_DEVB'." in out
+    assert '1 of 2 ports programmed.' in out
+    assert bytes(opened[ports[0]].bootloader.flash[0x10000:0x14000]) == data
+    assert opened[ports[1]].bootloader.counts[CMD.FLASH_WRITE] == 0
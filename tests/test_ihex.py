@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import serial
+
+from serprog import exceptions, ihex, loader
+
+
+def test_iter_pages_of_records_out_of_order_in_a_page():
+    records = [(0x110, b'\x02' * 16), (0x1F8, b'\x04' * 8), (0x100, b'\x01' * 16), (0x200, b'\x03' * 8)]
+    pages = list(ihex.iter_pages(records, 256, b'\xFF'))
+
+    assert [p['address'] for p in pages] == [0x100, 0x200]
+    assert pages[0]['data'] == b'\x01' * 16 + b'\x02' * 16 + b'\xFF' * 216 + b'\x04' * 8
+    assert pages[1]['data'] == b'\x03' * 8 + b'\xFF' * 248
+    # the same pages as the whole image
+    img = ihex.SparseImage()
+    img.update(records)
+    assert pages == [dict(p, data=bytes(p['data'])) for p in ihex.cut_to_pages(img, 256)]
+
+
+def test_iter_pages_of_a_record_before_the_current_page():
+    records = [(0x200, b'\x01' * 16), (0x100, b'\x02' * 16)]
+    with pytest.raises(exceptions.IhexFormatError) as e:
+        list(ihex.iter_pages(records, 256, b'\xFF', 'app.hex'))
+    assert e.value.filename == 'app.hex'
+
+
+def stream(filename):
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB', baudrate=921600, timeout=1)
+    l = loader.Loader(ser, device_type=1, is_ext_flash_prog=True, ext_flash_file=filename,
+                      is_ext_flash_stream=True)
+    while not l.is_finished:
+        l.do_step()
+    return ser.bootloader
+
+
+def test_stream_of_records_out_of_order_in_a_page(write_ihex):
+    first, second = bytes(range(256)), bytes(range(255, -1, -1))
+    filename = write_ihex([(0x200, first), (0x000, second)])
+    with pytest.raises(exceptions.FlashIsNotIhexError):
+        stream(filename)
+
+    # in a page of 512 bytes
+    filename = write_ihex([(0x100, first), (0x000, second), (0x300, first), (0x200, second)])
+    pages = stream(filename).files['image']
+    assert sorted(pages) == [0x000, 0x200]
+    assert pages[0x000] == second + first
+    assert pages[0x200] == second + first
+
+
+def blocks(img):
+    return [(b['address'], bytes(b['data'])) for b in img]
+
+
+DATA = {0x10000: bytes(range(256)) * 2, 0x10400: b'\x5A' * 40}
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n', '  \n', '\t\r\n'])
+def test_parse_and_line_parser_accept_line_ends(write_ihex, newline):
+    filename = write_ihex(DATA, newline=newline)
+    img = ihex.parse(filename)
+    assert blocks(img) == list(DATA.items())
+    assert sorted(ihex.iter_records(filename))[0][0] == 0x10000
+    assert blocks(ihex.SparseImage.from_sections(
+        [{'address': a, 'data': d} for a, d in ihex.iter_records(filename)])) == list(DATA.items())
+
+
+def corrupt(filename, lineno, replace):
+    with open(filename) as f:
+        lines = f.readlines()
+    lines[lineno - 1] = replace(lines[lineno - 1])
+    with open(filename, 'w') as f:
+        f.writelines(lines)
+
+
+@pytest.mark.parametrize('replace', [
+    lambda line: line[:9] + ('0' if line[9] != '0' else '1') + line[10:],   # checksum error
+    lambda line: line[:9] + 'G' + line[10:],                                # not a hex digit
+    lambda line: line[:-2] + '\n',                                          # short line
+    lambda line: line[1:],                                                  # no record mark
+])
+def test_bad_record_line_number(write_ihex, replace):
+    filename = write_ihex(DATA)
+    corrupt(filename, 7, replace)
+
+    with pytest.raises(exceptions.IhexFormatError) as e:
+        ihex.parse(filename)
+    assert e.value.lineno == 7
+    with pytest.raises(exceptions.IhexFormatError) as e:
+        list(ihex.iter_records(filename))
+    assert e.value.lineno == 7
+
+
+def test_missing_end_of_file(write_ihex):
+    filename = write_ihex(DATA)
+    with open(filename) as f:
+        eof = len(f.readlines())
+    corrupt(filename, eof, lambda line: '')
+    with pytest.raises(exceptions.IhexFormatError) as e:
+        ihex.parse(filename)
+    assert e.value.lineno == eof
+
+
+def test_parse_matches_reference_parser(write_ihex):
+    from serprog import benchmark
+    filename = write_ihex(DATA)
+    ref = benchmark.reference_parse(filename)
+    assert [(b['address'], bytes(b['data'])) for b in ref] == blocks(ihex.parse(filename))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+import os
+import struct
+
+import pytest
+
+from serprog import business, elf, exceptions, image
+
+
+def test_load_is_cached_until_the_file_changes(write_ihex):
+    filename = write_ihex({0x10000: bytes(range(256)) * 4})
+    img = image.load(filename)
+    assert image.load(filename) is img
+    assert image.load(filename, 256) is not img
+
+    # the same size, another modification time
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000))
+    assert image.load(filename) is not img
+
+
+def test_prog_parses_each_file_once(home, cli_args, write_ihex, monkeypatch):
+    flash = write_ihex({0x10000: bytes(range(256)) * 8}, 'app.hex')
+    eeprom = write_ihex({0: bytes(range(256))}, 'eeprom.hex')
+    parsed = []
+    parse = image.parse
+    def counted(filename, *args, **kwargs):
+        parsed.append(os.path.basename(filename))
+        return parse(filename, *args, **kwargs)
+    monkeypatch.setattr(image, 'parse', counted)
+
+    args = cli_args('prog', '-d', 'ATSAME54_DEVB', '-p', 'sim://ATSAME54_DEVB', '-b', '921600',
+                    '-f', flash, '-e', eeprom)
+    business.do_prog(args)
+    assert sorted(parsed) == ['app.hex', 'eeprom.hex']
+
+
+DATA = bytes(i * 7 % 251 for i in range(0x300))
+
+
+def write_srec(path, address, data):
+    lines = ['S0030000FC']
+    for i in range(0, len(data), 16):
+        rec = bytes([4 + 1 + len(data[i:i + 16])]) + (address + i).to_bytes(4, 'big') + data[i:i + 16]
+        lines.append('S3' + (rec + bytes([~sum(rec) & 0xFF])).hex().upper())
+    lines.append('S70500000000FA')
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def write_elf(path, segments):
+    """ A little endian ELF32 executable of (physical address, data) PT_LOAD segments,
+    and a .bss segment without file data. """
+    segments = list(segments) + [(0x20000000, b'')]
+    phoff, phsize = 52, 32
+    offset = phoff + phsize * len(segments)
+    ehdr = elf.MAGIC + bytes([1, 1, 1]) + bytes(9) + struct.pack(
+        '<HHIIIIIHHHHHH', 2, 40, 1, 0, phoff, 0, 0, 52, phsize, len(segments), 40, 0, 0)
+    phdrs, body = b'', b''
+    for paddr, data in segments:
+        phdrs += struct.pack('<IIIIIIII', elf.PT_LOAD, offset + len(body), paddr, paddr,
+                             len(data), len(data) or 0x100, 5, 4)
+        body += data
+    path.write_bytes(ehdr + phdrs + body)
+    return str(path)
+
+
+def image_data(img):
+    return [(p['address'], bytes(p['data'])) for p in img.pages]
+
+
+def test_formats_are_detected(tmp_path, write_ihex):
+    ihex_file = write_ihex({0x10000: DATA})
+    srec_file = write_srec(tmp_path / 'app.s37', 0x10000, DATA)
+    elf_file = write_elf(tmp_path / 'app.elf', [(0x10000, DATA[:0x100]), (0x10100, DATA[0x100:])])
+    bin_file = tmp_path / 'app.bin'
+    bin_file.write_bytes(DATA)
+    raw_file = tmp_path / 'app.img'
+    raw_file.write_bytes(DATA)
+
+    assert image.detect(ihex_file) == 'ihex'
+    assert image.detect(srec_file) == 'srec'
+    assert image.detect(elf_file) == 'elf'
+    assert image.detect(str(bin_file)) == 'bin'
+    assert image.detect(str(raw_file)) is None
+    assert image.detect(str(raw_file), 0x10000) == 'bin'
+
+    expected = image_data(image.load(ihex_file))
+    assert len(expected) == 2
+    for filename in (srec_file, elf_file, str(bin_file), str(raw_file)):
+        assert image_data(image.load(filename, base_address=0x10000)) == expected
+    assert sorted(image.iter_records(srec_file))[0] == (0x10000, DATA[:16])
+
+
+def test_elf_and_bin_pages_are_views_of_the_file(tmp_path):
+    bin_file = tmp_path / 'app.bin'
+    bin_file.write_bytes(DATA)
+    pages = image.load(str(bin_file), base_address=0x10000).pages
+    assert isinstance(pages[0]['data'].obj, mmap.mmap)
+
+    elf_file = write_elf(tmp_path / 'app.elf', [(0x10000, DATA[:0x200])])
+    pages = image.load(elf_file).pages
+    assert isinstance(pages[0]['data'].obj, mmap.mmap)
+
+
+def test_bad_srec_record(tmp_path):
+    filename = write_srec(tmp_path / 'app.srec', 0x10000, DATA)
+    lines = open(filename).readlines()
+    lines[3] = lines[3][:-3] + '00\n'
+    open(filename, 'w').writelines(lines)
+    with pytest.raises(exceptions.SrecFormatError) as e:
+        image.load(filename)
+    assert e.value.lineno == 4
+
+
+def test_raw_binary_needs_base_address(tmp_path, home, cli_args, capsys):
+    bin_file = tmp_path / 'app.bin'
+    bin_file.write_bytes(DATA)
+    with pytest.raises(exceptions.BaseAddressError):
+        image.load(str(bin_file))
+
+    cli_args('prog', '-p', 'sim://ATSAME54_DEVB', '-f', str(bin_file), valid=False)
+    assert 'Parameter --base-address is required' in capsys.readouterr().out
+    cli_args('prog', '-p', 'sim://ATSAME54_DEVB', '-f', str(bin_file), '--base-address', '0x10000')
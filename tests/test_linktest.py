@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+import serial
+
+from serprog import linktest
+
+
+def run(url, **kwargs):
+    ser = serial.serial_for_url(url, baudrate=115200, timeout=1)
+    kwargs = dict(dict(probes=5, pages=8), **kwargs)
+    res = linktest.run(ser, 0, [115200, 460800, 921600, 2000000], [256, 1024], **kwargs)
+    return ser, res
+
+
+def test_recommends_fastest_clean_rate_at_prog_page_size():
+    ser, res = run('sim://ATSAME54_DEVB?max_baud=921600')
+    assert res['device_type'] == 1
+    assert [r['error_rate'] for r in res['rates']] == [0, 0, 0, 1]
+    for rate in res['rates'][:3]:
+        # the page size of the loader is measured even if not asked
+        assert sorted(rate['pages']) == [256, 512, 1024]
+        # FLASH_VERIFY of other data is not a link error
+        assert all([tp['errors'] == 0 for tp in rate['pages'].values()])
+    assert res['best']['baudrate'] == 921600
+    assert 'page_size' not in res['best']
+    assert ser.baudrate == 921600
+    assert ser.bootloader.flash_pgsz == linktest.PAGE_SIZE
+
+
+def test_write_leaves_sector_erased():
+    ser, res = run('sim://ATSAME54_DEVB', write=True)
+    bl = ser.bootloader
+    assert all([tp['errors'] == 0 and tp['erase_s'] > 0
+                for r in res['rates'] for tp in r['pages'].values()])
+    assert bl.counts[linktest.bootprotocol.CMD.FLASH_WRITE] > 0
+    assert set(bl.flash) == {0xFF}
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import pytest
+import serial
+
+from serprog import bootprotocol, exceptions, loader
+from serprog.bootprotocol import CMD
+
+
+@pytest.fixture
+def port():
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB?seed=1', baudrate=921600, timeout=1)
+    yield ser
+    ser.close()
+
+
+def new_cth(ser):
+    cth = loader.CommandTrnasHandler(ser)
+    cth.timeout = 0.1
+    cth.backoff = 0.001
+    return cth
+
+
+def on_command(bl, hooks: dict):
+    """ Run hooks[cmd](bl) when the simulated device handles cmd, before
+    its response is dropped or corrupted.
+    """
+    handle = bl.handle
+    def hooked(cmd, data):
+        if cmd in hooks:
+            hooks[cmd](bl)
+        return handle(cmd, data)
+    bl.handle = hooked
+
+
+def test_idempotent_command_is_retried(port):
+    bl = port.bootloader
+    bl.error_rate = 0.3
+    cth = new_cth(port)
+    for _ in range(20):
+        assert cth.cmd_chk_device() == (True, bl.device_type)
+    assert cth.retry_count > 0
+    assert bl.counts[CMD.CHK_DEVICE] == 20 + cth.retry_count
+
+
+def test_late_response_is_skipped_after_resync(port):
+    bl = port.bootloader
+    cth = new_cth(port)
+    # the first response arrives after the timeout, but before the retry's
+    def slow_once(bl):
+        bl.latency[CMD.FLASH_GET_PGSZ] = 0.15 if bl.counts[CMD.FLASH_GET_PGSZ] == 1 else 0.0
+    on_command(bl, {CMD.FLASH_GET_PGSZ: slow_once})
+    assert cth.cmd_flash_get_pgsz() == (True, bl.flash_pgsz)
+    assert cth.retry_count == 1
+    assert cth.cmd_chk_device() == (True, bl.device_type)
+
+
+@pytest.mark.parametrize('cmd, name', [
+    (CMD.FLASH_ERASE_ALL, 'cmd_flash_erase_all'),
+    (CMD.EEPROM_ERASE_ALL, 'cmd_eeprom_erase_all'),
+    (CMD.EXT_FLASH_FOPEN, 'cmd_ext_flash_fopen'),
+    (CMD.PROG_EXT_FLASH_BOOT, 'cmd_prog_ext_flash_boot'),
+])
+def test_other_command_is_not_retried(port, cmd, name):
+    bl = port.bootloader
+    bl.drop_rate = 1.0
+    cth = new_cth(port)
+    cth.cmd_timeout[cmd] = 0.1
+    with pytest.raises(exceptions.ComuError):
+        getattr(cth, name)()
+    assert bl.counts[cmd] == 1
+    assert cth.retry_count == 0
+
+
+def test_prog_end_lost_response_of_ended_device(port):
+    bl = port.bootloader
+    cth = new_cth(port)
+    # the device leaves the bootloader and answers nothing
+    on_command(bl, {CMD.PROG_END: lambda bl: setattr(bl, 'drop_rate', 1.0)})
+    assert cth.cmd_prog_end() is True
+    assert bl.counts[CMD.PROG_END] == 1
+    assert bl.counts[CMD.CHK_PROTOCOL] == 1
+
+
+def test_prog_end_lost_request(port):
+    bl = port.bootloader
+    cth = new_cth(port)
+    # the first PROG_END is lost, the device is still in the bootloader
+    bl.drop_rate = 1.0
+    on_command(bl, {CMD.CHK_PROTOCOL: lambda bl: setattr(bl, 'drop_rate', 0.0)})
+    assert cth.cmd_prog_end() is True
+    assert bl.counts[CMD.PROG_END] == 2
+
+
+def test_read_timeout_is_set_back(port):
+    cth = new_cth(port)
+    transport = loader.SerialTransport.of(port)
+    assert port.timeout == loader.SerialTransport.POLL
+    assert cth.cmd_chk_protocol()[0]
+
+    transport.close()
+    assert port.timeout == 1
+    # the next handler starts another transport
+    cth = new_cth(port)
+    assert loader.SerialTransport.of(port) is not transport
+    assert cth.cmd_chk_protocol()[0]
+
+
+def test_timeout_is_a_deadline():
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB?drop_rate=1', baudrate=921600, timeout=1)
+    cth = new_cth(ser)
+    cth.timeout = 0.2
+    cth.retries = 0
+    start = time.monotonic()
+    # a silent device is not an error of CHK_PROTOCOL
+    assert cth.cmd_chk_protocol() == (False, 0)
+    assert 0.2 <= time.monotonic() - start < 0.6
+    with pytest.raises(exceptions.ComuError):
+        cth.cmd_chk_device()
+    ser.close()
+
+
+def test_command_timeout_overrides_timeout():
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB?latency=FLASH_ERASE_ALL:0.3', baudrate=921600, timeout=1)
+    cth = new_cth(ser)
+    cth.timeout = 0.1
+    assert cth.cmd_chk_protocol()[0]
+    assert cth.cmd_flash_erase_all()
+
+    cth.cmd_timeout[CMD.FLASH_ERASE_ALL] = 0.1
+    with pytest.raises(exceptions.ComuError):
+        cth.cmd_flash_erase_all()
+    ser.close()
+
+
+def test_corrupted_response_is_an_error(port):
+    port.bootloader.error_rate = 1
+    cth = new_cth(port)
+    cth.retries = 0
+    with pytest.raises(exceptions.ComuError):
+        cth.cmd_chk_device()
+
+
+def test_packets_are_queued_while_writing(port):
+    transport = loader.SerialTransport.of(port)
+    assert loader.SerialTransport.of(port) is transport
+    sent = time.monotonic()
+    for cmd in (CMD.CHK_PROTOCOL, CMD.CHK_DEVICE, CMD.FLASH_GET_PGSZ):
+        transport.write(bytes(bootprotocol.encode(cmd, b'')))
+    # received by the thread, not when they are taken
+    time.sleep(0.1)
+    packets = [transport.get_packet(0) for _ in range(3)]
+    assert [p.command for p, _ in packets] == [CMD.CHK_PROTOCOL, CMD.CHK_DEVICE, CMD.FLASH_GET_PGSZ]
+    assert all(sent < t < sent + 0.1 for _, t in packets)
+    with pytest.raises(exceptions.ComuError):
+        transport.get_packet(0.05)
+    transport.close()
+
+
+def test_get_packet_fails_when_port_is_closed(port):
+    transport = loader.SerialTransport.of(port)
+    threading.Timer(0.05, port.close).start()
+    start = time.monotonic()
+    with pytest.raises(exceptions.ComuError):
+        transport.get_packet(5)
+    assert time.monotonic() - start < 1
+    assert not transport.is_alive
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+import serial
+
+from serprog import business, loader, metrics
+from serprog.bootprotocol import CMD
+
+DATA = {0x10000: bytes(range(256)) * 16}
+PORT = 'sim://ATSAME54_DEVB'
+
+
+def test_retries_and_errors_are_counted():
+    ser = serial.serial_for_url(PORT + '?seed=1&error_rate=0.3', baudrate=921600, timeout=1)
+    cth = loader.CommandTrnasHandler(ser)
+    cth.timeout = 0.1
+    cth.backoff = 0.001
+    for _ in range(20):
+        assert cth.cmd_chk_device()[0]
+    ser.close()
+
+    m = cth.metrics[CMD.CHK_DEVICE]
+    assert cth.retry_count > 0
+    assert m.retries == cth.retry_count
+    assert m.sent == 20 + m.retries
+    assert m.checksum_errors + m.timeouts == m.retries
+    assert sum(m.buckets) == m.received - m.checksum_errors
+    assert m.as_dict()['buckets']['+Inf'] == sum(m.buckets)
+    assert m.tx_bytes > 0 and m.rx_bytes > 0
+
+
+def test_merge():
+    a, b = metrics.Metrics(), metrics.Metrics()
+    a.on_sent(CMD.FLASH_WRITE, 530)
+    a.on_received(CMD.FLASH_WRITE, 9, 0.003, 0.002)
+    b.on_sent(CMD.FLASH_WRITE, 530)
+    b.on_timeout(CMD.FLASH_WRITE)
+    b.on_retry(CMD.FLASH_WRITE)
+    b.on_sent(CMD.CHK_DEVICE, 8)
+    a.merge(b)
+    m = a.as_dict()
+    assert m['FLASH_WRITE']['sent'] == 2
+    assert m['FLASH_WRITE']['tx_bytes'] == 1060
+    assert m['FLASH_WRITE']['timeouts'] == 1
+    assert m['FLASH_WRITE']['buckets']['0.002'] == 0
+    assert m['FLASH_WRITE']['buckets']['0.005'] == 1
+    assert m['CHK_DEVICE']['sent'] == 1
+
+
+def test_prometheus_labels_are_escaped():
+    m = metrics.Metrics()
+    m.on_sent(0xEE, 8)
+    text = metrics.to_prometheus([({'port': 'C:\\"x"'}, m)])
+    assert 'serprog_command_sent_total{port="C:\\\\\\"x\\"",command="0xEE"} 1' in text.splitlines()
+
+
+@pytest.fixture
+def prog_metrics(home, cli_args, write_ihex, tmp_path):
+    filename = write_ihex(DATA)
+    def prog(name):
+        output = str(tmp_path / name)
+        business.do_prog(cli_args('prog', '-d', 'ATSAME54_DEVB', '-p', PORT, '-b', '921600',
+                                  '-f', filename, '--metrics', output))
+        with open(output) as f:
+            return f.read()
+    return prog
+
+
+def test_prog_writes_json(prog_metrics):
+    runs = json.loads(prog_metrics('metrics.json'))['runs']
+    assert len(runs) == 1
+    run = runs[0]
+    assert (run['port'], run['device'], run['baudrate']) == (PORT, 'ATSAME54_DEVB', 921600)
+    write = run['commands']['FLASH_WRITE']
+    assert write['sent'] == write['received'] == 8
+    assert write['tx_bytes'] > 8 * 512
+    assert write['buckets']['+Inf'] == 8
+    assert write['retries'] == write['timeouts'] == write['checksum_errors'] == 0
+    assert run['commands']['CHK_DEVICE']['sent'] >= 1
+
+
+def test_prog_writes_prometheus(prog_metrics):
+    lines = prog_metrics('metrics.prom').splitlines()
+    series = '{port="sim://ATSAME54_DEVB",device="ATSAME54_DEVB",baudrate="921600",command="FLASH_WRITE"'
+    assert '# TYPE serprog_command_sent_total counter' in lines
+    assert '# TYPE serprog_command_latency_seconds histogram' in lines
+    assert f'serprog_command_sent_total{series}}} 8' in lines
+    assert f'serprog_command_latency_seconds_bucket{series},le="+Inf"}} 8' in lines
+    assert f'serprog_command_latency_seconds_count{series}}} 8' in lines
+    assert not any(line.startswith('serprog') and len(line.split(' ')) != 2 for line in lines)
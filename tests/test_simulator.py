@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+import pytest
+import serial
+
+from serprog import bootprotocol, loader, simulator
+from serprog.bootprotocol import CMD
+
+DATA = {0x10000: bytes(range(256)) * 16}
+
+
+def frame(cmd, data=b''):
+    return bytes(bootprotocol.encode(cmd, data))
+
+
+def test_parse_latency():
+    assert simulator.parse_latency('flash_write:0.1,FLASH_ERASE_ALL=2,') == {
+        CMD.FLASH_WRITE: 0.1, CMD.FLASH_ERASE_ALL: 2.0}
+    for text in ('FLASH_WRITE', 'NO_SUCH_CMD:1', 'FLASH_WRITE:fast'):
+        with pytest.raises(ValueError):
+            simulator.parse_latency(text)
+
+
+@pytest.mark.parametrize('url', [
+    'sim://NO_SUCH_DEVICE',
+    'sim://ATSAME54_DEVB?speed=1',
+    'sim://ATSAME54_DEVB?error_rate=x',
+    'sim://ATSAME54_DEVB?latency=WRITE:1',
+])
+def test_bad_url(url):
+    with pytest.raises(serial.SerialException):
+        serial.serial_for_url(url, baudrate=115200)
+
+
+def test_url_options():
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB?latency=FLASH_ERASE_ALL:0.2&drop_rate=0.5&error_rate=0.1&'
+                                'max_baud=460800&seed=3', baudrate=115200, timeout=1)
+    bl = ser.bootloader
+    assert bl.latency[CMD.FLASH_ERASE_ALL] == 0.2
+    assert bl.latency[CMD.FLASH_WRITE] == simulator.DEFAULT_LATENCY[CMD.FLASH_WRITE]
+    assert (bl.drop_rate, bl.error_rate, bl.max_baudrate) == (0.5, 0.1, 460800)
+    ser.close()
+
+
+def test_response_time():
+    bl = simulator.Bootloader(latency={CMD.FLASH_ERASE_ALL: 0.5})
+    request = frame(CMD.FLASH_ERASE_ALL)
+    [(t, response)] = bl.feed(request, 100.0, 10000)
+    assert response == frame(CMD.FLASH_ERASE_ALL, b'\x00')
+    # request and response on the wire, and the erase
+    assert t == pytest.approx(100.0 + (len(request) + len(response)) / 1000 + 0.5)
+
+    # the device is busy with the erase before the next command
+    [(t2, _)] = bl.feed(frame(CMD.CHK_DEVICE), 100.0, None)
+    assert t2 == pytest.approx(t - len(response) / 1000)
+
+
+def test_bad_requests():
+    bl = simulator.Bootloader()
+    request = bytearray(frame(CMD.CHK_DEVICE))
+    request[-1] ^= 0xFF
+    assert bl.feed(bytes(request), 0.0) == [(0.0, frame(CMD.CHK_DEVICE, b'\x01'))]
+    assert bl.counts[CMD.CHK_DEVICE] == 0
+
+    # outside the application area
+    page = (0x8000).to_bytes(4, 'little') + b'\x00' * 512
+    assert bl.handle(CMD.FLASH_WRITE, page) == b'\x01'
+    assert bl.handle(CMD.FLASH_WRITE, b'\x00') == b'\x01'
+    assert bl.handle(0xEE, b'') == b'\x01'
+
+
+def test_flash_write_only_clears_bits():
+    bl = simulator.Bootloader()
+    address = (0x10000).to_bytes(4, 'little')
+    assert bl.handle(CMD.FLASH_WRITE, address + b'\x0F\xF0') == b'\x00'
+    assert bl.handle(CMD.FLASH_WRITE, address + b'\x3C\x3C') == b'\x00'
+    assert bl.flash[0x10000:0x10002] == b'\x0C\x30'
+    assert bl.handle(CMD.FLASH_VERIFY, address + b'\x3C\x3C') == b'\x01'
+    assert bl.handle(CMD.FLASH_ERASE_SECTOR, (8).to_bytes(2, 'little')) == b'\x00' + address
+    assert bl.flash[0x10000:0x10002] == b'\xFF\xFF'
+
+
+def test_baudrate_above_max_corrupts():
+    bl = simulator.Bootloader(max_baudrate=460800)
+    [(_, response)] = bl.feed(frame(CMD.CHK_DEVICE), 0.0, 921600)
+    assert bootprotocol.Decoder().feed(response)[0].error
+    [(_, response)] = bl.feed(frame(CMD.CHK_DEVICE), 0.0, 460800)
+    assert not bootprotocol.Decoder().feed(response)[0].error
+
+
+def test_latency_option_delays_response():
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB?latency=FLASH_ERASE_ALL:0.2', baudrate=921600, timeout=1)
+    cth = loader.CommandTrnasHandler(ser)
+    start = time.monotonic()
+    assert cth.cmd_flash_erase_all()
+    assert time.monotonic() - start >= 0.2
+    ser.close()
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='pseudo terminals are POSIX only')
+def test_pty_server(write_ihex):
+    filename = write_ihex(DATA)
+    server = simulator.PtyServer(simulator.Bootloader(), baudrate=921600).start()
+    try:
+        ser = serial.Serial(server.path, 921600, timeout=1)
+        l = loader.Loader(ser, device_type=1, is_flash_prog=True, flash_file=filename)
+        while not l.is_finished:
+            l.do_step()
+        ser.close()
+    finally:
+        server.close()
+    assert server.bootloader.flash[0x10000:0x11000] == DATA[0x10000]
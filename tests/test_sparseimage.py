@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from serprog import exceptions, ihex
+from serprog.sparseimage import SparseImage
+
+
+def segments(img):
+    return [(s['address'], bytes(s['data'])) for s in img]
+
+
+def test_records_in_order_are_one_segment():
+    img = SparseImage()
+    img.update([(0x100, b'\x01' * 16), (0x110, b'\x02' * 16), (0x200, b'\x03' * 4)])
+    assert segments(img) == [(0x100, b'\x01' * 16 + b'\x02' * 16), (0x200, b'\x03' * 4)]
+    assert img.size == 36
+    assert len(img) == 2
+
+
+def test_records_out_of_order_are_merged():
+    img = SparseImage()
+    img.update([(0x120, b'\x03' * 16), (0x100, b'\x01' * 16), (0x300, b'\x04'), (0x110, b'\x02' * 16)])
+    assert segments(img) == [(0x100, b'\x01' * 16 + b'\x02' * 16 + b'\x03' * 16), (0x300, b'\x04')]
+
+
+@pytest.mark.parametrize('records', [
+    [(0x100, b'\x01' * 16), (0x10F, b'\x02' * 2)],
+    [(0x200, b'\x01' * 16), (0x100, b'\x02' * 16), (0x108, b'\x03')],
+    [(0x200, b'\x01' * 16), (0x1F8, b'\x02' * 16)],
+])
+def test_overlap(records):
+    img = SparseImage()
+    with pytest.raises(exceptions.ImageOverlapError):
+        img.update(records)
+
+
+def test_read_fills_gaps():
+    img = SparseImage.from_sections([{'address': 0x10, 'data': b'\x01\x02'},
+                                     {'address': 0x14, 'data': b'\x03'}])
+    assert img.read(0x0E, 8, b'\x00') == b'\x00\x00\x01\x02\x00\x00\x03\x00'
+
+
+def test_pages_share_a_buffer_for_adjacent_data():
+    img = SparseImage()
+    img.update([(0x0F0, b'\x01' * 0x20), (0x180, b'\x02' * 0x10), (0x400, b'\x03')])
+    pages = list(img.pages(0x100))
+    assert [p['address'] for p in pages] == [0x000, 0x100, 0x400]
+    assert bytes(pages[0]['data']) == b'\xFF' * 0xF0 + b'\x01' * 0x10
+    assert bytes(pages[1]['data']) == b'\x01' * 0x10 + b'\xFF' * 0x70 + b'\x02' * 0x10 + b'\xFF' * 0x70
+    assert pages[0]['data'].obj is pages[1]['data'].obj
+    assert pages[0]['data'].readonly
+    assert [(a, bytes(d)) for a, d in img.runs(0x100)] == \
+        [(0x000, b''.join([bytes(p['data']) for p in pages[:2]])), (0x400, bytes(pages[2]['data']))]
+
+
+def test_ihex_overlap_is_a_format_error(write_ihex):
+    filename = write_ihex([(0x100, b'\x01' * 16), (0x108, b'\x02' * 16)])
+    with pytest.raises(exceptions.IhexFormatError) as e:
+        ihex.parse(filename)
+    assert e.value.lineno == 0
+    assert isinstance(e.value.__cause__, exceptions.ImageOverlapError)
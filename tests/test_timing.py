@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+import serial
+
+from serprog import business, loader, timing
+from serprog.bootprotocol import CMD
+
+DATA = {0x10000: bytes(range(256)) * 16}
+
+
+def program(filename, profile, window=1):
+    ser = serial.serial_for_url('sim://ATSAME54_DEVB', baudrate=921600, timeout=1)
+    l = loader.Loader(ser, device_type=1, is_flash_prog=True, flash_file=filename,
+                      window=window, timing_profile=profile)
+    times = l.prog_times
+    while not l.is_finished:
+        l.do_step()
+    ser.close()
+    return times
+
+
+def test_measure():
+    stats = {CMD.FLASH_WRITE: [4, 0.2], CMD.FLASH_ERASE_SECTOR: [1, 0.05], CMD.CHK_DEVICE: [1, 0.01]}
+    times = timing.measure(stats, 0.5)
+    assert times['flash_page'] == pytest.approx(0.05)
+    assert times['erase_sector'] == pytest.approx(0.05)
+    assert times['overhead'] == pytest.approx(0.25)
+    assert 'verify_page' not in times
+
+    times = dict(timing.default_times(1, 921600), **times)
+    assert timing.estimate(times, flash_pages=4, erase_sectors=1) == pytest.approx(0.5)
+    assert timing.estimate(times, flash_pages=4, overhead=False) == pytest.approx(0.2)
+
+
+def test_default_times_scale_with_baudrate():
+    slow = timing.default_times(1, 115200)
+    fast = timing.default_times(1, 921600)
+    assert fast['flash_page'] < slow['flash_page']
+    assert slow['flash_page'] - fast['flash_page'] == pytest.approx(
+        timing.page_wire_time(115200) - timing.page_wire_time(921600))
+
+
+def test_profile_moving_average(tmp_path):
+    path = str(tmp_path / 'timing.json')
+    profile = timing.Profile(path)
+    assert profile.get('ATSAME54_DEVB', 921600) == {}
+
+    profile.update('ATSAME54_DEVB', 921600, 1, {'flash_page': 0.01})
+    profile.update('ATSAME54_DEVB', 921600, 1, {'flash_page': 0.02})
+    profile.update('ATSAME54_DEVB', 921600, 4, {'flash_page': 0.005})
+    assert profile.get('ATSAME54_DEVB', 921600) == {'flash_page': pytest.approx(0.013)}
+    profile.save()
+
+    profile = timing.Profile.load(path)
+    assert profile.get('ATSAME54_DEVB', 921600, 4) == {'flash_page': 0.005}
+    assert [e[:3] + (e[3]['runs'],) for e in profile.entries()] == [
+        ('ATSAME54_DEVB', 921600, 1, 2), ('ATSAME54_DEVB', 921600, 4, 1)]
+
+
+@pytest.mark.parametrize('text', ['{"ATSAME54_DEVB": ', '[]'])
+def test_broken_profile_is_empty(tmp_path, text):
+    path = tmp_path / 'timing.json'
+    path.write_text(text)
+    assert timing.Profile.load(str(path)).entries() == []
+
+
+def test_loader_updates_profile(tmp_path, write_ihex):
+    filename = write_ihex(DATA)
+    profile = timing.Profile(str(tmp_path / 'timing.json'))
+    times = program(filename, profile)
+    assert times == timing.default_times(1, 921600)
+
+    measured = profile.get('ATSAME54_DEVB', 921600)
+    assert measured['flash_page'] > 0
+    assert measured['erase_sector'] > 0
+    assert profile.entries()[0][3]['runs'] == 1
+
+    # the next programming estimates with the measured times
+    times = program(filename, profile)
+    assert times['flash_page'] == measured['flash_page']
+    assert profile.entries()[0][3]['runs'] == 2
+    # another write window is measured apart
+    assert program(filename, profile, window=4) == timing.default_times(1, 921600)
+
+
+def test_prog_saves_profile(home, cli_args, write_ihex, capsys):
+    filename = write_ihex(DATA)
+    args = cli_args('prog', '-d', 'ATSAME54_DEVB', '-p', 'sim://ATSAME54_DEVB', '-b', '921600', '-f', filename)
+    business.do_prog(args)
+    business.do_prog(args)
+
+    with open(timing.default_path()) as f:
+        assert json.load(f)['ATSAME54_DEVB']['921600/1']['runs'] == 2
+
+    capsys.readouterr()
+    business.do_print_devices(None)
+    assert 'Measured throughput:' in capsys.readouterr().out
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pytest
+
+from serprog import business, exceptions, trace
+
+DATA = {0x10000: bytes(range(256)) * 16}
+
+
+@pytest.fixture
+def recorded(home, cli_args, write_ihex, tmp_path):
+    """ Program the simulator with --trace, returns (image, trace file). """
+    def record(port='sim://ATSAME54_DEVB', baud='921600'):
+        filename = write_ihex(DATA)
+        output = str(tmp_path / 'prog.trace')
+        business.do_prog(cli_args('prog', '-d', 'ATSAME54_DEVB', '-p', port, '-b', baud,
+                                  '-f', filename, '--trace', output))
+        return filename, output
+    return record
+
+
+def test_record(recorded):
+    filename, output = recorded()
+    tr = trace.load(output)
+    assert tr.meta['baudrate'] == 921600
+    assert tr.meta['port'] == 'sim://ATSAME54_DEVB'
+    assert tr.meta['loader']['flash_file'] == os.path.abspath(filename)
+    assert tr.count(trace.TX) > 8
+    assert tr.count(trace.RX) > 0
+    assert tr.duration > 0
+
+    packets, errors, _ = trace.decode(tr)
+    assert packets == tr.count(trace.TX)
+    assert errors == 0
+
+    # a record cut off by a crash is dropped
+    with open(output, 'r+b') as f:
+        f.truncate(os.path.getsize(output) - 1)
+    assert len(trace.load(output).records) == len(tr.records) - 1
+
+
+@pytest.mark.parametrize('fast', [True, False])
+def test_replay(recorded, cli_args, tmp_path, capsys, fast):
+    _, output = recorded()
+    metrics_file = str(tmp_path / 'replay.json')
+    argv = ['replay', '-i', output, '--metrics', metrics_file] + (['--fast'] if fast else [])
+    capsys.readouterr()
+    business.do_replay(cli_args(*argv))
+    out = capsys.readouterr().out
+    assert 'Replayed in' in out
+    assert 'WARNING' not in out
+
+    with open(metrics_file) as f:
+        run = json.load(f)['runs'][0]
+    assert run['port'] == 'sim://ATSAME54_DEVB'
+    assert run['commands']['FLASH_WRITE']['received'] == 8
+
+
+def test_replay_auto_baud(recorded, cli_args, capsys):
+    _, output = recorded('sim://ATSAME54_DEVB?max_baud=460800', 'auto')
+    tr = trace.load(output)
+    assert (trace.BAUD, (460800).to_bytes(4, 'little')) in [(r[0], r[2]) for r in tr.records]
+
+    capsys.readouterr()
+    business.do_replay(cli_args('replay', '-i', output, '--fast'))
+    assert 'WARNING' not in capsys.readouterr().out
+
+
+def test_replay_of_changed_image(recorded, cli_args, write_ihex, capsys):
+    _, output = recorded()
+    write_ihex({0x10000: b'\x00' * 0x1000})
+    capsys.readouterr()
+    business.do_replay(cli_args('replay', '-i', output, '--fast'))
+    assert 'writes differ from the trace' in capsys.readouterr().out
+
+
+def test_not_a_trace(tmp_path, cli_args, write_ihex):
+    filename = write_ihex(DATA)
+    with pytest.raises(exceptions.TraceFormatError):
+        trace.load(filename)
+    with pytest.raises(SystemExit):
+        business.do_replay(cli_args('replay', '-i', filename))
+    cli_args('replay', '-i', str(tmp_path / 'missing.trace'), valid=False)
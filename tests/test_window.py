@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import serial
+
+from serprog import loader
+from serprog.bootprotocol import CMD
+
+
+@pytest.fixture
+def flash_file(tmp_path):
+    data = bytes(i * 7 % 251 for i in range(0x8000))
+    path = tmp_path / 'app.bin'
+    path.write_bytes(data)
+    return str(path), data
+
+
+def new_loader(url, filename, window):
+    ser = serial.serial_for_url(url, baudrate=921600, timeout=1)
+    l = loader.Loader(ser, device_type=1, is_flash_prog=True, flash_file=filename,
+                      base_address=0x10000, window=window)
+    l._cth.timeout = 0.05
+    l._cth.backoff = 0.001
+    return ser, l
+
+
+def program(l):
+    while not l.is_finished:
+        l.do_step()
+
+
+def test_window_keeps_writes_outstanding(flash_file):
+    filename, data = flash_file
+    ser, l = new_loader('sim://ATSAME54_DEVB', filename, 8)
+    program(l)
+    bl = ser.bootloader
+    assert bytes(bl.flash[0x10000:0x18000]) == data
+    # every page is written once and none verified
+    assert bl.counts[CMD.FLASH_WRITE] == 64
+    assert bl.counts[CMD.FLASH_VERIFY] == 0
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_window_resyncs_after_dropped_responses(flash_file, seed):
+    filename, data = flash_file
+    ser, l = new_loader(f'sim://ATSAME54_DEVB?seed={seed}', filename, 8)
+    bl = ser.bootloader
+    bl.drop_rate = 0.05
+    bl.error_rate = 0.05
+    program(l)
+    bl.drop_rate = bl.error_rate = 0
+    assert bytes(bl.flash[0x10000:0x18000]) == data
+    assert bl.counts[CMD.FLASH_WRITE] > 64
+
+
+def test_negative_response_writes_page_again(flash_file):
+    filename, data = flash_file
+    ser, l = new_loader('sim://ATSAME54_DEVB', filename, 8)
+    bl = ser.bootloader
+    handle = bl.handle
+    refused = []
+    def hooked(cmd, payload):
+        if cmd == CMD.FLASH_WRITE and bl.counts[cmd] == 5:
+            refused.append(int.from_bytes(payload[:4], 'little'))
+            return b'\x01'
+        return handle(cmd, payload)
+    bl.handle = hooked
+    program(l)
+    assert refused == [0x10800]
+    assert bytes(bl.flash[0x10000:0x18000]) == data